@@ -1,67 +1,115 @@
+from collections import OrderedDict
 import numpy as np
 import pyvisa
+from StateCache import StateCache
+from Waveform import to_dac, repeat_period, choose_npts, two_tone
 
 class AWG_33220A:
+    MAX_POINTS = 65536 # Arbitrary waveform memory, in points.
+    NV_SLOTS = 4 # Number of user waveforms the instrument keeps in non-volatile memory.
+
     def __init__(self, rm: pyvisa.ResourceManager, id:str) -> None:
         self.awg = rm.open_resource(id)
-        self.awg.write("VOLT:UNIT VPP")
+        self.state = StateCache(self.awg) # Skips settings writes that would change nothing.
+        self.state.write("VOLT:UNIT", "VPP", "VOLT:UNIT VPP")
         self.awg.timeout = 10000
+        # Two-tone waveforms stored in non-volatile memory by load_two_tone, in least to most
+        # recently used order, mapping (freq1, freq2, npts, tol) to the waveform name.
+        self.stored = OrderedDict()
     
-    def calc_time(self, freq1:int, freq2:int) -> float:
+    def calc_time(self, freq1:float, freq2:float, tol=1e-6) -> float:
         '''Returns the time period necessary for the sum of the frequencies to complete 
         one repeatable oscillation.\n
         Arguments:
             freq1: The frequency (in Hz) of the first sine wave.
             freq2: The frequency (in Hz) of the second sine wave.
+            tol (optional): The relative error allowed on the frequency ratio so that the \
+                period is as short as possible. Defaults to 1e-6.
         Return:
             (float): The time (in s) corresponding to one period.
         '''
-        (m1, m2) = (float(freq1)/freq2).as_integer_ratio()
-        return m1 / freq1
+        return repeat_period(freq1, freq2, tol)
 
-    def calc_points(self, freq1, freq2):
+    def calc_points(self, freq1, freq2, tol=1e-6, pts_per_cycle=None):
         '''Calculates the amplitudes and the required frequency for periodicity \
         given two frequencies.\n
         This method also sets two state variables, self.pts, which contains the amplitudes, \
-        and self.freq which contains the frequency of oscillation of the arbitrary waveform.\n
+        and self.freq which contains the frequency of oscillation of the arbitrary waveform. \
+        Results are cached, so repeated calls with the same arguments do not resynthesize.\n
         Arguments:
             freq1: The frequency (in Hz) of the first sine wave.
             freq2: The frequency (in Hz) of the second sine wave.
+            tol (optional): Relative tolerance for the repeat period, see calc_time.
+            pts_per_cycle (optional): Points per cycle of the faster tone. Defaults to using \
+                the full waveform memory (MAX_POINTS).
         Return:
             (float tuple): First argument is the set of amplitude points, second is \
             the frequency of the arbitrary waveform.
         '''
-        t_end = self.calc_time(freq1, freq2)
-        t = np.linspace(0, t_end, 65536)
-        self.pts = 0.5*(np.sin(2*np.pi*freq1*t)+np.sin(2*np.pi*freq2*t))
-        self.freq = 1/t_end
+        npts = choose_npts(freq1, freq2, self.MAX_POINTS, tol, pts_per_cycle)
+        (self.pts, self.freq) = two_tone(float(freq1), float(freq2), npts, tol)
         return (self.pts, self.freq)
     
-    def write_pts(self, pts=None, name="LASER_REF"):
+    def write_pts(self, pts=None, name="LASER_REF", binary=True):
         '''Writes the data points to the AWG's non-volatile memory under the provided name. \n
         Arguments:
-            pts (optional): The points to load into memory. If not provided, the system will use \
-                the points stored as an instance variable.
+            pts (optional): The points to load into memory, normalized to [-1, 1]. If not provided, \
+                the system will use the points stored as an instance variable.
             name (optional): The name of the waveform. Defaults to 'LASER_REF' if no name \
                 is provided.
+            binary (optional): If True (default), the points are quantized to the 14-bit DAC codes \
+                (-8191 to +8191) and sent as one IEEE-488.2 binary block with DATA:DAC. This is \
+                about 8 times fewer bytes than ASCII and much faster to encode. If False, the points \
+                are sent as comma-separated ASCII with DATA.
         '''
-        if pts == None:
+        if pts is None:
             pts = self.pts
-        pass
-        pts_str = ', '.join(map(str, pts))
-        self.awg.write("DATA VOLATILE, " + pts_str)
+        if binary:
+            dac = to_dac(pts, -8191, 8191)
+            # The block is sent big-endian, so the byte order is set rather than assumed.
+            self.state.write("FORM:BORD", "NORM", "FORM:BORD NORM")
+            self.awg.write_binary_values("DATA:DAC VOLATILE, ", dac, datatype='h', is_big_endian=True)
+        else:
+            pts_str = ', '.join(map(str, pts))
+            self.awg.write("DATA VOLATILE, " + pts_str)
         self.awg.write("DATA:COPY " + name)
+        self.state.invalidate("FUNC:USER") # The selected waveform may have been overwritten.
+
+    def load_two_tone(self, freq1, freq2, tol=1e-6, pts_per_cycle=None):
+        '''Makes the two-tone waveform for freq1 and freq2 the active user waveform. \
+        The waveforms are kept in the NV_SLOTS non-volatile slots (named TWOTONE1 to TWOTONE4, \
+        least recently used slot overwritten first), so going back to a recent pair of \
+        frequencies skips both the synthesis and the upload.\n
+        Arguments:
+            freq1, freq2, tol, pts_per_cycle: As for calc_points.
+        Return:
+            (float): The frequency of the arbitrary waveform, also stored in self.freq.
+        '''
+        pts, freq = self.calc_points(freq1, freq2, tol, pts_per_cycle)
+        key = (float(freq1), float(freq2), len(pts), tol)
+        if key in self.stored:
+            self.stored.move_to_end(key)
+        else:
+            if len(self.stored) < self.NV_SLOTS:
+                name = "TWOTONE" + str(len(self.stored) + 1)
+            else:
+                name = self.stored.popitem(last=False)[1]
+            self.write_pts(pts, name)
+            self.stored[key] = name
+        self.state.write("FUNC:USER", self.stored[key], "FUNC:USER " + self.stored[key])
+        return freq
 
     def output_waveform(self, name="LASER_REF"):
-        self.awg.write("FUNC:USER " + name)
-        self.awg.write("FUNC USER")
-        self.awg.write("OUTPUT ON")
+        self.state.write("FUNC:USER", name, "FUNC:USER " + name)
+        self.state.write("FUNC", "USER", "FUNC USER")
+        self.state.write("OUTPUT", "ON", "OUTPUT ON")
 
     def stop_output(self):
-        self.awg.write("OUTPUT OFF")
+        self.state.write("OUTPUT", "OFF", "OUTPUT OFF")
 
     def set_wave_params(self, voltage, freq=None, offset=0, fUnits="Hz"):
-        '''Set all the parameters at once in a single method.
+        '''Set all the parameters at once in a single method. Parameters that did not change
+        since they were last set are not rewritten.
         '''
         if freq == None:
             freq = self.freq
@@ -72,10 +120,10 @@ class AWG_33220A:
     def set_voltage(self, voltage):
         '''Set the voltage of the AWG in V_pp.
         '''
-        self.awg.write("VOLT " + str(voltage) + " VPP")
+        self.state.write("VOLT", voltage, "VOLT " + str(voltage) + " VPP")
     
     def get_voltage(self):
-        return self.query_ascii_values("VOLT?")
+        return self.awg.query_ascii_values("VOLT?")
     
     def set_freq(self, freq, units="Hz"):
         '''Sets the frequency of oscillation for the waveform. Default units are Hz.
@@ -83,18 +131,24 @@ class AWG_33220A:
             freq: The frequency of oscillation for the waveform.
             units: The units for frequency. Can be 'Hz', 'KHz', or 'MHz'. 'Hz' is default.
         '''
-        self.awg.write("FREQ " + str(freq) + " " + units)
+        self.state.write("FREQ", (freq, units), "FREQ " + str(freq) + " " + units)
     
     def get_freq(self):
-        self.awg.query_ascii_values("FREQ?")
+        return self.awg.query_ascii_values("FREQ?")
 
     def set_volt_offset(self, offset=0):
         '''Define a voltage offset in volts. Default is 0.
         '''
-        self.awg.write("VOLT:OFFSET " + str(offset))
+        self.state.write("VOLT:OFFSET", offset, "VOLT:OFFSET " + str(offset))
     
     def get_volt_offset(self):
         return self.awg.query_ascii_values("VOLT:OFFSET?")
 
+    def reset(self):
+        '''Resets the AWG to its default settings (*RST) and clears the settings cache.'''
+        self.awg.write("*RST")
+        self.state.invalidate()
+        self.state.write("VOLT:UNIT", "VPP", "VOLT:UNIT VPP")
+
     def close(self):
         self.awg.close()
@@ -1,63 +1,100 @@
 import numpy as np
 import pyvisa
+from StateCache import StateCache
+from Waveform import to_dac, repeat_period, choose_npts, two_tone
 
 class DG4000:
+    MAX_POINTS = 16384 # Arbitrary waveform memory, in points.
+    DAC16_PACKET = 16384 # Maximum number of points in one :TRACE:DATA:DAC16 packet.
+
     def __init__(self, rm: pyvisa.ResourceManager, id:str) -> None:
         self.awg = rm.open_resource(id)
-        self.awg.write(":SOURCE:VOLT:UNIT VPP")
+        self.state = StateCache(self.awg) # Skips settings writes that would change nothing.
+        self.state.write(":SOURCE:VOLT:UNIT", "VPP", ":SOURCE:VOLT:UNIT VPP")
         self.awg.timeout = 10000
+        self.loaded = None # (freq1, freq2, npts, tol) of the two-tone waveform in volatile memory.
     
-    def calc_time(self, freq1:int, freq2:int) -> float:
+    def calc_time(self, freq1:float, freq2:float, tol=1e-6) -> float:
         '''Returns the time period necessary for the sum of the frequencies to complete 
         one repeatable oscillation.\n
         Arguments:
             freq1: The frequency (in Hz) of the first sine wave.
             freq2: The frequency (in Hz) of the second sine wave.
+            tol (optional): The relative error allowed on the frequency ratio so that the \
+                period is as short as possible. Defaults to 1e-6.
         Return:
             (float): The time (in s) corresponding to one period.
         '''
-        (m1, m2) = (float(freq1)/freq2).as_integer_ratio()
-        return m1 / freq1
+        return repeat_period(freq1, freq2, tol)
 
-    def calc_points(self, freq1, freq2):
+    def calc_points(self, freq1, freq2, tol=1e-6, pts_per_cycle=None):
         '''Calculates the amplitudes and the required frequency for periodicity \
         given two frequencies.\n
         This method also sets two state variables, self.pts, which contains the amplitudes, \
-        and self.freq which contains the frequency of oscillation of the arbitrary waveform.\n
+        and self.freq which contains the frequency of oscillation of the arbitrary waveform. \
+        Results are cached, so repeated calls with the same arguments do not resynthesize.\n
         Arguments:
             freq1: The frequency (in Hz) of the first sine wave.
             freq2: The frequency (in Hz) of the second sine wave.
+            tol (optional): Relative tolerance for the repeat period, see calc_time.
+            pts_per_cycle (optional): Points per cycle of the faster tone. Defaults to using \
+                the full waveform memory (MAX_POINTS).
         Return:
             (float tuple): First argument is the set of amplitude points, second is \
             the frequency of the arbitrary waveform.
         '''
-        t_end = self.calc_time(freq1, freq2)
-        t = np.linspace(0, t_end, 5000)
-        self.pts = 0.5*(np.sin(2*np.pi*freq1*t)+np.sin(2*np.pi*freq2*t))
-        self.freq = 1/t_end
+        npts = choose_npts(freq1, freq2, self.MAX_POINTS, tol, pts_per_cycle)
+        (self.pts, self.freq) = two_tone(float(freq1), float(freq2), npts, tol)
         return (self.pts, self.freq)
     
-    def write_pts(self, pts=[]):
-        '''Writes the data points to the AWG's non-volatile memory under the provided name. \n
+    def write_pts(self, pts=[], binary=True):
+        '''Writes the data points to the AWG's volatile memory. \n
         Arguments:
-            pts (optional): The points to load into memory. If not provided, the system will use \
-                the points stored as an instance variable.
+            pts (optional): The points to load into memory, normalized to [-1, 1]. If not provided, \
+                the system will use the points stored as an instance variable.
+            binary (optional): If True (default), the points are quantized to the 14-bit DAC codes \
+                (0 to 16383) and sent as IEEE-488.2 binary blocks with :TRACE:DATA:DAC16, in \
+                packets of at most 16384 points. If False, the points are sent as comma-separated \
+                ASCII with :TRACE:DATA:DATA.
         '''
         if len(pts) == 0:
             pts = self.pts
-        pass
-        pts_str = ', '.join(map(str, pts))
-        self.awg.write(":TRACE:DATA:DATA VOLATILE, " + pts_str)
+        self.loaded = None
+        if binary:
+            dac = to_dac(pts, 0, 16383, '<u2')
+            for i in range(0, len(dac), self.DAC16_PACKET):
+                flag = "END" if i + self.DAC16_PACKET >= len(dac) else "CON"
+                self.awg.write_binary_values(":TRACE:DATA:DAC16 VOLATILE," + flag + ",",
+                                             dac[i:i + self.DAC16_PACKET], datatype='H', is_big_endian=False)
+        else:
+            pts_str = ', '.join(map(str, pts))
+            self.awg.write(":TRACE:DATA:DATA VOLATILE, " + pts_str)
+
+    def load_two_tone(self, freq1, freq2, tol=1e-6, pts_per_cycle=None):
+        '''Loads the two-tone waveform for freq1 and freq2 into volatile memory, unless it is \
+        already there, in which case both the synthesis and the upload are skipped.\n
+        Arguments:
+            freq1, freq2, tol, pts_per_cycle: As for calc_points.
+        Return:
+            (float): The frequency of the arbitrary waveform, also stored in self.freq.
+        '''
+        pts, freq = self.calc_points(freq1, freq2, tol, pts_per_cycle)
+        key = (float(freq1), float(freq2), len(pts), tol)
+        if key != self.loaded:
+            self.write_pts(pts)
+            self.loaded = key
+        return freq
 
     def output_waveform(self):
         self.awg.write(":SOURCE:APPLY:USER")
-        self.awg.write(":OUTPUT ON")
+        self.state.write(":OUTPUT", "ON", ":OUTPUT ON")
 
     def stop_output(self):
-        self.awg.write(":OUTPUT OFF")
+        self.state.write(":OUTPUT", "OFF", ":OUTPUT OFF")
 
     def set_wave_params(self, voltage, freq=None, offset=0, fUnits="Hz"):
-        '''Set all the parameters at once in a single method.
+        '''Set all the parameters at once in a single method. Parameters that did not change
+        since they were last set are not rewritten.
         '''
         if freq == None:
             freq = self.freq
@@ -68,28 +105,37 @@ class DG4000:
     def set_voltage(self, voltage):
         '''Set the voltage of the AWG in V_pp.
         '''
-        self.awg.write(":VOLT " + str(voltage))
+        self.state.write(":VOLT", voltage, ":VOLT " + str(voltage))
     
     def get_voltage(self):
-        return self.query_ascii_values(":VOLT?")
+        return self.awg.query_ascii_values(":VOLT?")
     
-    def set_freq(self, freq):
+    def set_freq(self, freq, units="Hz"):
         '''Sets the frequency of oscillation for the waveform. Default units are Hz.
         Arguments:
             freq: The frequency of oscillation for the waveform.
+            units: The units for frequency. Can be 'Hz', 'KHz', or 'MHz'. 'Hz' is default.
         '''
-        self.awg.write(":FREQ " + str(freq))
+        freq = freq * {'HZ': 1, 'KHZ': 1e3, 'MHZ': 1e6}[units.upper()]
+        self.state.write(":FREQ", freq, ":FREQ " + str(freq))
     
     def get_freq(self):
-        self.awg.query_ascii_values(":FREQ?")
+        return self.awg.query_ascii_values(":FREQ?")
 
     def set_volt_offset(self, offset=0):
         '''Define a voltage offset in volts. Default is 0.
         '''
-        self.awg.write(":VOLT:OFFSET " + str(offset))
+        self.state.write(":VOLT:OFFSET", offset, ":VOLT:OFFSET " + str(offset))
     
     def get_volt_offset(self):
         return self.awg.query_ascii_values(":VOLT:OFFSET?")
 
+    def reset(self):
+        '''Resets the AWG to its default settings (*RST) and clears the settings cache.'''
+        self.awg.write("*RST")
+        self.state.invalidate()
+        self.loaded = None
+        self.state.write(":SOURCE:VOLT:UNIT", "VPP", ":SOURCE:VOLT:UNIT VPP")
+
     def close(self):
         self.awg.close()
\ No newline at end of file
@@ -0,0 +1,138 @@
+'''Pipelined acquisition for rotary stage scans. Each instrument gets its own worker thread, and
+jobs are chained through futures so that only real dependencies serialize the run: the stage has
+to settle before a sweep starts, but the OSA readout and the file write for one position can
+overlap the move to the next one.'''
+
+import functools
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class InstrumentWorker:
+    '''Runs the jobs for one instrument (or the disk) on a single thread, in submission order.'''
+
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    def submit(self, fn, *args, after=()) -> Future:
+        '''Queues fn(*args) on this worker.\n
+        Arguments:
+            - fn: The callable to run.
+            - args: Its arguments. Any `Future` is replaced by its result before the call.
+            - after: Futures that must complete before fn is run. If one of them failed, fn is
+                skipped and its future carries the same exception.
+        Returns:
+            (Future): The future of the result of fn.
+        '''
+        def job():
+            for dep in after:
+                dep.result()
+            return fn(*[a.result() if isinstance(a, Future) else a for a in args])
+        return self.executor.submit(job)
+
+    def shutdown(self, wait=True, cancel=False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel)
+
+
+class AcquisitionPipeline:
+    '''Schedules stage moves, power readings, OSA sweeps and dataset writes across workers.\n
+    For every position the dependencies are:
+        move N        after the light is no longer needed at position N-1
+        start power N after move N
+        sweep N       after move N (runs concurrently with the start power reading)
+        end power N   after the last sub-sweep of sweep N has finished
+        write N       after the sweep N readout and both power readings
+    '''
+
+    def __init__(self, stage, power_meter, sweep_fn, sink, settle_time=0.0, max_in_flight=2) -> None:
+        '''Arguments:
+            - stage: A `RotaryStage`, or any object with `move_to_pos(pos)`. If move_to_pos returns
+                the position reached, it is passed on to the sink as the measured angle.
+            - power_meter: A `PowerMeter`, or any object with `read_pow()`.
+            - sweep_fn: Called as sweep_fn(sweep, release) on the OSA worker and returns the data.
+                It must call release() as soon as the last sweep has finished and only the trace
+                readout remains, so the stage can move on during the readout. If it never calls
+                release, the stage waits for the whole function.
+            - sink: Called as sink(data, startPow, endPow, pos, sweep, angle) on the writer worker,
+                where pos is the commanded position and angle the measured one.
+            - settle_time [`float`]: Seconds to wait after each move before sweeping.
+            - max_in_flight [`int`]: Maximum number of positions that may be in progress at once.
+        '''
+        self.stage = stage
+        self.power_meter = power_meter
+        self.sweep_fn = sweep_fn
+        self.sink = sink
+        self.settle_time = settle_time
+        self.max_in_flight = max_in_flight
+        self.position_times = []
+        self._completed = []
+
+    def _move(self, pos):
+        angle = self.stage.move_to_pos(pos)
+        if self.settle_time > 0:
+            time.sleep(self.settle_time)
+        return pos if angle is None else angle
+
+    def _sweep(self, sweep, released:Future):
+        def release():
+            if not released.done():
+                released.set_result(None)
+        return self.sweep_fn(sweep, release)
+
+    @staticmethod
+    def _link_release(data:Future, released:Future):
+        '''Makes sure released completes even if the sweep job fails, is cancelled or never
+        calls release, so that the jobs waiting on it cannot hang.'''
+        def done(f):
+            if released.done():
+                return
+            if f.cancelled():
+                released.cancel()
+            elif f.exception() is not None:
+                released.set_exception(f.exception())
+            else:
+                released.set_result(None)
+        data.add_done_callback(done)
+
+    def run(self, positions, sweeps):
+        '''Acquires one sweep per position.\n
+        Arguments:
+            - positions: The stage positions in degrees.
+            - sweeps: The sweep configuration for each position, passed to sweep_fn.
+        Returns:
+            (list): The return values of the sink for each position.
+        Raises:
+            The first exception raised by any job. Pending jobs are cancelled.
+        '''
+        workers = {name: InstrumentWorker(name) for name in ('stage', 'power', 'osa', 'writer')}
+        writes = []
+        self._completed = []
+        t_start = time.perf_counter()
+        light_free = None # Future that completes when the stage may leave the previous position.
+        try:
+            for pos, sweep in zip(positions, sweeps):
+                if len(writes) >= self.max_in_flight:
+                    writes[-self.max_in_flight].result()
+                moved = workers['stage'].submit(self._move, pos, after=[light_free] if light_free else ())
+                start_pow = workers['power'].submit(self.power_meter.read_pow, after=[moved])
+                released = Future()
+                data = workers['osa'].submit(functools.partial(self._sweep, sweep, released), after=[moved])
+                self._link_release(data, released)
+                end_pow = workers['power'].submit(self.power_meter.read_pow, after=[released])
+                write = workers['writer'].submit(self.sink, data, start_pow, end_pow, pos, sweep, moved)
+                write.add_done_callback(lambda f: self._completed.append(time.perf_counter()))
+                writes.append(write)
+                light_free = end_pow
+            results = [w.result() for w in writes]
+        except BaseException:
+            for worker in workers.values():
+                worker.shutdown(wait=False, cancel=True)
+            for worker in workers.values():
+                worker.shutdown()
+            raise
+        for worker in workers.values():
+            worker.shutdown()
+        # Wall time between consecutive completed positions.
+        times = [t_start] + sorted(self._completed)
+        self.position_times = [b - a for a, b in zip(times, times[1:])]
+        return results
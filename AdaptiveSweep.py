@@ -0,0 +1,214 @@
+'''Adaptive OSA sweeps that only spend high-sensitivity sweep time around spectral features.\n
+A fast, low-sensitivity survey of the whole band is run first. The regions where the survey rises
+above the noise floor by more than a threshold are then swept again at high sensitivity over
+narrow spans, and the refined segments replace the matching parts of the survey in the returned
+trace. Regions are found on the nominal wavelength grid of the survey config, so the result does
+not depend on the unit the OSA reports x in.'''
+
+import collections
+import numpy as np
+from SweepSegments import SweepSegment, SegmentedSweep
+
+def find_regions(x, y, threshold, margin=0.0, merge_gap=0.0, min_span=0.0, bounds=None):
+    '''Finds the wavelength regions where a spectrum is above a threshold.\n
+    Arguments:
+        - x: The wavelengths in nm, sorted.
+        - y: The power in dBm at each wavelength.
+        - threshold [`float`]: The level in dBm a feature has to exceed.
+        - margin [`float`]: nm added on both sides of each region, so the flanks of a peak are kept.
+        - merge_gap [`float`]: Regions closer than this (in nm) after padding are merged into one.
+        - min_span [`float`]: Narrower regions are widened symmetrically to this span (in nm).
+        - bounds: Optional (lower, upper) limits in nm the regions are clipped to.
+    Returns:
+        (list): Sorted, non-overlapping (start, stop) tuples in nm.
+    '''
+    x = np.asarray(x)
+    above = np.asarray(y) > threshold
+    if not above.any():
+        return []
+    # Start and end index of every run of points above the threshold.
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], above.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2] - 1
+    lower, upper = bounds if bounds is not None else (x[0], x[-1])
+    regions = []
+    for i, j in zip(starts, ends):
+        start, stop = x[i] - margin, x[j] + margin
+        if stop - start < min_span:
+            center = (start + stop) / 2
+            start, stop = center - min_span / 2, center + min_span / 2
+        start, stop = max(start, lower), min(stop, upper)
+        if regions and start - regions[-1][1] <= merge_gap:
+            regions[-1] = (regions[-1][0], max(stop, regions[-1][1]))
+        else:
+            regions.append((start, stop))
+    return regions
+
+
+class AdaptiveSweep:
+    '''A survey sweep followed by high-sensitivity sweeps of the regions where features were found.
+    It has the same run/config interface as SegmentedSweep, so it can be used with sweepline and
+    the acquisition pipeline.\n
+    With reuse=True the feature map of the previous run (usually the previous stage angle) is kept:
+    the survey is skipped and only the known regions are refined, while the rest of the returned
+    trace comes from the most recent survey. A new survey is taken every survey_every runs, and as
+    soon as a feature reaches the edge of a refined region, which means that it has moved. A map
+    without features is not reused: the survey is then the whole measurement and is taken every run.
+    '''
+
+    def __init__(self, start:float, stop:float, survey_sens='MID', refine_sens='HIGH3', threshold_db=10.0,
+                 threshold=None, margin=0.5, merge_gap=1.0, min_span=0.5, snap=0.1,
+                 reuse=False, survey_every=10) -> None:
+        '''Arguments:
+            - start, stop [`float`]: The band to cover, in nm.
+            - survey_sens [`str`]: Sensitivity of the survey sweep, ex. 'MID'.
+            - refine_sens [`str`]: Sensitivity of the refining sweeps, ex. 'HIGH3'.
+            - threshold_db [`float`]: Features are points more than this many dB above the noise
+                floor, taken as the median of the survey.
+            - threshold [`float`]: An absolute threshold in dBm. Overrides threshold_db.
+            - margin, merge_gap, min_span [`float`]: In nm, see find_regions.
+            - snap [`float`]: Region bounds are rounded outwards to multiples of snap nm, so that the
+                same features give the same refining segments, whose point counts are then only
+                queried once. 0 disables rounding.
+            - reuse [`bool`]: Reuse the feature map of the previous run. See the class documentation.
+            - survey_every [`int`]: With reuse, the number of runs after which a new survey is taken.
+        '''
+        if stop <= start:
+            raise ValueError("stop must be above start")
+        self.survey = SweepSegment(float(start), float(stop), survey_sens.upper())
+        self.refine_sens = refine_sens.upper()
+        self.threshold_db = threshold_db
+        self.threshold = threshold
+        self.margin = margin
+        self.merge_gap = merge_gap
+        self.min_span = min_span
+        self.snap = snap
+        self.reuse = reuse
+        self.survey_every = survey_every
+        self.regions = None        # The current feature map, a list of (start, stop) in nm.
+        self.last_segments = None  # The segments of the last run, as returned by config.
+        self._survey_sweep = SegmentedSweep([self.survey])
+        self._survey_data = None
+        self._floor = None
+        self._runs_since_survey = 0
+        # SegmentedSweep of each recent set of refining segments, most recent last. Drifting
+        # features give new sets, so only the last few are kept.
+        self._refine = collections.OrderedDict()
+        self.refine_cache_size = 8
+
+    @classmethod
+    def from_config(cls, values):
+        '''Creates an adaptive sweep from a config line such as
+        "ADAPTIVE, 1500, 1600, MID, HIGH3, 10, reuse=true, survey_every=5": start, stop, survey
+        sensitivity, refining sensitivity, optionally the threshold in dB above the noise floor,
+        and optionally the reuse and survey_every settings as name=value fields.'''
+        if isinstance(values, str):
+            values = ''.join(values.split()).split(',')
+        values = [v for v in values if str(v) != '']
+        if values and str(values[0]).upper() == 'ADAPTIVE':
+            values = values[1:]
+        kwargs = {}
+        for field in [v for v in values if '=' in str(v)]:
+            name, _, value = str(field).partition('=')
+            name = name.lower()
+            if name == 'reuse':
+                if value.lower() not in ('true', 'false', 'yes', 'no', '1', '0'):
+                    raise ValueError("reuse must be true or false, not " + repr(value))
+                kwargs['reuse'] = value.lower() in ('true', 'yes', '1')
+            elif name == 'survey_every':
+                kwargs['survey_every'] = int(value)
+            else:
+                raise ValueError("Unknown adaptive sweep setting " + repr(name) + ", must be reuse or survey_every")
+        values = [v for v in values if '=' not in str(v)]
+        if len(values) not in (4, 5):
+            raise ValueError("An adaptive sweep needs start, stop, survey and refine sensitivity, "
+                             "and optionally a threshold in dB")
+        if len(values) == 5:
+            kwargs['threshold_db'] = float(values[4])
+        return cls(float(values[0]), float(values[1]), str(values[2]), str(values[3]), **kwargs)
+
+    def config(self):
+        '''Returns the segments of the last run as a JSON-friendly list of [start, stop, sens]
+        lists, the survey first. Before the first run, only the survey is listed.'''
+        return self.last_segments or [list(self.survey)]
+
+    def _nominal_grid(self, n):
+        return np.linspace(self.survey.start, self.survey.stop, n)
+
+    def _level(self):
+        return self.threshold if self.threshold is not None else self._floor + self.threshold_db
+
+    def _snap(self, regions):
+        if not self.snap:
+            return regions
+        snapped = [(max(self.survey.start, round(float(np.floor(a / self.snap) * self.snap), 9)),
+                    min(self.survey.stop, round(float(np.ceil(b / self.snap) * self.snap), 9)))
+                   for a, b in regions]
+        merged = []
+        for a, b in snapped:
+            if merged and a <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(b, merged[-1][1]))
+            else:
+                merged.append((a, b))
+        return merged
+
+    def plan(self, survey_data):
+        '''Finds the regions to refine from survey data (a 2xN trace of the survey segment).
+        Updates and returns self.regions.'''
+        y = survey_data[1]
+        self._floor = float(np.median(y))
+        regions = find_regions(self._nominal_grid(len(y)), y, self._level(), self.margin,
+                               self.merge_gap, self.min_span, (self.survey.start, self.survey.stop))
+        self.regions = self._snap(regions)
+        return self.regions
+
+    def _refine_sweep(self):
+        key = tuple(self.regions)
+        if key in self._refine:
+            self._refine.move_to_end(key)
+        else:
+            self._refine[key] = SegmentedSweep([SweepSegment(a, b, self.refine_sens) for a, b in key])
+            while len(self._refine) > self.refine_cache_size:
+                self._refine.popitem(last=False)
+        return self._refine[key]
+
+    def _moved(self, refined, sweep):
+        '''Returns True if a feature touches the edge of a refined segment.'''
+        level = self._level()
+        for seg in sweep.views(refined):
+            y = seg[1]
+            if len(y) and (y[0] > level or y[-1] > level):
+                return True
+        return False
+
+    def run(self, osa, release=None):
+        '''Performs the survey (unless a feature map is reused) and the refining sweeps, and
+        returns the merged trace.\n
+        Arguments:
+            - osa: The OSA on which the sweeps are to be performed.
+            - release (optional): Called once the last sweep has finished, before its trace is read
+                out, as in SegmentedSweep.run.
+        Returns:
+            (numpy array): A 2xN array sorted by wavelength. x is first row, y is second row.
+        '''
+        # Only a map with features is reused: without any, the survey is the whole measurement,
+        # and skipping it would return the old survey as new data.
+        surveyed = not (self.reuse and self.regions and self._survey_data is not None
+                        and self._runs_since_survey < self.survey_every)
+        if surveyed:
+            self._survey_data = self._survey_sweep.run(osa)
+            self._runs_since_survey = 0
+            self.plan(self._survey_data)
+        self._runs_since_survey += 1
+        if not self.regions:
+            # Nothing to refine, the survey was the last sweep.
+            if release is not None:
+                release()
+            self.last_segments = [list(self.survey)]
+            return self._survey_data.copy()
+        refine = self._refine_sweep()
+        refined = refine.run(osa, release)
+        if self.reuse and self._moved(refined, refine):
+            self._runs_since_survey = self.survey_every # Survey again at the next run.
+        merged = SegmentedSweep([self.survey] + refine.segments, overlap='last')
+        self.last_segments = merged.config()
+        return merged.assemble([self._survey_data] + refine.views(refined))
@@ -0,0 +1,98 @@
+'''An asyncio facade over the blocking instrument drivers, so that an experiment script can run
+independent operations on several instruments with asyncio.gather instead of threads.\n
+Every driver method becomes a coroutine: `await osa.sweep()`, `await pm.read_pow()`,
+`await stage.move_to_pos(45)`. The blocking call runs on an executor with a single worker per
+instrument address, so calls to one instrument are done one at a time and in order, while calls to
+different instruments overlap. Calls are also made under the lock of the instrument's bus (see
+BusLock), so instruments sharing a GPIB board do not collide. Drivers that already lock their bus
+around each transaction (such as OSA) are not locked again, so that a long sweep on one OSA does not
+hold up the readout of another OSA on the same board.\n
+A call that is awaited with a timeout or cancelled keeps running on its worker until the driver
+returns, since a blocking VISA call cannot be interrupted from asyncio.'''
+
+import asyncio
+import contextlib
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from BusLock import bus_lock
+
+_executors = {}
+_registry_lock = threading.Lock()
+
+def resource_executor(address:str) -> ThreadPoolExecutor:
+    '''Returns the single-worker executor of an instrument address, the same object for every
+    facade on that address.'''
+    with _registry_lock:
+        if address not in _executors:
+            _executors[address] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=address)
+        return _executors[address]
+
+def _address_of(driver) -> str:
+    '''Finds the VISA address of a driver from the resource it holds.'''
+    for value in vars(driver).values():
+        name = getattr(value, 'resource_name', None)
+        if isinstance(name, str):
+            return name
+    raise ValueError("Cannot find the VISA resource of " + type(driver).__name__ + ", pass address=")
+
+
+class AsyncInstrument:
+    '''Wraps one driver instance. Methods of the driver are returned as coroutine functions, other
+    attributes as they are.'''
+
+    def __init__(self, driver, address:str=None) -> None:
+        '''Arguments:
+            - driver: The driver instance, ex. an `OSA` or a `PowerMeter`.
+            - address [`str`]: The VISA address of the instrument. Found from the driver if omitted.
+        '''
+        self.driver = driver
+        self.address = address or _address_of(driver)
+        self.executor = resource_executor(self.address)
+        # Drivers with their own bus lock take it around each transaction themselves.
+        self.bus = contextlib.nullcontext() if hasattr(driver, 'bus') else bus_lock(self.address)
+
+    @classmethod
+    async def open(cls, driver_class, rm, address:str, *args, **kwargs):
+        '''Creates a driver on the executor of its address and returns its facade. The driver
+        constructors talk to the instrument (RotaryStage homes, for example), so they are not run
+        on the event loop either.\n
+        Arguments:
+            - driver_class: The driver class, ex. `OSA`.
+            - rm: The resource manager.
+            - address [`str`]: The VISA address of the instrument.
+            - args, kwargs: Further arguments of the driver constructor.
+        '''
+        def create():
+            with bus_lock(address):
+                return driver_class(rm, address, *args, **kwargs)
+        driver = await asyncio.get_running_loop().run_in_executor(resource_executor(address), create)
+        return cls(driver, address)
+
+    def _locked(self, fn, args, kwargs):
+        with self.bus:
+            return fn(*args, **kwargs)
+
+    async def call(self, fn, *args, **kwargs):
+        '''Runs any blocking function on this instrument's executor and under its bus lock, for
+        example `await osa.call(sweep.run, osa.driver)` to run a SegmentedSweep.'''
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(self._locked, fn, args, kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self.driver, name)
+        if not callable(attr):
+            return attr
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.call(attr, *args, **kwargs)
+        return method
+
+    async def close(self):
+        '''Closes the driver, if it has a close method, after any calls still queued for it.'''
+        if hasattr(self.driver, 'close'):
+            await self.call(self.driver.close)
+        with _registry_lock:
+            if _executors.get(self.address) is self.executor:
+                del _executors[self.address]
+        self.executor.shutdown(wait=False)
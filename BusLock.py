@@ -0,0 +1,27 @@
+'''Locks that serialize access to a shared instrument bus, such as a GPIB board with several
+instruments on it. Instruments driven from different threads take the lock of their bus around
+each transaction, so that a write and the read of its reply are never split by traffic to another
+instrument on the same bus.'''
+
+import threading
+
+_locks = {}
+_registry_lock = threading.Lock()
+
+def bus_key(address:str) -> str:
+    '''Returns the name of the bus a VISA address is on. All instruments on one GPIB board share
+    the key of the board ('GPIB0::1::INSTR' and 'GPIB::30::INSTR' are both on 'GPIB0'). Any other
+    resource is its own bus.'''
+    board = address.split('::')[0].upper()
+    if board.startswith('GPIB'):
+        return 'GPIB' + (board[4:] or '0')
+    return address.upper()
+
+def bus_lock(address:str) -> threading.RLock:
+    '''Returns the lock of the bus an address is on, the same object for every address on that
+    bus. The lock is reentrant, so a driver method can call other locked methods.'''
+    key = bus_key(address)
+    with _registry_lock:
+        if key not in _locks:
+            _locks[key] = threading.RLock()
+        return _locks[key]
@@ -1,7 +1,27 @@
+import threading
+import time
+import numpy as np
 import pyvisa
+from RingBuffer import RingBuffer
+from StateCache import StateCache
+
+def parse_channels(chnl:str):
+    '''Expands a channel specification such as '(@1)', '(@1,3)' or '(@1:3)' into the list of
+    channel numbers it covers.'''
+    chans = []
+    for part in chnl.strip().lstrip('(@').rstrip(')').split(','):
+        if ':' in part:
+            lo, hi = part.split(':')
+            chans.extend(range(int(lo), int(hi) + 1))
+        elif part.strip():
+            chans.append(int(part))
+    return chans
 
 class E36300:
     '''A control class for Keysight E36300 series Programmable DC Power Supplies.'''
+
+    # Failed readings in a row after which the polling thread gives up.
+    POLL_RETRIES = 3
     
     def __init__(self, rm:pyvisa.ResourceManager, id:str) -> None:
         '''This constructor initializes an instrument for remote control via Python.\n
@@ -10,6 +30,14 @@ class E36300:
         - id [`str`]: The VISA id of the instrument to connect to.
         '''
         self.dcps = rm.open_resource(id)
+        # Skips settings writes that would change nothing. Settings are tracked per channel, so
+        # overlapping channel specifications stay consistent.
+        self.state = StateCache(self.dcps)
+        self.lock = threading.Lock() # Serializes bus access between callers and the polling thread.
+        self.telemetry = None
+        self.poll_error = None # The last error of the polling thread, if any.
+        self._poll_thread = None
+        self._poll_stop = threading.Event()
 
     # Voltage control functions.
     def set_voltage(self, volt:float, chnl:str):
@@ -20,7 +48,8 @@ class E36300:
             - chnl [`str`]: The channel specification. This is of form '(@1)' for channel 1, '(@1,3)' for channels 1 \
                 and 3, or '(@1:3)' for channels 1-3. The single quotes should not be included in the argument.
         '''
-        self.dcps.write("VOLT " + str(volt) + ", " + chnl)
+        with self.lock:
+            self.state.write_all([('VOLT', c) for c in parse_channels(chnl)], volt, "VOLT " + str(volt) + ", " + chnl)
 
     def get_set_voltage(self, chnl:str):
         '''Returns the user-defined voltage set-point for the given channel or channels.
@@ -28,7 +57,8 @@ class E36300:
             - chnl [`str`]: The channel specification. This is of form '(@1)' for channel 1, '(@1,3)' for channels 1 \
                 and 3, or '(@1:3)' for channels 1-3. The single quotes should not be included in the argument.
         '''
-        return self.dcps.query_ascii_values("VOLT? " + chnl)
+        with self.lock:
+            return self.dcps.query_ascii_values("VOLT? " + chnl)
 
     def query_output_voltage(self, chnl:str):
         '''Returns the voltage currently being output for the given channel or channels.
@@ -36,7 +66,8 @@ class E36300:
             - chnl [`str`]: The channel specification. This is of form '(@1)' for channel 1, '(@1,3)' for channels 1 \
                 and 3, or '(@1:3)' for channels 1-3. The single quotes should not be included in the argument.
         '''
-        return self.dcps.query_ascii_values("MEAS:VOLT? " + chnl)
+        with self.lock:
+            return self.dcps.query_ascii_values("MEAS:VOLT? " + chnl)
 
     # Current control functions.
     def set_current(self, curr:float, chnl:str):
@@ -47,7 +78,8 @@ class E36300:
             - chnl [`str`]: The channel specification. This is of form '(@1)' for channel 1, '(@1,3)' for channels 1 \
                 and 3, or '(@1:3)' for channels 1-3. The single quotes should not be included in the argument.
         '''
-        self.dcps.write("CURRENT " + str(curr) + ", " + chnl)
+        with self.lock:
+            self.state.write_all([('CURRENT', c) for c in parse_channels(chnl)], curr, "CURRENT " + str(curr) + ", " + chnl)
 
     def get_set_current(self, chnl):
         '''Returns the user-defined current set-point for the given channel or channels.
@@ -55,7 +87,8 @@ class E36300:
             - chnl [`str`]: The channel specification. This is of form '(@1)' for channel 1, '(@1,3)' for channels 1 \
                 and 3, or '(@1:3)' for channels 1-3. The single quotes should not be included in the argument.
         '''
-        return self.dcps.query_ascii_values("CURRENT? " + chnl)
+        with self.lock:
+            return self.dcps.query_ascii_values("CURRENT? " + chnl)
 
     def query_output_current(self, chnl):
         '''Returns the current currently being output for the given channel or channels.
@@ -63,7 +96,8 @@ class E36300:
             - chnl [`str`]: The channel specification. This is of form '(@1)' for channel 1, '(@1,3)' for channels 1 \
                 and 3, or '(@1:3)' for channels 1-3. The single quotes should not be included in the argument.
         '''
-        return self.dcps.query_ascii_values("MEAS:CURRENT? " + chnl)
+        with self.lock:
+            return self.dcps.query_ascii_values("MEAS:CURRENT? " + chnl)
 
     #Output control function.
     def set_chnl_output(self, chnl='(@1:3)', on=False):
@@ -74,11 +108,104 @@ class E36300:
                 and 3, or '(@1:3)' for channels 1-3. The single quotes should not be included in the argument.
             - on [`bool`]: Defaults to `False`. Enables output if set to `True`, disables otherwise.
         '''
-        if on:
-            self.dcps.write("OUTPUT ON, " + chnl)
-        else:
-            self.dcps.write("OUTPUT OFF, " + chnl)
+        # Always sent, not cached: an over-voltage or over-current trip turns a channel off
+        # behind our back, and turning it back on must not be skipped.
+        with self.lock:
+            self.dcps.write(("OUTPUT ON, " if on else "OUTPUT OFF, ") + chnl)
+
+    # Batched telemetry functions.
+    def telemetry_dtype(self, chnl='(@1:3)', quantities=('VOLT', 'CURR')):
+        '''Returns the structured dtype of one telemetry record: the Unix time 't', followed by one
+        field per quantity and channel named like 'VOLT1' or 'CURR3'.'''
+        return np.dtype([('t', 'f8')] + [(q + str(c), 'f8') for q in quantities for c in parse_channels(chnl)])
+
+    def read_telemetry(self, chnl='(@1:3)', quantities=('VOLT', 'CURR')):
+        '''Measures the given quantities on all the given channels in a single compound query, such as \
+            'MEAS:VOLT? (@1:3);:MEAS:CURR? (@1:3)', instead of one query per channel and quantity.\n
+        Arguments:
+            - chnl [`str`]: The channel specification, as for the other functions. Defaults to all channels.
+            - quantities [`tuple`]: The MEAS quantities to read, 'VOLT' and/or 'CURR'.
+        Returns:
+            (`numpy.void`): One record of the dtype given by telemetry_dtype.
+        '''
+        cmd = ";:".join("MEAS:" + q + "? " + chnl for q in quantities)
+        with self.lock:
+            t0 = time.time()
+            reply = self.dcps.query(cmd)
+            t1 = time.time()
+        values = [float(v) for part in reply.strip().split(';') for v in part.split(',')]
+        dtype = self.telemetry_dtype(chnl, quantities)
+        if len(values) != len(dtype) - 1:
+            raise ValueError("Unexpected telemetry reply: " + reply)
+        return np.array([((t0 + t1) / 2, *values)], dtype=dtype)[0]
+
+    def start_polling(self, interval=1.0, chnl='(@1:3)', quantities=('VOLT', 'CURR'), capacity=100000):
+        '''Starts a background thread that calls read_telemetry every interval seconds and stores the \
+            records in a ring buffer (self.telemetry).\n
+        Arguments:
+            - interval [`float`]: Seconds between two readings.
+            - chnl, quantities: As for read_telemetry.
+            - capacity [`int`]: Number of records kept.
+        '''
+        self.stop_polling()
+        self.telemetry = RingBuffer(capacity, self.telemetry_dtype(chnl, quantities))
+        self.poll_error = None
+        self._poll_stop.clear()
+        self._poll_thread = threading.Thread(target=self._poll_loop, args=(interval, chnl, quantities),
+                                             name='E36300-poll', daemon=True)
+        self._poll_thread.start()
+
+    def _poll_loop(self, interval, chnl, quantities):
+        t_next = time.perf_counter()
+        failures = 0
+        while not self._poll_stop.is_set():
+            try:
+                record = self.read_telemetry(chnl, quantities)
+            except Exception as err:
+                # Retry a few times, then stop: is_polling turns False and snapshot raises the error.
+                self.poll_error = err
+                failures += 1
+                if failures >= self.POLL_RETRIES:
+                    return
+                self._poll_stop.wait(min(interval, 0.1 * failures))
+                t_next = time.perf_counter()
+                continue
+            failures = 0
+            self.telemetry.append(record)
+            t_next += interval
+            self._poll_stop.wait(max(0, t_next - time.perf_counter()))
+
+    def stop_polling(self):
+        '''Stops the polling thread. The stored records stay available.'''
+        if self._poll_thread is not None:
+            self._poll_stop.set()
+            self._poll_thread.join()
+            self._poll_thread = None
+
+    def is_polling(self):
+        '''Returns True while the polling thread runs. It stops on stop_polling, or by itself
+        after POLL_RETRIES failed readings in a row, with the error in poll_error.'''
+        return self._poll_thread is not None and self._poll_thread.is_alive()
+
+    def snapshot(self):
+        '''Returns the polled telemetry records, oldest first.\n
+        Raises:
+            RuntimeError: If the polling thread stopped on an error. The records read until then
+                stay in self.telemetry.
+        '''
+        if self._poll_thread is not None and not self.is_polling():
+            raise RuntimeError("Power supply polling stopped: " + repr(self.poll_error)) from self.poll_error
+        if self.telemetry is None:
+            return np.zeros(0, dtype=self.telemetry_dtype())
+        return self.telemetry.snapshot()
+
+    def reset(self):
+        '''Resets the power supply to its default settings (*RST) and clears the settings cache.'''
+        with self.lock:
+            self.dcps.write("*RST")
+            self.state.invalidate()
 
     def close(self):
         '''Closes VISA connection to device.'''
+        self.stop_polling()
         self.dcps.close()
\ No newline at end of file
@@ -0,0 +1,215 @@
+'''A process-wide registry of open instruments, so that the instruments are opened and initialized
+once and then shared by every script and run in the process.\n
+`registry.get(RotaryStage, 'ASRL3::INSTR')` opens and initializes the stage on its first call and
+returns the same driver afterwards, so the stage is homed once, the power meter averaging and the
+OSA data format are set once, and so on. A driver is created again only if its VISA session was
+closed or it is asked for with different constructor arguments. All drivers are closed, and the
+shared ResourceManager with them, when the process exits.\n
+To keep the instruments open across processes, for example between short experiment scripts,
+run a registry daemon:
+```
+python InstrumentRegistry.py --serve
+```
+and get proxies of its drivers with connect(): `connect().instrument('PowerMeter', 'USB::1::INSTR').read_pow()`.
+Proxies forward method calls only (not attributes), and return copies of the results.
+The daemon and its clients share a random key, which the first `--serve` writes to
+~/.instrument_registry_key (readable by the user only), or which can be given in the
+INSTRUMENT_REGISTRY_KEY environment variable.'''
+
+import argparse
+import atexit
+import importlib
+import os
+import secrets
+import threading
+from multiprocessing.managers import BaseManager
+import pyvisa
+
+# Driver class name -> module, for drivers given by name (as the daemon clients do).
+DRIVERS = {
+    'OSA': 'OSA', 'PowerMeter': 'PowerMeter', 'RotaryStage': 'RotaryStage',
+    'AWG_33220A': 'AWG_33220A', 'DG4000': 'AWG_DG4000', 'E36300': 'DCPS_E36300', 'MDT693B': 'PC_MDT693B',
+}
+DAEMON_ADDRESS = ('127.0.0.1', 50517)
+DAEMON_KEY_FILE = os.path.join(os.path.expanduser('~'), '.instrument_registry_key')
+DAEMON_KEY_ENV = 'INSTRUMENT_REGISTRY_KEY'
+
+_rm = None
+_rm_lock = threading.Lock()
+
+def resource_manager() -> pyvisa.ResourceManager:
+    '''Returns the ResourceManager shared by the whole process, created on first use.'''
+    global _rm
+    with _rm_lock:
+        if _rm is None:
+            _rm = pyvisa.ResourceManager()
+        return _rm
+
+def driver_class(driver):
+    '''Returns a driver class given as a class or by its name in DRIVERS.'''
+    if not isinstance(driver, str):
+        return driver
+    if driver not in DRIVERS:
+        raise ValueError("Unknown driver " + repr(driver) + ", must be one of " + ", ".join(DRIVERS))
+    return getattr(importlib.import_module(DRIVERS[driver]), driver)
+
+def _resources(driver):
+    '''Returns the VISA resources a driver holds.'''
+    return [v for v in vars(driver).values() if isinstance(getattr(v, 'resource_name', None), str)]
+
+def _is_open(driver) -> bool:
+    try:
+        for res in _resources(driver):
+            res.session # Raises InvalidSession once the resource is closed.
+    except pyvisa.errors.InvalidSession:
+        return False
+    return True
+
+def _close(driver):
+    '''Closes a driver, or its resources if it has no close method (ex. OSA).'''
+    if hasattr(driver, 'close'):
+        driver.close()
+    else:
+        for res in _resources(driver):
+            res.close()
+
+
+class InstrumentRegistry:
+    '''The open drivers of a process, keyed by VISA address.'''
+
+    def __init__(self, rm=None) -> None:
+        '''Arguments:
+            - rm: The ResourceManager to open instruments with, ex. a SimVISA.SimResourceManager.
+                Defaults to the shared one of resource_manager().
+        '''
+        self.rm = rm
+        self.sessions = {} # Address -> (driver, constructor arguments).
+        self.lock = threading.RLock()
+
+    def get(self, driver, address:str, *args, **kwargs):
+        '''Returns the open driver of an address, creating it if needed.\n
+        Arguments:
+            - driver: The driver class, ex. `OSA`, or its name, ex. 'OSA'.
+            - address [`str`]: The VISA address of the instrument.
+            - args, kwargs: Further arguments of the driver constructor. A driver opened with
+                different arguments is closed and created again.
+        Raises:
+            ValueError: If the address is open with a different driver class.
+        '''
+        cls = driver_class(driver)
+        params = (args, kwargs)
+        with self.lock:
+            if address in self.sessions:
+                instr, old_params = self.sessions[address]
+                if type(instr) is not cls:
+                    raise ValueError(address + " is open as " + type(instr).__name__ + ", not " + cls.__name__)
+                if old_params == params and _is_open(instr):
+                    return instr
+                self.close(address)
+            instr = cls(self.rm or resource_manager(), address, *args, **kwargs)
+            self.sessions[address] = (instr, params)
+            return instr
+
+    def close(self, address:str):
+        '''Closes the driver of an address, if it is open.'''
+        with self.lock:
+            entry = self.sessions.pop(address, None)
+        if entry is not None and _is_open(entry[0]):
+            _close(entry[0])
+
+    def close_all(self):
+        '''Closes every open driver.'''
+        with self.lock:
+            for address in list(self.sessions):
+                try:
+                    self.close(address)
+                except Exception as err: # Close the others anyway.
+                    print("Could not close " + address + ": " + repr(err))
+
+
+registry = InstrumentRegistry()
+
+@atexit.register
+def _close_at_exit():
+    registry.close_all()
+    if _rm is not None:
+        _rm.close()
+
+
+class RegistryManager(BaseManager):
+    pass
+
+def daemon_authkey(create=False, path=None) -> bytes:
+    '''Returns the key shared by the registry daemon and its clients. The daemon unpickles what
+    its clients send, so the key must stay secret: it is taken from the INSTRUMENT_REGISTRY_KEY
+    environment variable if set, and otherwise read from a file only the user can read.\n
+    Arguments:
+        - create [`bool`]: If True, a random key is written to the file if it does not exist yet.
+        - path [`str`]: The key file. Defaults to DAEMON_KEY_FILE.
+    Raises:
+        FileNotFoundError: If there is no key and create is False.
+    '''
+    if os.environ.get(DAEMON_KEY_ENV):
+        return os.environ[DAEMON_KEY_ENV].encode()
+    path = path or DAEMON_KEY_FILE
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+    try:
+        with open(path) as f:
+            return f.read().strip().encode()
+    except FileNotFoundError:
+        raise FileNotFoundError("No instrument registry key in " + path + ", start the daemon first or set "
+                                + DAEMON_KEY_ENV) from None
+
+def serve(address=DAEMON_ADDRESS, authkey=None, rm=None):
+    '''Runs a registry daemon until it is interrupted. The drivers it opens stay open between
+    client connections. Several clients can connect at once, but calls to one instrument from
+    different clients are not serialized, so use each instrument from one client at a time.\n
+    Arguments:
+        - address: The (host, port) to listen on.
+        - authkey [`bytes`]: The key clients must present. Defaults to daemon_authkey(), which
+            creates the key file on the first run.
+        - rm: The ResourceManager to open instruments with. Defaults to the shared one.
+    '''
+    authkey = authkey or daemon_authkey(create=True)
+    if rm is not None:
+        registry.rm = rm
+    RegistryManager.register('instrument', callable=registry.get)
+    server = RegistryManager(address=address, authkey=authkey).get_server()
+    print("Instrument registry listening on %s:%d" % address)
+    try:
+        server.serve_forever()
+    finally:
+        registry.close_all()
+
+def connect(address=DAEMON_ADDRESS, authkey=None):
+    '''Connects to a registry daemon. Call `instrument(name, address, *args, **kwargs)` on the
+    result to get a proxy of a driver, with the driver given by name (see DRIVERS). The key
+    defaults to the daemon's, see daemon_authkey.'''
+    RegistryManager.register('instrument')
+    manager = RegistryManager(address=address, authkey=authkey or daemon_authkey())
+    manager.connect()
+    return manager
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs an instrument registry daemon that keeps instruments "
+                                     "open and initialized between experiment scripts.")
+    parser.add_argument('--serve', action='store_true', help="Start the daemon.")
+    parser.add_argument('--host', default=DAEMON_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=DAEMON_ADDRESS[1])
+    parser.add_argument('--simulate', action='store_true',
+                        help="Serve the simulated instruments of SimVISA instead of real ones.")
+    args = parser.parse_args()
+    if not args.serve:
+        parser.error("nothing to do, use --serve to start the daemon")
+    rm = None
+    if args.simulate:
+        from SimVISA import sim_lab
+        rm = sim_lab()
+    serve((args.host, args.port), rm=rm)
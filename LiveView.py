@@ -0,0 +1,298 @@
+'''Live view of an acquisition run: the latest OSA trace, a waterfall of the traces over the stage
+angle, and the laser power measured during the sweeps.\n
+The acquisition loop publishes each trace to a LiveFeed. Publishing never blocks: every trace is
+first decimated to screen resolution (min/max binning), and the feed keeps only the most recent
+frames in bounded queues, so a slow plot or a slow remote viewer drops frames instead of holding
+up the instruments. A LiveMonitor draws the frames with matplotlib, either in the same process or
+in a remote viewer that reads them from the feed's socket server:
+```
+python collect_dataset.py --live-port 50600 run.toml      # Headless, serves the frames.
+python LiveView.py --connect localhost:50600              # Viewer, on this or another machine.
+```
+matplotlib is only imported by LiveMonitor.'''
+
+import argparse
+import collections
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+
+DEFAULT_PORT = 50600
+
+def decimate_minmax(x, y, bins=1000):
+    '''Reduces a trace to the minimum and maximum of y in each of `bins` equal groups of points,
+    which keeps every peak and dip of the trace visible when plotted at that width.\n
+    Returns:
+        (tuple): x and y with 2 points per bin (the x of each bin's first point, twice), or the
+            trace unchanged if it is not longer than 2*bins points.
+    '''
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if len(y) <= 2 * bins:
+        return x, y
+    starts = np.linspace(0, len(y), bins, endpoint=False).astype(int)
+    lo = np.fmin.reduceat(y, starts)
+    hi = np.fmax.reduceat(y, starts)
+    return np.repeat(x[starts], 2), np.column_stack((lo, hi)).ravel()
+
+def encode_frame(frame:dict) -> bytes:
+    '''Serializes a frame: a length-prefixed JSON header, followed by the raw float64 arrays.'''
+    arrays = {k: np.ascontiguousarray(v, dtype='<f8') for k, v in frame.items() if isinstance(v, np.ndarray)}
+    header = {k: v for k, v in frame.items() if k not in arrays}
+    header['arrays'] = {k: len(v) for k, v in arrays.items()}
+    head = json.dumps(header).encode()
+    return struct.pack('<I', len(head)) + head + b''.join(a.tobytes() for a in arrays.values())
+
+def _recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return data
+
+def read_frame(sock) -> dict:
+    '''Reads one frame written by encode_frame from a socket.'''
+    head = json.loads(_recv_exact(sock, struct.unpack('<I', _recv_exact(sock, 4))[0]))
+    frame = {k: v for k, v in head.items() if k != 'arrays'}
+    for name, n in head['arrays'].items():
+        frame[name] = np.frombuffer(_recv_exact(sock, 8 * n), '<f8')
+    return frame
+
+
+class LiveFeed:
+    '''The frames of a run, for the monitors and viewers that want them.'''
+
+    def __init__(self, bins=1000, capacity=64, port=None, host='127.0.0.1') -> None:
+        '''Arguments:
+            - bins [`int`]: Traces are decimated to 2*bins points.
+            - capacity [`int`]: The number of frames queued per consumer. Older ones are dropped.
+            - port [`int`]: If given, frames are also served on this TCP port, see serve.
+            - host [`str`]: The interface to serve on. Defaults to local connections only.
+        '''
+        self.bins = bins
+        self.capacity = capacity
+        self.frames = collections.deque(maxlen=capacity) # For an in-process monitor.
+        self.dropped = 0
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self.server = None
+        if port is not None:
+            self.serve(port, host)
+
+    def publish(self, x, y, angle=np.nan, band=None, power=None, **info):
+        '''Adds a trace. Returns at once; never waits for a consumer.\n
+        Arguments:
+            - x, y: The trace, in nm and dBm.
+            - angle [`float`]: The stage angle.
+            - band [`str`]: The OSA band of the trace.
+            - power: The power meter log during the sweep (see PowerMeter.snapshot), or None.
+            - info: Further JSON-serializable values to show, ex. the position index.
+        '''
+        xd, yd = decimate_minmax(x, y, self.bins)
+        frame = dict(info, t=time.time(), angle=float(angle), band=band, minmax=len(xd) < len(x), x=xd, y=yd)
+        if power is not None and len(power):
+            step = max(1, len(power) // 200)
+            frame['power_t'] = np.asarray(power['t'][::step], dtype=float)
+            frame['power'] = np.asarray(power['power'][::step], dtype=float)
+        self._push(self.frames, frame)
+        with self._clients_lock:
+            clients = list(self._clients)
+        if clients:
+            data = encode_frame(frame)
+            for queue, ready in clients:
+                self._push(queue, data)
+                ready.set()
+
+    def _push(self, queue, item):
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append(item)
+
+    def get_all(self):
+        '''Removes and returns the frames queued for the in-process monitor, oldest first.'''
+        out = []
+        while self.frames:
+            out.append(self.frames.popleft())
+        return out
+
+    def serve(self, port=DEFAULT_PORT, host='127.0.0.1'):
+        '''Serves the frames on a TCP port from a background thread. Each connected viewer gets
+        its own bounded queue and sender thread.'''
+        feed = self
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                queue, ready = collections.deque(maxlen=feed.capacity), threading.Event()
+                with feed._clients_lock:
+                    feed._clients.append((queue, ready))
+                try:
+                    while not getattr(feed.server, 'closing', False):
+                        if not ready.wait(0.5):
+                            continue
+                        ready.clear()
+                        while queue:
+                            self.request.sendall(queue.popleft())
+                except OSError:
+                    pass # Viewer gone.
+                finally:
+                    with feed._clients_lock:
+                        feed._clients.remove((queue, ready))
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True, name='live-feed').start()
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.closing = True
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class LiveClient:
+    '''Receives the frames of a LiveFeed served on a socket, with the same get_all as the feed.'''
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, capacity=64) -> None:
+        self.sock = socket.create_connection((host, port))
+        self.frames = collections.deque(maxlen=capacity)
+        self.connected = True
+        threading.Thread(target=self._receive, daemon=True, name='live-client').start()
+
+    def _receive(self):
+        try:
+            while True:
+                self.frames.append(read_frame(self.sock))
+        except (OSError, ConnectionError, ValueError):
+            self.connected = False
+
+    def get_all(self):
+        out = []
+        while self.frames:
+            out.append(self.frames.popleft())
+        return out
+
+    def close(self):
+        self.sock.close()
+
+
+class LiveState:
+    '''What the monitor shows, built from the frames: the latest trace of each band, the
+    waterfall of one band and the power log.'''
+
+    def __init__(self, band=None, columns=500, history=500) -> None:
+        '''Arguments:
+            - band [`str`]: The band shown in the waterfall. Defaults to the band of the first frame.
+            - columns [`int`]: Wavelength bins of the waterfall.
+            - history [`int`]: Traces kept in the waterfall, and power samples kept x 200.
+        '''
+        self.band = band
+        self.columns = columns
+        self.latest = {}
+        self.grid = None
+        self.rows = collections.deque(maxlen=history)
+        self.angles = collections.deque(maxlen=history)
+        self.power = collections.deque(maxlen=200 * history)
+        self.count = 0
+
+    def add(self, frame:dict):
+        self.count += 1
+        band = frame.get('band')
+        self.latest[band] = frame
+        if self.band is None:
+            self.band = band
+        if band == self.band and len(frame['x']):
+            x, y = frame['x'], frame['y']
+            if frame.get('minmax'):
+                x, y = x[::2], np.maximum(y[::2], y[1::2]) # The upper envelope of each bin.
+            if self.grid is None:
+                self.grid = np.linspace(x[0], x[-1], self.columns)
+            self.rows.append(np.interp(self.grid, x, y, left=np.nan, right=np.nan))
+            self.angles.append(frame['angle'])
+        if 'power' in frame:
+            self.power.extend(zip(frame['power_t'], frame['power']))
+
+    def waterfall(self):
+        '''Returns the waterfall as a (traces x columns) array, or None before the first trace.'''
+        return np.array(self.rows) if self.rows else None
+
+
+class LiveMonitor:
+    '''A matplotlib window showing a LiveState, fed from a LiveFeed or a LiveClient.'''
+
+    def __init__(self, source, band=None, columns=500, history=500) -> None:
+        import matplotlib.pyplot as plt # Only needed to show the plots.
+        self.plt = plt
+        self.source = source
+        self.state = LiveState(band, columns, history)
+        self.fig, (self.ax_trace, self.ax_fall, self.ax_pow) = plt.subplots(3, 1, figsize=(9, 10))
+        self.lines = {}
+        self.image = None
+        self.pow_line, = self.ax_pow.plot([], [], '.-')
+        self.ax_trace.set_xlabel("Wavelength [nm]")
+        self.ax_trace.set_ylabel("Power [dBm]")
+        self.ax_fall.set_xlabel("Wavelength [nm]")
+        self.ax_fall.set_ylabel("Stage angle [deg]")
+        self.ax_pow.set_xlabel("Time [s]")
+        self.ax_pow.set_ylabel("Laser power [W]")
+        self.fig.tight_layout()
+
+    def update(self):
+        '''Draws the frames received since the last update. Returns False if there were none.'''
+        frames = self.source.get_all()
+        for frame in frames:
+            self.state.add(frame)
+        if not frames:
+            return False
+        st = self.state
+        for band, frame in st.latest.items():
+            if band not in self.lines:
+                self.lines[band], = self.ax_trace.plot([], [], lw=0.8, label=str(band))
+                self.ax_trace.legend(loc='upper right')
+            self.lines[band].set_data(frame['x'], frame['y'])
+        last = frames[-1]
+        self.ax_trace.set_title("Angle %.2f deg, %d traces" % (last['angle'], st.count))
+        self.ax_trace.relim()
+        self.ax_trace.autoscale_view()
+        fall = st.waterfall()
+        if fall is not None:
+            angles = np.array(st.angles)
+            extent = (st.grid[0], st.grid[-1], angles.min(), angles.max() if angles.max() > angles.min() else angles.min() + 1)
+            order = np.argsort(angles, kind='stable')
+            if self.image is None:
+                self.image = self.ax_fall.imshow(fall[order], aspect='auto', origin='lower', extent=extent)
+                self.fig.colorbar(self.image, ax=self.ax_fall, label="dBm")
+            else:
+                self.image.set_data(fall[order])
+                self.image.set_extent(extent)
+                self.image.set_clim(np.nanmin(fall), np.nanmax(fall))
+        if st.power:
+            t, p = np.array(st.power).T
+            self.pow_line.set_data(t - t[0], p)
+            self.ax_pow.relim()
+            self.ax_pow.autoscale_view()
+        self.fig.canvas.draw_idle()
+        return True
+
+    def run(self, interval=0.25, stop=None):
+        '''Updates the window every interval seconds until it is closed, or until stop() returns True.'''
+        self.plt.show(block=False)
+        while self.plt.fignum_exists(self.fig.number) and not (stop is not None and stop()):
+            self.update()
+            self.plt.pause(interval)
+        self.update()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shows the live view of a run served by collect_dataset.py --live-port.")
+    parser.add_argument('--connect', default='127.0.0.1:%d' % DEFAULT_PORT, metavar='HOST:PORT')
+    parser.add_argument('--band', help="The OSA band shown in the waterfall.")
+    args = parser.parse_args()
+    host, port = args.connect.rsplit(':', 1)
+    client = LiveClient(host, int(port))
+    LiveMonitor(client, band=args.band).run()
@@ -0,0 +1,50 @@
+'''Concurrent acquisition on several OSAs, for example the 1 um and 2 um analyzers, so that all
+bands are measured at the same stage position in one pass.\n
+Each OSA runs its sweep on its own thread. The sweeps themselves overlap completely; only the bus
+transactions are serialized, by the bus lock each OSA takes (see BusLock), so readouts of OSAs on
+the same GPIB board follow each other instead of colliding.'''
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class MultiOSA:
+    '''A set of OSAs, each identified by the name of its band.'''
+
+    def __init__(self, osas:dict) -> None:
+        '''Arguments:
+            - osas [`dict`]: Maps band names, ex. '1um', to `OSA` instances.
+        '''
+        self.osas = dict(osas)
+        if not self.osas:
+            raise ValueError("MultiOSA needs at least one OSA")
+        self.executor = ThreadPoolExecutor(max_workers=len(self.osas), thread_name_prefix='osa')
+
+    def run(self, sweeps:dict, release=None):
+        '''Runs one sweep on every OSA at once and returns all the traces.\n
+        Arguments:
+            - sweeps [`dict`]: Maps each band name to its SegmentedSweep or AdaptiveSweep. Bands
+                without a sweep are skipped.
+            - release (optional): Called once the last sweep on every OSA has finished, before the
+                last readout. Lets a pipelined run move the stage during the readouts.
+        Returns:
+            (dict): The 2xN trace of each band.
+        Raises:
+            The first exception raised by any of the sweeps, after all of them have ended.
+        '''
+        remaining = [len(sweeps)]
+        lock = threading.Lock()
+        def band_release():
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and release is not None:
+                release()
+        futures = {band: self.executor.submit(sweep.run, self.osas[band], band_release)
+                   for band, sweep in sweeps.items()}
+        errors = [f.exception() for f in futures.values() if f.exception() is not None]
+        if errors:
+            raise errors[0]
+        return {band: f.result() for band, f in futures.items()}
+
+    def close(self):
+        self.executor.shutdown()
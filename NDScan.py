@@ -0,0 +1,195 @@
+'''Scans over several parameters at once, such as the stage angle, a power supply voltage, the
+piezo position and the AWG frequency.\n
+Each parameter is an Axis: a name, the values to visit and the driver setter that applies a value.
+NDScan visits every combination of the axis values and measures at each one. The combinations are
+visited in snake order by default (a reflected mixed-radix Gray code): every step changes exactly
+one axis by one value, and no axis ever jumps back to its first value, so the stage is never rewound
+across its whole range. A setter is only called when the value of its axis changes, so the number of
+(slow) moves is the number of actual setpoint changes. Put the slowest axis first: it changes least
+often.\n
+Traces are written to a SweepDataset whose entries carry their N-D scan index; ScanDataset reads
+them back by index.'''
+
+import time
+import numpy as np
+from SweepDataset import SweepDataset
+
+class Axis:
+    '''One scanned parameter.'''
+
+    def __init__(self, name:str, values, setter, settle=0.0) -> None:
+        '''Arguments:
+            - name [`str`]: The name of the parameter, ex. 'angle'.
+            - values: The values to visit, in order.
+            - setter: Called with one value to apply it. Its return value, if not None, is stored
+                as the actual value reached (ex. the angle reported by RotaryStage.move_to_pos).
+            - settle [`float`]: Seconds to wait after the setter before measuring.
+        '''
+        self.name = name
+        self.values = list(np.asarray(values).tolist())
+        self.setter = setter
+        self.settle = settle
+
+    def __len__(self):
+        return len(self.values)
+
+def stage_axis(stage, values, name='angle', settle=0.0):
+    '''An axis of RotaryStage angles in degrees.'''
+    return Axis(name, values, stage.move_to_pos, settle)
+
+def dcps_axis(dcps, chnl:str, values, name=None, settle=0.0):
+    '''An axis of E36300 output voltages on channel chnl, ex. '(@1)'.'''
+    return Axis(name or 'volt' + chnl.strip('(@)'), values, lambda v: dcps.set_voltage(v, chnl), settle)
+
+def piezo_axis(piezo, channel:str, values, name=None, settle=0.0):
+    '''An axis of MDT693B voltages on channel 'x', 'y' or 'z'.'''
+    return Axis(name or 'piezo_' + channel, values, lambda v: piezo.set_voltage(channel, v), settle)
+
+def awg_freq_axis(awg, values, name='freq', units='Hz', settle=0.0):
+    '''An axis of AWG_33220A or DG4000 frequencies.'''
+    return Axis(name, values, lambda v: awg.set_freq(v, units), settle)
+
+def awg_amplitude_axis(awg, values, name='amplitude', settle=0.0):
+    '''An axis of AWG_33220A or DG4000 amplitudes in Vpp.'''
+    return Axis(name, values, awg.set_voltage, settle)
+
+def scan_order(shape, order='snake'):
+    '''Returns the index tuples of an N-D grid in visiting order, as an (points x axes) array.
+    The first axis changes slowest.\n
+    Arguments:
+        - shape: The number of values of each axis.
+        - order [`str`]: 'raster' for plain row-major order, in which every inner axis restarts
+            from its first value, or 'snake' (also 'gray') for the reflected order, in which each
+            step changes one axis by one value.
+    '''
+    shape = tuple(int(n) for n in shape)
+    idx = np.indices(shape).reshape(len(shape), -1).T
+    if order == 'raster':
+        return idx
+    if order not in ('snake', 'gray'):
+        raise ValueError("order must be 'raster' or 'snake'")
+    out = idx.copy()
+    outer = np.zeros(len(idx), dtype=np.int64) # Row-major counter of the axes before axis k.
+    for k, n in enumerate(shape):
+        # Axis k runs backwards whenever the outer axes have taken an odd number of steps.
+        out[:, k] = np.where(outer % 2 == 1, n - 1 - idx[:, k], idx[:, k])
+        outer = outer * n + idx[:, k]
+    return out
+
+
+class NDScan:
+    '''Visits every combination of the values of several axes and measures at each.'''
+
+    def __init__(self, axes, measure, order='snake') -> None:
+        '''Arguments:
+            - axes: The Axis of each parameter, slowest first.
+            - measure: Called with a dict of the current axis values at each point. It returns
+                either a 2xN trace, a (trace, metadata dict) tuple, or any other value (ex. a
+                power reading).
+            - order [`str`]: See scan_order.
+        '''
+        self.axes = list(axes)
+        names = [a.name for a in self.axes]
+        if len(set(names)) != len(names):
+            raise ValueError("Axis names must be unique: " + ", ".join(names))
+        self.measure = measure
+        self.order = order
+        self.shape = tuple(len(a) for a in self.axes)
+        self.set_calls = {a.name: 0 for a in self.axes} # Setter calls made by the last run.
+
+    def points(self):
+        '''Returns the index tuples in visiting order, see scan_order.'''
+        return scan_order(self.shape, self.order)
+
+    def moves(self):
+        '''Returns the number of setter calls a run makes on each axis.'''
+        pts = self.points()
+        changes = np.count_nonzero(np.diff(pts, axis=0), axis=0) + 1
+        return {a.name: int(n) for a, n in zip(self.axes, changes)}
+
+    def run(self, writer=None, callback=None):
+        '''Runs the scan.\n
+        Arguments:
+            - writer: A SweepDatasetWriter to store traces in. Needed if measure returns traces.
+                Its entries get 'scan_index', 'scan_point' and 'scan_actual' metadata, see ScanDataset.
+            - callback (optional): Called with the N-D index, the point dict and the result after
+                each measurement, ex. to publish to a LiveView.LiveFeed.
+        Returns:
+            (numpy array): An N-D array with the shape of the grid. With a writer, it holds the
+                dataset entry of each point; otherwise the result of measure at each point.
+        '''
+        results = np.full(self.shape, -1 if writer is not None else None,
+                          dtype=np.int64 if writer is not None else object)
+        current = [None] * len(self.axes)
+        actual = {}
+        self.set_calls = {a.name: 0 for a in self.axes}
+        for idx in self.points():
+            settle = 0.0
+            for k, axis in enumerate(self.axes):
+                value = axis.values[idx[k]]
+                if current[k] is not None and current[k] == value:
+                    continue
+                reached = axis.setter(value)
+                actual[axis.name] = value if reached is None else reached
+                current[k] = value
+                self.set_calls[axis.name] += 1
+                settle = max(settle, axis.settle)
+            if settle > 0:
+                time.sleep(settle)
+            point = {a.name: v for a, v in zip(self.axes, current)}
+            result = self.measure(point)
+            idx = tuple(int(i) for i in idx)
+            if writer is not None:
+                data, meta = result if isinstance(result, tuple) else (result, {})
+                angle = actual.get('angle', np.nan)
+                results[idx] = writer.append(data, angle=angle, scan_index=list(idx), scan_point=point,
+                                             scan_actual=dict(actual), **meta)
+            else:
+                results[idx] = result
+            if callback is not None:
+                callback(idx, point, result)
+        return results
+
+    def attrs(self):
+        '''The description of the scan, for the dataset attrs (see ScanDataset).'''
+        return {'scan': {'axes': [{'name': a.name, 'values': a.values} for a in self.axes], 'order': self.order}}
+
+
+class ScanDataset:
+    '''Reads the traces of an NDScan by their N-D index.'''
+
+    def __init__(self, path:str) -> None:
+        '''Arguments:
+            - path [`str`]: The dataset directory, written with attrs=scan.attrs().
+        '''
+        self.dataset = SweepDataset(path)
+        scan = self.dataset.attrs['scan']
+        self.names = [a['name'] for a in scan['axes']]
+        self.values = {a['name']: np.array(a['values']) for a in scan['axes']}
+        self.shape = tuple(len(a['values']) for a in scan['axes'])
+        # Dataset entry of each grid point, -1 where none was measured (yet).
+        self.entries = np.full(self.shape, -1, dtype=np.int64)
+        for i, meta in enumerate(self.dataset.meta):
+            if 'scan_index' in meta:
+                self.entries[tuple(meta['scan_index'])] = i
+
+    def __getitem__(self, idx):
+        '''Returns the 2xN trace at an N-D index, ex. scan[2, 0, 5].'''
+        entry = self.entries[idx]
+        if entry < 0:
+            raise KeyError("No trace at " + str(idx))
+        return self.dataset[int(entry)]
+
+    def select(self, **fixed):
+        '''Returns the entries of the points whose axes have the given values, as an array over
+        the remaining axes, ex. select(angle=30) for all voltages at 30 degrees.'''
+        idx = []
+        for name in self.names:
+            if name in fixed:
+                matches = np.flatnonzero(np.isclose(self.values[name], fixed[name]))
+                if not len(matches):
+                    raise KeyError(name + " has no value " + str(fixed[name]))
+                idx.append(int(matches[0]))
+            else:
+                idx.append(slice(None))
+        return self.entries[tuple(idx)]
@@ -1,16 +1,88 @@
+import collections
+import time
 import pyvisa
 import numpy as np
+from BusLock import bus_lock
+from StateCache import StateCache
 
 class OSA:
-    def __init__(self, resourceMan: pyvisa.ResourceManager, visa_id) :
-        '''Connects to OSA with VISA and sets data format to ASCII.
-        Also specifies timeout as infinite and sets correct read termination
-        character.
+    # Maps the data_format option to the :FORMAT:DATA argument and the
+    # struct datatype used to unpack binary blocks.
+    DATA_FORMATS = {
+        'ASCII': ('ASCII', None),
+        'REAL32': ('REAL,32', 'f'),
+        'REAL64': ('REAL,64', 'd'),
+    }
+
+    # Settings that determine the X axis of a sweep, see read_trace.
+    X_AXIS_SETTINGS = (':SENSE:WAV:START', ':SENSE:WAV:STOP', ':SENSE:SENSE', ':SENSE:BANDWIDTH:RESOLUTION')
+
+    def __init__(self, resourceMan: pyvisa.ResourceManager, visa_id, data_format='ASCII',
+                 timeout=30000, sweep_timeout=600, bus=None, cache_x=True) :
+        '''Connects to OSA with VISA and sets the trace data format.
+        Also sets a finite I/O timeout and the correct read termination character.
+        Sweep completion is detected from the status registers rather than by letting
+        the instrument stall the bus, see wait_sweep.\n
+        Inputs:
+            resourceMan: A pyvisa ResourceManager object.
+            visa_id: The VISA id string for the OSA.
+            data_format (optional): The format used to transfer trace data. One of 'ASCII',
+                'REAL32' or 'REAL64'. The binary formats transfer IEEE-488.2 definite-length
+                blocks that are unpacked directly into numpy arrays, which is several times
+                smaller and faster to parse than ASCII. Note that REAL32 only keeps about 7
+                significant digits, so wavelengths are rounded to ~1e-4 nm. Defaults to 'ASCII'.
+            timeout (optional): The VISA I/O timeout in ms. Must cover the transfer of one trace.
+            sweep_timeout (optional): Default time in s to wait for a sweep to finish before
+                it is aborted.
+            bus (optional): The lock taken around every bus transaction, so that several OSAs can
+                be driven from different threads. Defaults to the shared lock of the GPIB board
+                in visa_id, see BusLock.bus_lock.
+            cache_x (optional): If True (default), the X axis of each scan configuration is read
+                from the OSA once and reused for later sweeps of the same configuration, so only Y
+                is transferred. See read_trace.
         '''
+        if data_format not in self.DATA_FORMATS:
+            raise ValueError("data_format must be one of " + ", ".join(self.DATA_FORMATS))
+        self.bus = bus if bus is not None else bus_lock(visa_id)
         self.osa = resourceMan.open_resource(visa_id)
-        self.osa.timeout = float('+inf')
+        self.osa.timeout = timeout
         self.osa.read_termination = '\n'
-        self.osa.write(':FORMAT:DATA ASCII') # Sets output format.
+        self.sweep_timeout = sweep_timeout
+        self.data_format = data_format
+        self.state = StateCache(self.osa) # Skips settings writes that would change nothing.
+        self.cache_x = cache_x
+        self.x_cache = collections.OrderedDict() # X axis of each configuration, most recent last.
+        self.x_cache_size = 64
+        self.active = None # The active trace, once known.
+        self._swept = {} # The configuration of the last sweep of each trace.
+        if hasattr(self.osa, 'on_reopen'): # A ResilientIO resource, see _reopened.
+            self.osa.on_reopen.append(self._reopened)
+        self._init_settings()
+
+    def _init_settings(self) :
+        fmt = self.DATA_FORMATS[self.data_format][0]
+        with self.bus:
+            self.state.write(':FORMAT:DATA', fmt, ':FORMAT:DATA ' + fmt) # Sets output format.
+            # Sweep-complete bit feeds the status byte.
+            self.state.write(':STATUS:OPERATION:ENABLE', 1, ':STATUS:OPERATION:ENABLE 1')
+
+    def _reopened(self) :
+        '''Forgets the traces after the VISA session was opened again, as the OSA may have been
+        power cycled. The settings are restored by the StateCache.'''
+        self.active = None
+        self._swept.clear()
+        self.x_cache.clear()
+
+    def reset(self) :
+        '''Resets the OSA to its default settings (*RST), then restores the data format
+        and status settings this class relies on.'''
+        with self.bus:
+            self.osa.write('*RST')
+            self.state.invalidate()
+            self.active = None
+            self._swept.clear()
+            self.x_cache.clear()
+            self._init_settings()
 
     def switch_trace(self, new_trace) :
         '''Switches active trace to new_trace.\n
@@ -18,43 +90,222 @@ class OSA:
         allows it to be written to.
         '''
 
-        self.osa.write(':TRACE:ATTRIBUTE FIX') #Fix active trace
-        self.osa.write('TRACE:STATE:' + new_trace + ' ON')
-        self.osa.write(':TRACE:ATTRIBUTE:' + new_trace + ' WRITE') #Sets new_trace to active.
+        with self.bus:
+            self.osa.write(':TRACE:ATTRIBUTE FIX') #Fix active trace
+            self.osa.write('TRACE:STATE:' + new_trace + ' ON')
+            self.osa.write(':TRACE:ATTRIBUTE:' + new_trace + ' WRITE') #Sets new_trace to active.
+            self.active = new_trace
 
-    def config_scan(self, lower: float, upper: float, sens) :
+    def config_scan(self, lower: float, upper: float, sens, resolution=None) :
         '''Sets parameters for a wavelength scan.\n
         Inputs:
             lower: lower wavelength bound of scan in nm.
             upper: upper wavelength bound of scan in nm.
             sens: The scan sensitivity. Ex. 'HIGH3'
+            resolution (optional): The resolution bandwidth in nm. Left unchanged if not given.
         '''
         
-        self.osa.write(':SENSE:SENSE ' + sens) # Sets sensitivity.
-        #Set wavelength bounds.
-        self.osa.write(':SENSE:WAV:START ' + str(lower) + 'NM')
-        self.osa.write(':SENSE:WAV:STOP ' + str(upper) + 'NM')
+        # Each setting is only written if it changed since the last scan.
+        with self.bus:
+            self.state.write(':SENSE:SENSE', sens, ':SENSE:SENSE ' + sens) # Sets sensitivity.
+            #Set wavelength bounds.
+            self.state.write(':SENSE:WAV:START', lower, ':SENSE:WAV:START ' + str(lower) + 'NM')
+            self.state.write(':SENSE:WAV:STOP', upper, ':SENSE:WAV:STOP ' + str(upper) + 'NM')
+            if resolution is not None:
+                self.state.write(':SENSE:BANDWIDTH:RESOLUTION', resolution,
+                                 ':SENSE:BANDWIDTH:RESOLUTION ' + str(resolution) + 'NM')
 
-    def sweep(self) :
+    def sweep(self, timeout=None, poll_interval=0.1, callback=None, use_srq=False) :
         '''Get sweep data from active trace using current sweep parameters and return the data.\n
         This method DOES NOT set sweep parameters. Those must be set prior to running this command.
-        The required input is the OSA to sweep. Note that this method may take a long time
-        to evaluate. Consider putting in a thread. \n
+        It is equivalent to start_sweep, wait_sweep and read_trace in sequence. Use those directly
+        to serve other instruments while the sweep runs. \n
+        Inputs:
+            timeout, poll_interval, callback, use_srq (optional): Passed on to wait_sweep.
         Returns: 
             A numpy array containing the x,y data of the sweep. Assume dBm y scale. x is first row,
             y is second row.
         '''
-        self.osa.write(':INIT:SMODE SINGLE') #Sets sweep mode to single.
-        self.osa.write('*CLS') # Clears status buffer.
-        self.osa.write(':INIT') # Starts sweep.
-        # Collect and return data.
-        trace = self.osa.query(':TRACE:ACTIVE?')
-        dat_x = self.osa.query_ascii_values(':TRACE:X? ' + trace)
-        print('Done x')
-        dat_y = self.osa.query_ascii_values(':TRACE:y? ' + trace)
-        print('Done y')
-        return np.array([dat_x, dat_y])
+        self.start_sweep()
+        self.wait_sweep(timeout, poll_interval, callback, use_srq)
+        return self.read_trace()
+
+    def start_sweep(self) :
+        '''Starts a single sweep with the current parameters and returns immediately.'''
+        with self.bus:
+            self.state.write(':INIT:SMODE', 'SINGLE', ':INIT:SMODE SINGLE') #Sets sweep mode to single.
+            self.osa.write('*CLS') # Clears status buffer.
+            self.osa.write(':INIT') # Starts sweep.
+            self._swept[self._active_trace()] = self._scan_config()
+
+    def sweep_done(self) :
+        '''Returns True if a sweep has completed since the last start_sweep. Reading the
+        operation event register clears it, so only one call reports each completion.
+        '''
+        with self.bus:
+            return bool(int(self.osa.query(':STATUS:OPERATION:EVENT?')) & 1)
+
+    def wait_sweep(self, timeout=None, poll_interval=0.1, callback=None, use_srq=False) :
+        '''Blocks until the sweep started by start_sweep completes. The bus is released between
+        polls so other instruments can be served from other threads.\n
+        Inputs:
+            timeout (optional): Seconds to wait before aborting the sweep. Defaults to the
+                sweep_timeout given to the constructor.
+            poll_interval (optional): Seconds between status polls. Defaults to 0.1.
+            callback (optional): Called with the elapsed time in s after every poll.
+            use_srq (optional): If True, wait for the GPIB service request raised at the end of the
+                sweep instead of polling the status register.
+        Raises:
+            TimeoutError: If the sweep did not complete in time. The sweep is aborted first.
+        '''
+        if timeout is None:
+            timeout = self.sweep_timeout
+        if use_srq:
+            # Request service on the operation status summary bit.
+            with self.bus:
+                self.state.write('*SRE', 128, '*SRE 128')
+        t_start = time.perf_counter()
+        while True:
+            if use_srq:
+                try:
+                    self.osa.wait_for_srq(int(1000 * poll_interval))
+                    done = self.sweep_done()
+                except pyvisa.errors.VisaIOError as err:
+                    if err.error_code != pyvisa.constants.StatusCode.error_timeout:
+                        raise
+                    done = False
+            else:
+                done = self.sweep_done()
+            elapsed = time.perf_counter() - t_start
+            if callback is not None:
+                callback(elapsed)
+            if done:
+                return
+            if elapsed > timeout:
+                self.abort()
+                raise TimeoutError("OSA sweep did not complete within " + str(timeout) + " s.")
+            if not use_srq:
+                time.sleep(poll_interval)
+
+    def get_active_trace(self) :
+        '''Returns the name of the active trace, ex. 'TRA'.'''
+        with self.bus:
+            self.active = self.osa.query(':TRACE:ACTIVE?').strip()
+            return self.active
+
+    def _active_trace(self) :
+        '''The active trace, only queried if it is not known from switch_trace.'''
+        return self.active if self.active is not None else self.get_active_trace()
+
+    def _scan_config(self) :
+        '''Returns the settings that determine the X axis of a sweep, or None if some of them
+        were not set through config_scan, in which case the X axis is not cached.'''
+        key = tuple(self.state.get(k) for k in self.X_AXIS_SETTINGS)
+        return None if None in key[:3] else key
+
+    def get_sweep_points(self) :
+        '''Returns the number of sampling points a sweep with the current parameters produces.'''
+        with self.bus:
+            return int(float(self.osa.query(':SENSE:SWEEP:POINTS?')))
+
+    def get_trace_points(self, trace='TRA') :
+        '''Returns the number of data points currently stored in a trace.'''
+        with self.bus:
+            return int(float(self.osa.query(':TRACE:SNUMBER? ' + trace)))
+
+    def read_trace(self, trace=None, out=None, npts=None) :
+        '''Reads the x,y data of a trace in the format selected in the constructor.\n
+        The X axis only depends on the scan configuration (start, stop, sensitivity and resolution
+        set by config_scan). With cache_x, the X axis of each configuration is read once, and later
+        sweeps of the same configuration only transfer Y. The number of points in the trace is
+        checked against the cached X axis, so a change made at the front panel is noticed.\n
+        Inputs:
+            trace (optional): The trace to read, ex. 'TRA'. Defaults to the active trace.
+            out (optional): A 2xN array (or view) to store the data in, where N must match the
+                number of points in the trace.
+            npts (optional): The number of points in the trace, if the caller has just queried it
+                with get_trace_points. Saves querying it again to check the cached X axis.
+        Returns:
+            A 2xN numpy array. x is first row, y is second row. This is out if it was given.
+        '''
+        if trace is None:
+            trace = self._active_trace()
+        dat_x = self._trace_x(trace, npts)
+        dat_y = self._query_trace_values(':TRACE:Y? ' + trace)
+        if out is None:
+            return np.array([dat_x, dat_y])
+        if out.shape != (2, len(dat_x)):
+            raise ValueError("Trace has " + str(len(dat_x)) + " points, out has shape " + str(out.shape))
+        out[0] = dat_x
+        out[1] = dat_y
+        return out
+
+    def read_roi(self, windows, trace=None) :
+        '''Reads only the parts of a trace that fall within wavelength windows, using the
+        sampling point range of the trace query (:TRACE:Y? TRA,first,last). The X axis comes from
+        the cache (see read_trace), so only the Y values of the windows are transferred.\n
+        Inputs:
+            windows: A (lower, upper) window in nm, or a list of them. Overlapping windows are merged.
+                An empty list reads nothing.
+            trace (optional): The trace to read. Defaults to the active trace.
+        Returns:
+            A 2xN numpy array of the points in the windows, sorted by wavelength.
+        '''
+        if len(windows) == 0:
+            return np.zeros((2, 0))
+        if trace is None:
+            trace = self._active_trace()
+        x = self._trace_x(trace)
+        windows = [windows] if np.ndim(windows) == 1 else windows
+        # Point ranges [first, last) of the windows, merged where they overlap.
+        ranges = []
+        for first, last in sorted((int(np.searchsorted(x, lo, 'left')), int(np.searchsorted(x, hi, 'right')))
+                                  for lo, hi in windows):
+            if last <= first:
+                continue
+            if ranges and first <= ranges[-1][1]:
+                ranges[-1][1] = max(last, ranges[-1][1])
+            else:
+                ranges.append([first, last])
+        parts = [np.zeros((2, 0))]
+        for first, last in ranges:
+            # The OSA numbers the sampling points from 1, and the range includes both ends.
+            y = self._query_trace_values(':TRACE:Y? ' + trace + ',' + str(first + 1) + ',' + str(last))
+            parts.append(np.array([x[first:last], y]))
+        return np.hstack(parts)
+
+    def _trace_x(self, trace, npts=None) :
+        '''Returns the X axis of a trace, from the cache if its configuration was read before.
+        npts is the number of points in the trace, queried here if not given.'''
+        key = self._swept.get(trace) if self.cache_x else None
+        x = self.x_cache.get(key) if key is not None else None
+        if npts is None and x is not None:
+            npts = self.get_trace_points(trace)
+        if x is not None and npts != len(x):
+            x = None # The configuration was changed outside this driver.
+        if x is None:
+            x = self._query_trace_values(':TRACE:X? ' + trace)
+            if key is not None:
+                x.setflags(write=False) # Shared by every sweep of the configuration.
+                self.x_cache[key] = x
+                while len(self.x_cache) > self.x_cache_size:
+                    self.x_cache.popitem(last=False)
+        else:
+            self.x_cache.move_to_end(key)
+        return x
+
+    def _query_trace_values(self, cmd) :
+        '''Sends a trace query and unpacks the reply according to the data format. The bus is held
+        for the query only, so other instruments can be served between the x and y transfers.'''
+        datatype = self.DATA_FORMATS[self.data_format][1]
+        with self.bus:
+            if datatype is None:
+                return self.osa.query_ascii_values(cmd, container=np.array)
+            # The AQ637x series sends REAL data little-endian.
+            return self.osa.query_binary_values(cmd, datatype=datatype, is_big_endian=False,
+                                                container=np.array)
 
     def abort(self) :
         '''Halts a sweep in progress.'''
-        self.osa.write(':ABORT')    
\ No newline at end of file
+        with self.bus:
+            self.osa.write(':ABORT')    
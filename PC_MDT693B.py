@@ -1,19 +1,69 @@
+import re
+import time
+import numpy as np
 import pyvisa
+from StateCache import StateCache
 
 class MDT693B:
     '''A control class for the ThorLabs MDT693B Open-Loop Piezo Controller'''
-    
-    def __init__(self, rm:pyvisa.ResourceManager, id:str) -> None:
+
+    AXES = ('x', 'y', 'z')
+    PROMPT = '>' # The controller ends every reply with this prompt.
+
+    def __init__(self, rm:pyvisa.ResourceManager, id:str, vlimit=150.0) -> None:
         '''This constructor initializes an instrument for remote control via Python.\n
         Arguments:
         - rm [`pyvisa.ResourceManager`]: The ResourceManager object that will establish a connection to the instrument.
         - id [`str`]: The VISA id of the instrument to connect to.
+        - vlimit [`float`]: The output voltage limit set on the controller (75, 100 or 150 V).
         '''
         self.pc = rm.open_resource(id)
+        self.pc.read_termination = self.PROMPT
+        self.vlimit = vlimit
+        # Every command is answered with a reply ending in the prompt. Writes do not wait for it,
+        # so this counts the replies still to be read. See drain.
+        self.pending = 0
+        # Skips voltage writes that would change nothing. Call self.state.invalidate() after
+        # turning the front panel knobs, since the cache cannot see those changes.
+        self.state = StateCache(self.pc)
+        self._send("echo=0") # Replies then only hold the prompt, or the value and the prompt.
+        self.drain(wait=True)
+
+    def _send(self, cmd:str):
+        '''Writes a command without waiting for its reply.'''
+        self.pc.write(cmd)
+        self.pending += 1
+
+    def drain(self, wait=False):
+        '''Reads the replies of earlier commands, so they do not pile up in the input buffer.\n
+        Arguments:
+            - wait [`bool`]: If True, blocks until every pending reply has been read. Otherwise
+                only the bytes that have already arrived are read, in a single call.
+        '''
+        if not wait:
+            try:
+                n = self.pc.bytes_in_buffer
+            except AttributeError: # Not a serial resource, so the replies are read one by one.
+                return
+            if n > 0:
+                self.pending = max(0, self.pending - self.pc.read_bytes(n).count(self.PROMPT.encode()))
+            return
+        while self.pending > 0:
+            self.pc.read()
+            self.pending -= 1
+
+    def _query(self, cmd:str):
+        '''Sends a query and returns the numbers in its bracketed reply, ex. "[ 10.00]".'''
+        self.drain(wait=True)
+        self.pc.write(cmd)
+        reply = self.pc.read()
+        return [float(v) for v in re.findall(r'[-+]?\d+(?:\.\d*)?', reply.split('[')[-1])]
 
     def set_all_volts(self, volt=0.0):
         '''This command will set the output voltage of all axes to the specified value, in volts.'''
-        self.pc.write("allvoltage=" + str(volt))
+        if self.state.write_all(['x', 'y', 'z'], volt, "allvoltage=" + str(volt)):
+            self.pending += 1
+            self.drain()
 
     def set_voltage(self, channel:str, volt=0.0):
         '''Sets the output voltage of a specified channel to a given voltage.\n
@@ -25,9 +75,26 @@ class MDT693B:
         if channel not in ['x','y','z']:
             # Handles invalid channel input by doing nothing.
             pass
-        else:
-            self.pc.write(channel + "voltage=" + str(volt))
-    
+        elif self.state.write(channel, volt, channel + "voltage=" + str(volt)):
+            self.pending += 1
+            self.drain()
+
+    def set_xyz(self, x, y, z):
+        '''Sets the voltages of all three axes with a single command. Axes given as None keep
+        their voltage. Does not wait for the controller's reply.'''
+        values = {a: float(v) for a, v in zip(self.AXES, (x, y, z)) if v is not None}
+        if len(values) < 3:
+            values = {a: values.get(a, self.state.get(a)) for a in self.AXES}
+            if None in values.values():
+                # Voltage of an axis unknown, so fall back to per-axis writes.
+                for axis, volt in values.items():
+                    if volt is not None:
+                        self.set_voltage(axis, volt)
+                return
+        cmd = "xyzvoltage=" + ",".join('%.2f' % values[a] for a in self.AXES)
+        if self.state.write_many(values, cmd):
+            self.pending += 1
+
     def get_voltage(self, channel:str):
         '''Get the current voltage of a specific axis.\n
         Arguments:
@@ -37,8 +104,139 @@ class MDT693B:
             # Handles invalid channel input by doing nothing.
             pass
         else:
-            return self.pc.query_ascii_values(channel + "voltage?")
+            return self._query(channel + "voltage?")
+
+    def get_voltages(self):
+        '''Returns the voltages of all three axes with a single query.'''
+        return self._query("xyzvoltage?")
+
+    def scan(self, points, power_meter=None, read_fn=None, averaging=None, settle=0.0, sync=True):
+        '''Visits a list of setpoints and measures the power at each one.\n
+        Each point costs one xyzvoltage write and one power reading. The controller's replies are
+        drained from the input buffer as they arrive rather than read one by one.\n
+        Arguments:
+            - points: An (N, 3) array of x, y, z voltages, or (N, 2) of x, y voltages at the current z.
+            - power_meter: The `PowerMeter` to read at each point.
+            - read_fn: Instead of power_meter, any function returning one reading.
+            - averaging [`int`]: If given, the power meter averaging is set to this first.
+            - settle [`float`]: Seconds to wait between a setpoint and its reading.
+            - sync [`bool`]: If True (default), waits for the controller to acknowledge each
+                setpoint before reading. If False, setpoints are streamed and the reading only
+                waits for settle, which saves a reply round trip per point. raster, hill_climb and
+                align stream by default.
+        Returns:
+            (numpy array): The power at each point.
+        '''
+        points = np.asarray(points, dtype=float)
+        if points.ndim != 2 or points.shape[1] not in (2, 3):
+            raise ValueError("points must have shape (N, 2) or (N, 3)")
+        points = np.clip(points, 0, self.vlimit)
+        if read_fn is None:
+            if averaging is not None:
+                power_meter.set_averaging(averaging)
+            read_fn = lambda: power_meter.read_pow()[0]
+        powers = np.empty(len(points))
+        for i, p in enumerate(points):
+            self.set_xyz(p[0], p[1], p[2] if len(p) == 3 else None)
+            if sync:
+                self.drain(wait=True)
+            if settle > 0:
+                time.sleep(settle)
+            powers[i] = read_fn()
+            self.drain()
+        self.drain(wait=True)
+        return powers
+
+    def raster(self, x, y, z=None, snake=True, sync=False, **scan_args):
+        '''Scans an x/y grid and returns the 2D power map.\n
+        Arguments:
+            - x, y: The voltages along each axis.
+            - z [`float`]: The z voltage for the scan. Defaults to the current one.
+            - snake [`bool`]: If True, every other row is scanned backwards, so that the piezo never
+                jumps across the whole grid between rows.
+            - sync [`bool`]: See scan. Defaults to False: the setpoints are streamed, and each
+                reading only waits for settle after its setpoint was written. Give settle= (the
+                response time of the piezo and the optics), or sync=True to wait for the
+                controller's acknowledgement of each setpoint.
+            - scan_args: Passed on to scan, ex. power_meter=pm, averaging=5, settle=0.002.
+        Returns:
+            (numpy array): The power map, with shape (len(y), len(x)).
+        '''
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        xx, yy = np.meshgrid(x, y)
+        if snake:
+            xx[1::2] = xx[1::2, ::-1]
+        pts = np.column_stack((xx.ravel(), yy.ravel()))
+        if z is not None:
+            pts = np.column_stack((pts, np.full(len(pts), float(z))))
+        powers = self.scan(pts, sync=sync, **scan_args).reshape(len(y), len(x))
+        if snake:
+            powers[1::2] = powers[1::2, ::-1]
+        return powers
+
+    def hill_climb(self, start=None, step=5.0, min_step=0.2, axes=('x', 'y'), max_evals=200, sync=False, **scan_args):
+        '''Finds the voltages that maximize the power by coordinate ascent: each axis is moved
+        by +-step while that improves the power, and the step is halved when no move helps.\n
+        Arguments:
+            - start: The (x, y, z) voltages to start from, or (x, y), or (x,), in which case the other
+                axes start from their current voltages. Defaults to the current voltages.
+            - step [`float`]: The initial step in volts.
+            - min_step [`float`]: The search stops once the step falls below this.
+            - axes: The axes to optimize.
+            - max_evals [`int`]: The maximum number of power readings.
+            - sync [`bool`]: See raster.
+            - scan_args: Passed on to scan, ex. power_meter=pm.
+        Returns:
+            (tuple): The best (x, y, z) voltages, as a numpy array, and the power there. The
+                piezo is left at these voltages.
+        '''
+        start = [] if start is None else list(start)
+        if len(start) > 3:
+            raise ValueError("start holds at most the x, y and z voltages")
+        best = np.array(start if len(start) == 3 else start + self.get_voltages()[len(start):], dtype=float)
+        scan_args['sync'] = sync
+        best_pow = self.scan([best], **scan_args)[0]
+        evals = 1
+        idx = [self.AXES.index(a) for a in axes]
+        while step >= min_step and evals < max_evals:
+            improved = False
+            for i in idx:
+                for sign in (1, -1):
+                    trial = best.copy()
+                    trial[i] = np.clip(trial[i] + sign*step, 0, self.vlimit)
+                    if trial[i] == best[i]:
+                        continue
+                    p = self.scan([trial], **scan_args)[0]
+                    evals += 1
+                    if p > best_pow:
+                        best, best_pow, improved = trial, p, True
+                        break
+            if not improved:
+                step /= 2
+        self.set_xyz(*best)
+        self.drain(wait=True)
+        return best, best_pow
+
+    def align(self, x, y, z=None, step=None, sync=False, **scan_args):
+        '''Coarse raster over the x and y voltages, followed by a hill climb from the best grid point.\n
+        Arguments:
+            - x, y: The grid voltages of the coarse scan.
+            - z [`float`]: The z voltage. Defaults to the current one.
+            - step [`float`]: The initial hill-climb step. Defaults to the grid spacing.
+            - sync [`bool`]: See raster.
+            - scan_args: Passed on to scan, ex. power_meter=pm.
+        Returns:
+            (tuple): The best (x, y, z) voltages and the power there, as for hill_climb.
+        '''
+        if z is None:
+            z = self.get_voltages()[2]
+        power_map = self.raster(x, y, z, sync=sync, **scan_args)
+        iy, ix = np.unravel_index(np.argmax(power_map), power_map.shape)
+        if step is None:
+            step = float(max(np.ptp(x) / max(len(x) - 1, 1), np.ptp(y) / max(len(y) - 1, 1)))
+        return self.hill_climb((x[ix], y[iy], z), step=step / 2, sync=sync, **scan_args)
 
     def close(self):
         '''End pyvisa connection to instrument.'''
-        self.pc.close()
\ No newline at end of file
+        self.drain(wait=True)
+        self.pc.close()
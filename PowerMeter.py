@@ -1,6 +1,16 @@
+import threading
+import time
+import numpy as np
 import pyvisa
+from RingBuffer import RingBuffer
+from StateCache import StateCache
 
 class PowerMeter:
+    # Record stored by the logging thread: Unix time (s) and power (W).
+    LOG_DTYPE = np.dtype([('t', 'f8'), ('power', 'f8')])
+    # Failed reads in a row after which the logging thread gives up.
+    LOG_RETRIES = 3
+
     def __init__(self, rm:pyvisa.ResourceManager, id:str):
         '''Initializes the VISA connection to the power meter and
         sets some default values. \n
@@ -10,23 +20,156 @@ class PowerMeter:
         '''
         self.instr = rm.open_resource(id)
         self.instr.read_termination = '\n'
+        self.state = StateCache(self.instr) # Skips settings writes that would change nothing.
+        self.lock = threading.Lock() # Serializes access between read_pow and the logging thread.
+        self.log = None
+        self.log_error = None # The last error of the logging thread, if any.
+        self._log_rate = None
+        self._log_thread = None
+        self._log_stop = threading.Event()
+        if hasattr(self.instr, 'on_reopen'): # A ResilientIO resource, see _reopened.
+            self.instr.on_reopen.append(self._reopened)
         self.set_averaging(10)
 
+    def _reopened(self):
+        '''Restarts the logging thread after the VISA session was opened again, if it stopped
+        on the lost session. Runs in the thread whose call reconnected, which may hold self.lock,
+        so it takes no lock.'''
+        if self.log is not None and not self._log_stop.is_set() and not self.is_logging():
+            self._start_log_thread()
+
     def set_averaging(self, num_meas):
-        '''Sets the number of observations to average over. Argument num_meas 
+        '''Sets the number of observations to average over. Argument num_meas
         must be an integer.
         '''
-        self.instr.write(":AVER " + str(num_meas))
-    
+        with self.lock:
+            self.state.write(':AVER', num_meas, ":AVER " + str(num_meas))
+
     def read_pow(self):
-        '''Reads a single power observation from the meter and 
-        returns its value.
+        '''Reads a single power observation from the meter and
+        returns its value. While logging is running, this returns the most recent
+        logged sample instead, without using the bus, unless that sample is older than
+        two logging periods (ex. while the logging thread retries a failed read).
         '''
-        self.instr.write('CONF:POW')
-        self.instr.write(':INIT')
-        pow = self.instr.query_ascii_values(':FETCH?')
+        if self.is_logging():
+            latest = self.log.latest()
+            max_age = max(2 / self._log_rate if self._log_rate else 0, 0.5)
+            if latest is not None and time.time() - latest['t'] <= max_age:
+                return [float(latest['power'])]
+        with self.lock:
+            self.state.write('CONF', 'POW', 'CONF:POW') # Only sent if the meter was reconfigured.
+            self.instr.write(':INIT')
+            pow = self.instr.query_ascii_values(':FETCH?')
         return pow
 
+    def start_logging(self, rate=None, capacity=100000, averaging=None):
+        '''Starts a background thread that continuously samples the power into a ring buffer.
+        The meter is configured once, after which every sample costs a single READ? round trip.\n
+        Inputs:
+            rate: Samples per second. Defaults to as fast as the meter answers.
+            capacity: Number of (t, power) samples kept in the ring buffer.
+            averaging: If given, sets the number of observations averaged per sample first.
+                Lower averaging allows higher sample rates.
+        '''
+        self.stop_logging()
+        if averaging is not None:
+            self.set_averaging(averaging)
+        with self.lock:
+            self.state.write('CONF', 'POW', 'CONF:POW')
+        self.log = RingBuffer(capacity, self.LOG_DTYPE)
+        self.log_error = None
+        self._log_rate = rate
+        self._log_stop.clear()
+        self._start_log_thread()
+
+    def _start_log_thread(self):
+        self._log_thread = threading.Thread(target=self._log_loop, args=(self._log_rate,),
+                                            name='PowerMeter-log', daemon=True)
+        self._log_thread.start()
+
+    def _log_loop(self, rate):
+        period = 1 / rate if rate else 0
+        t_next = time.perf_counter()
+        failures = 0
+        while not self._log_stop.is_set():
+            try:
+                with self.lock:
+                    t0 = time.time()
+                    value = self.instr.query_ascii_values('READ?')[0]
+                    t1 = time.time()
+            except Exception as err:
+                # Retry a few times, then stop: is_logging turns False and read_pow uses the bus.
+                # The error is kept in log_error rather than printed from the thread.
+                self.log_error = err
+                failures += 1
+                if failures >= self.LOG_RETRIES:
+                    return
+                self._log_stop.wait(0.1 * failures)
+                t_next = time.perf_counter()
+                continue
+            failures = 0
+            self.log.append(((t0 + t1) / 2, value))
+            if period:
+                t_next += period
+                delay = t_next - time.perf_counter()
+                if delay > 0:
+                    self._log_stop.wait(delay)
+                else:
+                    t_next = time.perf_counter() # Fell behind, do not try to catch up.
+
+    def stop_logging(self):
+        '''Stops the logging thread. The logged samples stay available.'''
+        if self._log_thread is not None:
+            self._log_stop.set()
+            self._log_thread.join()
+            self._log_thread = None
+
+    def is_logging(self):
+        '''Returns True while the logging thread runs. It stops on stop_logging, or by itself
+        after LOG_RETRIES failed reads in a row, with the error in log_error.'''
+        return self._log_thread is not None and self._log_thread.is_alive()
+
+    def snapshot(self, t_start=None, t_end=None):
+        '''Returns the logged samples as a structured array with fields 't' (Unix time in s)
+        and 'power' (W), oldest first.\n
+        Inputs:
+            t_start, t_end: Optional Unix times bounding the returned window.
+        '''
+        if self.log is None:
+            return np.zeros(0, dtype=self.LOG_DTYPE)
+        samples = self.log.snapshot()
+        mask = np.ones(len(samples), dtype=bool)
+        if t_start is not None:
+            mask &= samples['t'] >= t_start
+        if t_end is not None:
+            mask &= samples['t'] <= t_end
+        return samples[mask]
+
+    def stats(self, t_start=None, t_end=None):
+        '''Returns statistics of the logged power over a time window.\n
+        Inputs:
+            t_start, t_end: Optional Unix times bounding the window.
+        Returns:
+            A dict with the number of samples 'n', 'mean' and 'std' of the power (W), and
+            'drift', the slope of a least-squares line through the samples (W/s).
+        '''
+        samples = self.snapshot(t_start, t_end)
+        n = len(samples)
+        if n == 0:
+            return {'n': 0, 'mean': np.nan, 'std': np.nan, 'drift': np.nan}
+        p = samples['power']
+        t = samples['t'] - samples['t'].mean()
+        denom = np.dot(t, t)
+        drift = np.dot(t, p - p.mean()) / denom if denom > 0 else np.nan
+        return {'n': n, 'mean': p.mean(), 'std': p.std(), 'drift': drift}
+
+    def reset(self):
+        '''Resets the meter to its default settings (*RST) and clears the settings cache.'''
+        with self.lock:
+            self.instr.write('*RST')
+            self.state.invalidate()
+
     def close(self):
         '''Closes VISA connection.'''
-        self.instr.close()
\ No newline at end of file
+        self.stop_logging()
+        self.instr.close()
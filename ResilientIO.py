@@ -0,0 +1,334 @@
+'''Fault tolerance for the instrument I/O: calls that fail on a transient error are retried, lost
+sessions are opened again, and a watchdog stops operations that stall.\n
+ResilientResourceManager wraps a ResourceManager, so every driver opened from it is covered
+without changes to the driver:
+```
+rm = ResilientResourceManager(pyvisa.ResourceManager())
+osa = OSA(rm, 'GPIB0::1::INSTR')
+```
+Every error is classified (see classify) as transient (a timeout, a framing error on a serial
+line), as a disconnect (the session or the device is gone) or as fatal (anything else), and:
+- Queries, and writes of commands that can safely be sent twice, are retried after a transient
+  error with an exponential backoff. The replies still queued are cleared before a query is sent
+  again, so a late reply to the failed attempt is not taken for the reply to the new one. Commands
+  whose effect adds up ('*TRG', ':INIT', relative stage moves) are not retried, since the first
+  attempt may have gone through, and neither are queries that clear an event register ('*ESR?',
+  ':STATUS:OPERATION:EVENT?'), since the event may have been read by the lost reply. Nor are bare reads: their command was sent by an earlier call,
+  and the drivers time reads out on purpose to poll (see RotaryStage.wait_move).
+- After a disconnect, the session is opened again, its timeout and terminations are restored,
+  and the settings in the driver's StateCache are written again (see StateCache.replay) in case
+  the instrument was power cycled. Then a write is sent again. A query is not: what it asks for,
+  such as a trace, may have been lost with the session, so its error is raised for the caller to
+  measure again.
+- Fatal errors are raised at once.\n
+A Watchdog guards operations that can stall without any single call timing out, such as an OSA
+sweep that never completes. Once a watched block runs past its deadline, the watchdog calls an
+abort function (ex. OSA.abort) and makes every later call on the watched resources raise
+StalledError, so the block ends instead of hanging.\n
+To trace the I/O as well, attach the SCPITrace.Tracer to the wrapped manager (rm.rm) before
+opening the instruments, so that it sees every attempt.'''
+
+import contextlib
+import re
+import threading
+import time
+from pyvisa import constants, errors
+
+StatusCode = constants.StatusCode
+# VISA errors after which the same call may succeed.
+TRANSIENT_CODES = {
+    StatusCode.error_timeout, StatusCode.error_io, StatusCode.error_resource_busy,
+    StatusCode.error_resource_locked, StatusCode.error_serial_framing, StatusCode.error_serial_overrun,
+    StatusCode.error_serial_parity, StatusCode.error_input_protocol_violation,
+    StatusCode.error_output_protocol_violation,
+}
+# VISA errors after which the session has to be opened again.
+DISCONNECT_CODES = {
+    StatusCode.error_connection_lost, StatusCode.error_invalid_object, StatusCode.error_resource_not_found,
+    StatusCode.error_no_listeners,
+}
+# Messages whose effect depends on how often they are sent: a trigger, a sweep start (a second
+# ':INIT' restarts the sweep), a relative stage move, and the queries of event registers, which
+# clear the register, so a retry would lose an event (ex. the end of an OSA sweep) read by the
+# failed attempt.
+NOT_IDEMPOTENT = re.compile(r'\s*(\*TRG|\*ESR\?|:?INIT(IATE)?(:IMM\w*)?\s*($|;)|'
+                            r':?STAT\w*:\w+(:EVEN\w*)?\?|0(fw|bw|mr))', re.IGNORECASE)
+
+class StalledError(TimeoutError):
+    '''Raised by the calls on a resource whose operation was stopped by a Watchdog.'''
+
+def classify(err) -> str:
+    '''Returns 'transient', 'disconnect' or 'fatal' for an exception raised by a VISA call.'''
+    if isinstance(err, StalledError):
+        return 'fatal'
+    if isinstance(err, errors.VisaIOError):
+        if err.error_code in TRANSIENT_CODES:
+            return 'transient'
+        return 'disconnect' if err.error_code in DISCONNECT_CODES else 'fatal'
+    if isinstance(err, errors.InvalidSession):
+        return 'disconnect'
+    if isinstance(err, TimeoutError): # Ex. a socket timeout of a TCPIP resource.
+        return 'transient'
+    if isinstance(err, OSError): # Ex. the serial port went away.
+        return 'disconnect'
+    return 'fatal'
+
+def idempotent(message) -> bool:
+    '''Returns True if sending message twice has the same effect as sending it once, which is the
+    case for most queries, settings and absolute moves, but not for triggers, sweep starts,
+    relative moves and event register queries.'''
+    if isinstance(message, (bytes, bytearray)):
+        message = bytes(message[:16]).decode('ascii', 'replace')
+    return NOT_IDEMPOTENT.match(message) is None
+
+
+class ResilientResource:
+    '''A VISA resource that retries and reconnects, see the module description. Its other
+    attributes are those of the current session, which is replaced when it is opened again.'''
+
+    # Attributes of the wrapper itself. All others are set on the session, and set again on a new one.
+    _OWN = ('rm', 'address', 'open_kwargs', 'retries', 'backoff', 'max_backoff', 'reconnects',
+            'reconnect_delay', 'resource', 'settings', 'on_reopen', 'cancelled', 'lock', 'counts', '_closed')
+
+    def __init__(self, rm, address:str, retries=3, backoff=0.05, max_backoff=2.0, reconnects=5,
+                 reconnect_delay=0.5, **open_kwargs) -> None:
+        '''Arguments:
+            - rm: The ResourceManager the session is opened, and opened again, with.
+            - address [`str`]: The VISA address of the instrument.
+            - retries [`int`]: The attempts after the first one of a call that may be retried.
+            - backoff [`float`]: Seconds before the first retry. The wait doubles with each retry.
+            - max_backoff [`float`]: The longest wait between two attempts, in s.
+            - reconnects [`int`]: The attempts after the first one to open a lost session again.
+            - reconnect_delay [`float`]: Seconds before the second attempt to open the session.
+                The wait doubles with each attempt, as a USB device can take seconds to come back.
+            - open_kwargs: Passed on to rm.open_resource.
+        '''
+        own = lambda name, value: object.__setattr__(self, name, value)
+        own('rm', rm)
+        own('address', address)
+        own('open_kwargs', open_kwargs)
+        own('retries', retries)
+        own('backoff', backoff)
+        own('max_backoff', max_backoff)
+        own('reconnects', reconnects)
+        own('reconnect_delay', reconnect_delay)
+        own('settings', {}) # Attributes set on the session, restored on a new one.
+        own('on_reopen', []) # Called after the session was opened again, ex. StateCache.replay.
+        own('cancelled', None) # The reason given by the watchdog, while the operation is stopped.
+        own('lock', threading.RLock())
+        own('counts', {'transient': 0, 'disconnect': 0, 'retries': 0, 'reconnects': 0})
+        own('_closed', False)
+        own('resource', rm.open_resource(address, **open_kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        if name in self._OWN:
+            object.__setattr__(self, name, value)
+            return
+        setattr(self.resource, name, value)
+        self.settings[name] = value
+
+    def _call(self, method:str, retry, *args, **kwargs):
+        '''Calls a method of the session. retry is None for calls that are not retried, 'write' for
+        writes and 'query' for queries, whose pending replies are cleared before a retry.'''
+        attempt = 0
+        while True:
+            if self.cancelled is not None:
+                raise StalledError(self.cancelled)
+            resource = self.resource
+            try:
+                return getattr(resource, method)(*args, **kwargs)
+            except Exception as err:
+                kind = classify(err)
+                # Timeouts of reads are passed on uncounted, as the drivers use them to poll.
+                if kind == 'fatal' or self._closed or (kind == 'transient' and retry is None):
+                    raise
+                self.counts[kind] += 1
+                if kind == 'disconnect':
+                    self.reconnect(resource)
+                if retry is None or attempt >= self.retries or (kind == 'disconnect' and retry == 'query'):
+                    raise
+            time.sleep(min(self.backoff * 2 ** attempt, self.max_backoff))
+            if kind == 'transient' and retry == 'query':
+                with contextlib.suppress(Exception):
+                    self.resource.clear()
+            attempt += 1
+            self.counts['retries'] += 1
+
+    def reconnect(self, failed=None):
+        '''Opens the session again, restores its attributes and calls the on_reopen functions.\n
+        Arguments:
+            - failed: The session that failed. If another thread has already replaced it, nothing
+                is done.
+        '''
+        with self.lock:
+            if failed is not None and self.resource is not failed:
+                return
+            with contextlib.suppress(Exception):
+                self.resource.close()
+            for attempt in range(self.reconnects + 1):
+                try:
+                    resource = self.rm.open_resource(self.address, **self.open_kwargs)
+                    break
+                except Exception:
+                    if attempt == self.reconnects:
+                        raise
+                    time.sleep(min(self.reconnect_delay * 2 ** attempt, 30.0))
+            for name, value in self.settings.items():
+                setattr(resource, name, value)
+            self.resource = resource
+            self.counts['reconnects'] += 1
+            for fn in self.on_reopen:
+                fn()
+
+    def cancel(self, reason=None):
+        '''Makes every call raise StalledError(reason), or calls work again if reason is None.'''
+        self.cancelled = reason
+
+    def write(self, message:str, *args, **kwargs):
+        return self._call('write', 'write' if idempotent(message) else None, message, *args, **kwargs)
+
+    def write_raw(self, message:bytes):
+        return self._call('write_raw', 'write' if idempotent(message) else None, message)
+
+    def write_ascii_values(self, message:str, *args, **kwargs):
+        return self._call('write_ascii_values', 'write' if idempotent(message) else None, message, *args, **kwargs)
+
+    def write_binary_values(self, message:str, *args, **kwargs):
+        return self._call('write_binary_values', 'write' if idempotent(message) else None, message, *args, **kwargs)
+
+    def query(self, message:str, *args, **kwargs):
+        return self._call('query', 'query' if idempotent(message) else None, message, *args, **kwargs)
+
+    def query_ascii_values(self, message:str, *args, **kwargs):
+        return self._call('query_ascii_values', 'query' if idempotent(message) else None, message, *args, **kwargs)
+
+    def query_binary_values(self, message:str, *args, **kwargs):
+        return self._call('query_binary_values', 'query' if idempotent(message) else None, message, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        return self._call('read', None, *args, **kwargs)
+
+    def read_raw(self, *args, **kwargs):
+        return self._call('read_raw', None, *args, **kwargs)
+
+    def read_bytes(self, *args, **kwargs):
+        return self._call('read_bytes', None, *args, **kwargs)
+
+    def read_stb(self):
+        return self._call('read_stb', 'write')
+
+    def wait_for_srq(self, *args, **kwargs):
+        return self._call('wait_for_srq', None, *args, **kwargs)
+
+    def assert_trigger(self):
+        return self._call('assert_trigger', None)
+
+    def clear(self):
+        return self._call('clear', 'write')
+
+    def close(self):
+        self._closed = True
+        self.resource.close()
+
+
+class ResilientResourceManager:
+    '''Wraps a ResourceManager so that every resource it opens is a ResilientResource. Its other
+    attributes are those of the wrapped manager.'''
+
+    def __init__(self, rm, **policy) -> None:
+        '''Arguments:
+            - rm: The ResourceManager to wrap, ex. a SimVISA.SimResourceManager.
+            - policy: The retry and reconnect arguments of ResilientResource.
+        '''
+        self.rm = rm
+        self.policy = policy
+        self.resources = {} # Address -> the last ResilientResource opened for it.
+
+    def __getattr__(self, name):
+        return getattr(self.rm, name)
+
+    def open_resource(self, address:str, **kwargs):
+        resource = ResilientResource(self.rm, address, **dict(self.policy, **kwargs))
+        self.resources[address] = resource
+        return resource
+
+    def stats(self) -> dict:
+        '''Returns the transient errors, disconnects, retries and reconnects of each address.'''
+        return {address: dict(res.counts) for address, res in self.resources.items()}
+
+    def report(self, file=None):
+        '''Prints the stats of the addresses that had errors.'''
+        for address, counts in self.stats().items():
+            if counts['transient'] or counts['disconnect']:
+                print("%s: %d transient errors, %d disconnects, %d retries, %d reconnects" % (address,
+                      counts['transient'], counts['disconnect'], counts['retries'], counts['reconnects']), file=file)
+
+
+class Watchdog:
+    '''A thread that stops operations running past their deadline, see watch.'''
+
+    def __init__(self, interval=0.5) -> None:
+        '''Arguments:
+            - interval [`float`]: Seconds between two checks of the deadlines.
+        '''
+        self.interval = interval
+        self.stalls = [] # The names of the operations stopped so far.
+        self._watches = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @contextlib.contextmanager
+    def watch(self, name:str, timeout:float, abort=None, resources=()):
+        '''Watches the operation run in a with block. If it is still running after timeout
+        seconds, abort is called from the watchdog thread, then every later call on resources
+        raises StalledError until the block ends.\n
+        Arguments:
+            - name [`str`]: The name of the operation, for the messages.
+            - timeout [`float`]: Seconds the block may take.
+            - abort (optional): Stops the operation on the instruments, ex. OSA.abort.
+            - resources: The ResilientResources used by the operation.
+        '''
+        entry = {'name': name, 'deadline': time.monotonic() + timeout, 'abort': abort,
+                 'resources': list(resources), 'stalled': False, 'done': False, 'lock': threading.Lock()}
+        with self._lock:
+            self._watches.append(entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='watchdog')
+                self._thread.start()
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                self._watches.remove(entry)
+            with entry['lock']: # Waits for a stop in progress.
+                entry['done'] = True
+                if entry['stalled']:
+                    for res in entry['resources']:
+                        res.cancel(None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                expired = [w for w in self._watches if not w['stalled'] and now > w['deadline']]
+            for entry in expired:
+                self._stop(entry)
+
+    def _stop(self, entry):
+        with entry['lock']:
+            if entry['done']:
+                return
+            entry['stalled'] = True
+            self.stalls.append(entry['name'])
+            print("Watchdog: " + entry['name'] + " stalled, stopping it.")
+            if entry['abort'] is not None:
+                try:
+                    entry['abort']()
+                except Exception as err: # Stop the calls anyway.
+                    print("Watchdog: could not abort " + entry['name'] + ": " + repr(err))
+            for res in entry['resources']:
+                res.cancel(entry['name'] + " stalled")
@@ -0,0 +1,47 @@
+'''A fixed-size, thread-safe ring buffer of numpy records, used by the instrument classes that
+log readings from a background thread.'''
+
+import threading
+import numpy as np
+
+class RingBuffer:
+    '''Keeps the most recent `capacity` records of a structured dtype. Appends overwrite the oldest
+    record once the buffer is full.'''
+
+    def __init__(self, capacity:int, dtype) -> None:
+        '''Arguments:
+            - capacity [`int`]: The number of records kept.
+            - dtype: The numpy dtype of one record, usually a structured dtype.
+        '''
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.count = 0 # Total number of records ever appended.
+        self.lock = threading.Lock()
+
+    def append(self, record):
+        '''Appends one record (a tuple matching the dtype).'''
+        with self.lock:
+            self.data[self.count % self.capacity] = record
+            self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def snapshot(self) -> np.ndarray:
+        '''Returns a copy of the stored records, oldest first.'''
+        with self.lock:
+            if self.count <= self.capacity:
+                return self.data[:self.count].copy()
+            i = self.count % self.capacity
+            return np.concatenate((self.data[i:], self.data[:i]))
+
+    def latest(self):
+        '''Returns the most recent record, or None if the buffer is empty.'''
+        with self.lock:
+            if self.count == 0:
+                return None
+            return self.data[(self.count - 1) % self.capacity].copy()
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
@@ -1,44 +1,180 @@
+import time
 import pyvisa
+from pyvisa import constants, errors
 
-class RotaryStage:  
-    def __init__(self, rm:pyvisa.ResourceManager, address) -> None:
+# Status codes reported by the ELL14 in its GS replies.
+STATUS_CODES = {
+    0: "OK", 1: "Communication time out", 2: "Mechanical time out", 3: "Command error",
+    4: "Value out of range", 5: "Module isolated", 6: "Module out of isolation",
+    7: "Initializing error", 8: "Thermal error", 9: "Busy", 10: "Sensor error",
+    11: "Motor error", 12: "Out of range", 13: "Over current error",
+}
+STATUS_BUSY = 9
+
+def parse_reply(reply:str):
+    '''Splits an ELL14 reply such as "0PO0001A2B3" into its address, command code and data.\n
+    Returns:
+        (str tuple): (address, code, data), ex. ('0', 'PO', '0001A2B3').
+    '''
+    reply = reply.strip()
+    if len(reply) < 3:
+        raise ValueError("Malformed stage reply: " + repr(reply))
+    return reply[0], reply[1:3].upper(), reply[3:]
+
+class RotaryStage:
+    def __init__(self, rm:pyvisa.ResourceManager, address, settle_time=0.0, move_timeout=10.0, home=True) -> None:
         '''Initializes the VISA connection to the rotary stage and
         sets some default values. \n
         Inputs:
             rm: A pyvisa ResourceManager object.
             id: The VISA id string for the powermeter.
+            settle_time (optional): Seconds to wait after each move has completed, for example
+                the time measured by calibrate_settle. Defaults to 0.
+            move_timeout (optional): Seconds a move may take before a TimeoutError is raised.
+            home (optional): If True (default), homes the motor and moves it to 0. If False, the
+                motor stays where it is and its position is read, which saves the homing time when
+                the stage was homed earlier and has not been power cycled since.
         '''
         self.stage = rm.open_resource(address)
         self.stepPerDeg = 262144/360 #Conversion constant.
         self.stage.read_termination = '\r\n'
-        self.stage.write('0ho0') #Home the motor.
-        self.pos = 0 #State variable for motor position.
-        self.move_to_pos(0)
+        self.settle_time = settle_time
+        self.move_timeout = move_timeout
+        self.pos = 0 #State variable for motor position, as last reported by the motor.
+        if home:
+            self.stage.write('0ho0') #Home the motor.
+            self.wait_move()
+            self.move_to_pos(0)
+        else:
+            self.get_pos(query=True)
 
-    def move_to_pos(self, pos):
+    def move_to_pos(self, pos, wait=True):
         '''Moves the motor to a set absolute position in degrees. \n
         Inputs:
             pos: The position in degrees to move the stage to.
+            wait (optional): If True (default), returns once the move has completed and the
+                settle time has passed. Otherwise call wait_move before using the new position.
+        Returns:
+            The position in degrees reported by the motor at the end of the move, or None if
+            wait is False.
         '''
         pos_in_steps = int(self.stepPerDeg * (pos/2)) #Motor is off by factor of 2.
-        hex_pos = "{0:0{1}x}".format(pos_in_steps, 8) #Converts decimal position to 8-digit hexadecimal.
+        hex_pos = "{0:0{1}x}".format(pos_in_steps & 0xFFFFFFFF, 8) #Converts position to 8-digit two's complement hexadecimal.
         self.stage.write("0ma" + hex_pos)
-        self.pos = pos
+        if wait:
+            return self.wait_move()
+        return None
+
+    def wait_move(self, timeout=None, poll_interval=0.05):
+        '''Waits until the current move or homing has completed. The motor answers a move with a PO
+        reply once it stops. While waiting, the status (GS) is polled every poll_interval seconds
+        so that motor errors are caught early.\n
+        Inputs:
+            timeout (optional): Seconds to wait. Defaults to self.move_timeout.
+            poll_interval (optional): Seconds between two status polls.
+        Returns:
+            The position in degrees reported by the motor.
+        Raises:
+            TimeoutError: If the move did not complete in time.
+            RuntimeError: If the motor reports an error.
+        '''
+        deadline = time.perf_counter() + (self.move_timeout if timeout is None else timeout)
+        pending = 0 # Number of status polls whose reply has not been read.
+        old_timeout = self.stage.timeout
+        try:
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise TimeoutError("The stage did not finish its move in time.")
+                self.stage.timeout = max(1, int(1000 * min(poll_interval, remaining)))
+                try:
+                    _, code, data = parse_reply(self.stage.read())
+                except errors.VisaIOError as e:
+                    if e.error_code != constants.StatusCode.error_timeout:
+                        raise
+                    self.stage.write('0gs')
+                    pending += 1
+                    continue
+                if code == 'PO':
+                    self.pos = self.calc_pos(data)
+                    break
+                if code == 'GS':
+                    pending -= 1
+                    status = int(data, 16)
+                    if status == 0:
+                        # Stopped, but the end of move reply was lost. Ask for the position.
+                        self.stage.write('0gp')
+                    elif status != STATUS_BUSY:
+                        raise RuntimeError("Stage error " + str(status) + ": " + STATUS_CODES.get(status, "Unknown"))
+            # Drop the replies to status polls that crossed the end of the move.
+            self.stage.timeout = max(1, int(1000 * poll_interval))
+            for i in range(pending):
+                try:
+                    self.stage.read()
+                except errors.VisaIOError:
+                    break
+        finally:
+            self.stage.timeout = old_timeout
+        if self.settle_time > 0:
+            time.sleep(self.settle_time)
+        return self.pos
 
     def calc_pos(self, posHex, bits=32):
         '''Calculates the position in degrees from the hexadecimal step number
         returned by the motor after it finishes moving.'''
-        # This method should be implemented when the group wants to directly read
-        # the position of the motor. I could not get it to work consistently, so 
-        # I moved on. It was not needed at the time.
-        pass
+        steps = int(posHex, 16)
+        if steps >= 1 << (bits - 1):
+            steps -= 1 << bits # Two's complement for negative positions.
+        return steps * 2 / self.stepPerDeg # Undoes the factor of 2 in move_to_pos.
+
+    def get_status(self):
+        '''Returns the status code of the motor (see STATUS_CODES). Do not call during a move
+        started with wait=False.'''
+        _, code, data = parse_reply(self.stage.query('0gs'))
+        return int(data, 16)
 
-    def get_pos(self):
-        '''Returns current position, in degrees, of the motor.
+    def get_pos(self, query=False):
+        '''Returns current position, in degrees, of the motor, as reported at the end of the
+        last move. If query is True, the position is read from the motor instead.
         '''
+        if query:
+            _, code, data = parse_reply(self.stage.query('0gp'))
+            self.pos = self.calc_pos(data)
         return self.pos
 
+    def calibrate_settle(self, read_fn, step=10.0, tol=0.01, window=5, max_time=5.0):
+        '''Measures how long a signal takes to settle after a move, and uses that as the settle
+        time of every later move.\n
+        Inputs:
+            read_fn: Returns one reading of a signal that depends on the stage, ex. the read_pow
+                method of a PowerMeter.
+            step (optional): Degrees to move back and forth for the measurement.
+            tol (optional): Relative spread of window consecutive readings that counts as settled.
+            window (optional): Number of consecutive readings compared.
+            max_time (optional): Longest settle time allowed, in seconds.
+        Returns:
+            The settle time in seconds.
+        '''
+        start = self.pos
+        self.settle_time = 0.0
+        self.move_to_pos(start + step)
+        t_stop = time.perf_counter()
+        readings, times = [], []
+        settle = max_time
+        while time.perf_counter() - t_stop < max_time:
+            times.append(time.perf_counter())
+            value = read_fn()
+            readings.append(float(value[0] if hasattr(value, '__len__') else value))
+            recent = readings[-window:]
+            mean = sum(recent) / len(recent)
+            if len(recent) == window and max(recent) - min(recent) <= tol * abs(mean):
+                settle = times[-window] - t_stop # Settled from the first reading of the window on.
+                break
+        self.move_to_pos(start)
+        self.settle_time = settle
+        return settle
+
     def close(self):
         '''Closes VISA connection.'''
         self.move_to_pos(0)
-        self.stage.close()
\ No newline at end of file
+        self.stage.close()
@@ -0,0 +1,119 @@
+'''A checkpoint journal for acquisition runs, so that an interrupted run can be resumed where it
+stopped instead of repeating every sweep.\n
+The manifest is a JSON file (manifest.json) in the dataset directory. It holds the run config
+(instrument addresses, positions and sweep config), and one record per completed position with its
+dataset entries, the dataset file offsets after them and the instrument settings at the time.
+It is rewritten after every position through a temporary file and os.replace, so a crash leaves
+either the old or the new version on disk, never a partial one.'''
+
+import datetime
+import json
+import os
+import time
+import numpy as np
+
+MANIFEST_FILE = 'manifest.json'
+
+def _jsonable(value):
+    '''Converts cached instrument settings to JSON-friendly values.'''
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+class RunManifest:
+    '''The run config and the list of completed positions of one run.'''
+
+    def __init__(self, path:str, config:dict) -> None:
+        '''Starts a new manifest. Use load to open the manifest of an existing run.\n
+        Arguments:
+            - path [`str`]: The dataset directory of the run.
+            - config [`dict`]: Everything needed to restart the run, for example the instrument
+                addresses, the list of positions and the sweep config lines. Must be JSON-serializable.
+        '''
+        self.path = path
+        self.config = config
+        self.completed = []
+        self.status = 'running'
+        self.error = None
+        self.created = str(datetime.datetime.now())
+        self.save()
+
+    @classmethod
+    def load(cls, path:str):
+        '''Opens the manifest of the run in the dataset directory path.'''
+        with open(os.path.join(path, MANIFEST_FILE)) as file:
+            state = json.load(file)
+        manifest = cls.__new__(cls)
+        manifest.path = path
+        manifest.config = state['config']
+        manifest.completed = state['completed']
+        manifest.status = state['status']
+        manifest.error = state.get('error')
+        manifest.created = state.get('created')
+        return manifest
+
+    def save(self):
+        '''Writes the manifest atomically.'''
+        state = {'config': self.config, 'status': self.status, 'error': self.error,
+                 'created': self.created, 'updated': str(datetime.datetime.now()),
+                 'completed': self.completed}
+        target = os.path.join(self.path, MANIFEST_FILE)
+        tmp = target + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(state, file, indent=1)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, target)
+
+    def done(self):
+        '''Returns the set of indices of the completed positions.'''
+        return {rec['index'] for rec in self.completed}
+
+    def remaining(self):
+        '''Returns the indices of the positions still to be measured, in order.'''
+        done = self.done()
+        return [i for i in range(len(self.config['positions'])) if i not in done]
+
+    def resume(self, writer):
+        '''Prepares a resumed run: drops the dataset entries written after the last checkpoint,
+        which will be measured again, and marks the run as running.\n
+        Arguments:
+            - writer: The SweepDatasetWriter of the run, opened with append=True.
+        '''
+        writer.truncate(sum(len(rec.get('entries', [rec.get('entry')])) for rec in self.completed))
+        self.status = 'running'
+        self.error = None
+        self.save()
+
+    def record(self, index:int, entries, writer, angle=None, settings=None):
+        '''Checkpoints a completed position.\n
+        Arguments:
+            - index [`int`]: The index of the position in config['positions'].
+            - entries: The dataset entry it was stored as, or a list of entries (one per band).
+            - writer: The SweepDatasetWriter, whose file offsets are recorded.
+            - angle [`float`]: The measured stage angle.
+            - settings [`dict`]: The instrument settings, ex. {'osa': osa.state.values}.
+        '''
+        self.completed.append({
+            'index': index, 'entries': [int(e) for e in np.atleast_1d(entries)], 'angle': angle, 'time': time.time(),
+            'trace_offset': writer.offset, 'aux_offset': writer.aux_offset,
+            'settings': _jsonable(settings or {}),
+        })
+        self.save()
+
+    def finish(self, error=None):
+        '''Marks the run as complete, or as failed with the given exception.'''
+        if error is None:
+            self.status = 'complete' if not self.remaining() else 'incomplete'
+        else:
+            self.status = 'failed'
+            self.error = repr(error)
+        self.save()
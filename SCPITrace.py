@@ -0,0 +1,209 @@
+'''Tracing of the instrument I/O: the command, instrument, latency, bytes sent and received and
+timeouts of every write, read and query of the drivers, with per-command statistics and a timeline
+that can be opened in a Chrome-trace viewer (chrome://tracing or https://ui.perfetto.dev).\n
+The tracer patches the I/O methods of individual VISA resources, so the drivers need no changes:
+```
+tracer = Tracer()
+tracer.attach_manager(rm)      # Traces every resource opened from rm from now on.
+tracer.attach(osa.osa)         # Or trace a resource that is already open.
+...
+tracer.report()
+tracer.export_chrome('trace.json')
+tracer.stop()                  # Restores the original methods.
+```
+Nothing is patched while tracing is off, so it then costs nothing. Other steps of a run, such as
+writing the dataset, can be marked with `with span('store'):`, which is a no-op unless a tracer has
+been started.'''
+
+import contextlib
+import json
+import re
+import threading
+import time
+from collections import deque
+import numpy as np
+from pyvisa import constants, errors
+
+# The methods that are timed. Calls made by these methods to each other (query calls write and
+# read, for example) are part of the outer call and are not recorded again.
+TIMED_METHODS = ('write', 'read', 'query', 'write_raw', 'read_raw', 'read_bytes', 'query_ascii_values',
+                 'query_binary_values', 'write_binary_values', 'write_ascii_values', 'read_stb',
+                 'wait_for_srq', 'assert_trigger', 'clear')
+# Upper edges of the latency histogram bins, in s.
+HIST_EDGES = np.array([1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0, np.inf])
+
+_active = None
+_no_span = contextlib.nullcontext()
+
+def span(name:str, cat='run'):
+    '''Marks a step of a run in the timeline of the active tracer. A no-op if no tracer is active.'''
+    return _active.span(name, cat) if _active is not None else _no_span
+
+def command_key(cmd:str) -> str:
+    '''Returns the command of a message without its arguments, used to group statistics. For
+    example ':SENS:WAV:STAR 1500NM' gives ':SENS:WAV:STAR', 'xvoltage=10' gives 'xvoltage' and
+    the ELL14 move '0ma0000A000' gives '0ma'.'''
+    cmd = cmd.strip()
+    m = re.match(r'(\d[a-zA-Z]{2})[0-9A-Fa-f]*$', cmd)
+    if m:
+        return m.group(1)
+    return re.split(r'[\s=]', cmd, 1)[0]
+
+
+class Tracer:
+    '''Records the I/O of the resources attached to it.'''
+
+    def __init__(self, capacity=1000000) -> None:
+        '''Arguments:
+            - capacity [`int`]: The number of events kept. Older events are dropped.
+        '''
+        # Event tuples: (start, duration, instrument, method, command, bytes out, bytes in, timeout, thread).
+        self.events = deque(maxlen=capacity)
+        self.t0 = time.perf_counter()
+        self._local = threading.local()
+        self._patched = [] # (object, attribute) pairs to restore.
+
+    def start(self):
+        '''Makes this the tracer that span() records to.'''
+        global _active
+        _active = self
+        return self
+
+    def stop(self):
+        '''Restores the original methods of every attached resource and deactivates spans.'''
+        global _active
+        for obj, attr in reversed(self._patched):
+            with contextlib.suppress(AttributeError):
+                delattr(obj, attr)
+        self._patched.clear()
+        if _active is self:
+            _active = None
+
+    def attach_manager(self, rm, names=None):
+        '''Traces every resource opened from the resource manager rm from now on.\n
+        Arguments:
+            - rm: A pyvisa ResourceManager or SimVISA.SimResourceManager.
+            - names [`dict`]: Optional labels for the timeline, keyed by VISA address.
+        '''
+        names = names or {}
+        open_resource = rm.open_resource
+        def traced_open(address, *args, **kwargs):
+            resource = open_resource(address, *args, **kwargs)
+            self.attach(resource, names.get(address))
+            return resource
+        rm.open_resource = traced_open
+        self._patched.append((rm, 'open_resource'))
+        return rm
+
+    def attach(self, resource, name:str=None):
+        '''Traces an open resource.\n
+        Arguments:
+            - resource: The VISA resource, ex. osa.osa.
+            - name [`str`]: The label of the instrument. Defaults to its VISA address.
+        '''
+        name = name or resource.resource_name
+        count = [0, 0] # Bytes written and read, counted by the lowest level methods.
+        def counted(fn, i):
+            def wrapper(*args, **kwargs):
+                result = fn(*args, **kwargs)
+                count[i] += result if i == 0 else len(result)
+                return result
+            return wrapper
+        # pyvisa reads go through _read_raw, SimVISA reads through read_raw.
+        raw_read = '_read_raw' if hasattr(resource, '_read_raw') else 'read_raw'
+        originals = {m: getattr(resource, m) for m in TIMED_METHODS + (raw_read,) if hasattr(resource, m)}
+        originals['write_raw'] = counted(originals['write_raw'], 0)
+        originals[raw_read] = counted(originals[raw_read], 1)
+        for method, fn in originals.items():
+            if method in TIMED_METHODS:
+                fn = self._timed(fn, name, method, count)
+            setattr(resource, method, fn)
+            self._patched.append((resource, method))
+        return resource
+
+    def _timed(self, fn, name, method, count):
+        local = self._local
+        def wrapper(*args, **kwargs):
+            if getattr(local, 'busy', False):
+                return fn(*args, **kwargs)
+            local.busy = True
+            sent, received = count
+            result = None
+            timeout = False
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            except errors.VisaIOError as err:
+                timeout = err.error_code == constants.StatusCode.error_timeout
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                local.busy = False
+                n_in = count[1] - received
+                if method == 'read_bytes' and n_in == 0 and result is not None:
+                    n_in = len(result) # pyvisa's read_bytes bypasses _read_raw.
+                cmd = args[0] if args else ''
+                if isinstance(cmd, bytes):
+                    cmd = cmd[:64].decode('ascii', 'replace')
+                self.events.append((start, duration, name, method, str(cmd)[:64].strip(),
+                                    count[0] - sent, n_in, timeout, threading.get_ident()))
+        return wrapper
+
+    @contextlib.contextmanager
+    def span(self, name:str, cat='run'):
+        '''Records the time spent in a with block as an event of the timeline.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((start, time.perf_counter() - start, cat, 'span', name, 0, 0, False,
+                                threading.get_ident()))
+
+    def summary(self):
+        '''Returns the statistics of each instrument and command, as a dict keyed by
+        (instrument, command) with the count, total/mean/median/p95/max latency in s, bytes out
+        and in, timeouts and the latency histogram (counts per HIST_EDGES bin).'''
+        groups = {}
+        for ev in list(self.events):
+            key = (ev[2], ev[4] if ev[3] == 'span' else command_key(ev[4]) or ev[3])
+            groups.setdefault(key, []).append(ev)
+        stats = {}
+        for key, evs in groups.items():
+            t = np.array([ev[1] for ev in evs])
+            stats[key] = {
+                'count': len(t), 'total': t.sum(), 'mean': t.mean(), 'median': np.median(t),
+                'p95': np.percentile(t, 95), 'max': t.max(),
+                'bytes_out': sum(ev[5] for ev in evs), 'bytes_in': sum(ev[6] for ev in evs),
+                'timeouts': sum(ev[7] for ev in evs),
+                'histogram': np.bincount(np.searchsorted(HIST_EDGES, t), minlength=len(HIST_EDGES)).tolist(),
+            }
+        return stats
+
+    def report(self, top=30, file=None):
+        '''Prints the commands that took the most time in total.'''
+        stats = sorted(self.summary().items(), key=lambda kv: -kv[1]['total'])[:top]
+        print("%-16s %-24s %7s %9s %9s %9s %10s %10s %4s" % ('instrument', 'command', 'count', 'total s',
+              'mean ms', 'p95 ms', 'bytes out', 'bytes in', 'tmo'), file=file)
+        for (instr, cmd), s in stats:
+            print("%-16s %-24s %7d %9.3f %9.3f %9.3f %10d %10d %4d" % (instr[:16], cmd[:24], s['count'], s['total'],
+                  s['mean'] * 1e3, s['p95'] * 1e3, s['bytes_out'], s['bytes_in'], s['timeouts']), file=file)
+
+    def export_chrome(self, path:str):
+        '''Writes the timeline in the Chrome trace event format. Each instrument and each thread
+        that marked spans gets its own row.'''
+        rows = {}
+        trace = []
+        for start, duration, name, method, cmd, sent, received, timeout, thread in list(self.events):
+            row = 'thread %d' % thread if method == 'span' else name
+            if row not in rows:
+                rows[row] = len(rows) + 1
+                trace.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': rows[row], 'args': {'name': row}})
+            event = {'name': cmd if method == 'span' else command_key(cmd) or method, 'cat': name, 'ph': 'X',
+                     'pid': 1, 'tid': rows[row], 'ts': (start - self.t0) * 1e6, 'dur': duration * 1e6}
+            if method != 'span':
+                event['args'] = {'method': method, 'message': cmd, 'bytes_out': sent, 'bytes_in': received,
+                                 'timeout': timeout}
+            trace.append(event)
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
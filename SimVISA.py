@@ -0,0 +1,729 @@
+'''A small in-process stand-in for a pyvisa ResourceManager, so that the driver classes can be
+exercised and benchmarked without hardware. Each simulated resource keeps count of the bytes that
+cross the "bus", and can optionally add a per-command latency and a finite transfer bandwidth.
+Faults (timeouts, lost replies, disconnects) can be injected to test error handling, see
+SimDevice.inject.'''
+
+import copy
+import time
+import numpy as np
+from pyvisa import util, constants, errors
+
+class SimResource:
+    '''Imitates the parts of a pyvisa MessageBasedResource that the drivers use. Messages are
+    forwarded as raw bytes to a device model, and replies are parsed with the same pyvisa helpers
+    a real session uses, so parse costs are representative.'''
+
+    def __init__(self, device, address:str, latency=0.0, bandwidth=None) -> None:
+        '''Arguments:
+            - device: The simulated instrument that handles the messages.
+            - address [`str`]: The VISA address the resource was opened with.
+            - latency [`float`]: Seconds added to every write and read.
+            - bandwidth [`float`]: Bytes per second of the simulated bus. `None` means unlimited.
+        '''
+        self.device = device
+        self.resource_name = address
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.timeout = 2000
+        self.read_termination = None
+        self.write_termination = '\n'
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.closed = False
+        self.dead = False # Set by an injected disconnect, until the resource is opened again.
+        self._replies = []
+
+    def _check_connection(self):
+        if self.dead:
+            raise errors.VisaIOError(constants.StatusCode.error_connection_lost)
+
+    def _bus_delay(self, nbytes):
+        delay = self.latency
+        if self.bandwidth:
+            delay += nbytes / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def write_raw(self, message:bytes):
+        self._check_connection()
+        fault = self.device.next_fault(message) if self.device.faults else None
+        if fault == 'timeout':
+            raise errors.VisaIOError(constants.StatusCode.error_timeout)
+        if fault in ('disconnect', 'power_cycle'):
+            self.dead = True
+            if fault == 'power_cycle':
+                self.device.power_cycle()
+            raise errors.VisaIOError(constants.StatusCode.error_connection_lost)
+        self._bus_delay(len(message))
+        self.bytes_written += len(message)
+        reply = self.device.handle(message)
+        if reply is not None and fault != 'no_reply':
+            self._replies.append(reply)
+        return len(message)
+
+    def read_raw(self, _arrived=False) -> bytes:
+        self._check_connection()
+        if not self._replies:
+            # A real session would wait for the full timeout here.
+            raise errors.VisaIOError(constants.StatusCode.error_timeout)
+        # Replies are sent in the order they become ready, so an immediate reply can overtake a
+        # deferred one, like a status reply arriving during a stage move.
+        i = min(range(len(self._replies)), key=lambda k: self._replies[k][0] if isinstance(self._replies[k], tuple) else 0)
+        reply = self._replies[i]
+        if isinstance(reply, tuple):
+            # Deferred reply, only sent by the device at time reply[0].
+            wait = reply[0] - time.perf_counter()
+            if self.timeout is not None and wait > self.timeout / 1000:
+                time.sleep(self.timeout / 1000)
+                raise errors.VisaIOError(constants.StatusCode.error_timeout)
+            if wait > 0:
+                time.sleep(wait)
+            reply = reply[1]
+        self._replies.pop(i)
+        if _arrived:
+            # Bytes already in the input buffer: no latency, only the copy out of it.
+            if self.bandwidth:
+                time.sleep(len(reply) / self.bandwidth)
+        else:
+            self._bus_delay(len(reply))
+        self.bytes_read += len(reply)
+        return reply
+
+    @property
+    def bytes_in_buffer(self):
+        '''Number of reply bytes that have arrived and not been read, like on a serial resource.'''
+        now = time.perf_counter()
+        return sum(len(r[1]) if isinstance(r, tuple) else len(r) for r in self._replies
+                   if not isinstance(r, tuple) or r[0] <= now)
+
+    def read_bytes(self, count:int) -> bytes:
+        '''Reads count bytes, across reply boundaries, like pyvisa's read_bytes. Bytes that have
+        already arrived (see bytes_in_buffer) are read without the message latency.'''
+        data = b''
+        while len(data) < count:
+            data += self.read_raw(_arrived=count <= self.bytes_in_buffer)
+        if len(data) > count:
+            self._replies.insert(0, data[count:])
+            self.bytes_read -= len(data) - count
+        return data[:count]
+
+    def write(self, message:str):
+        return self.write_raw((message + (self.write_termination or '')).encode('ascii'))
+
+    def read(self) -> str:
+        msg = self.read_raw().decode('ascii')
+        if self.read_termination and msg.endswith(self.read_termination):
+            msg = msg[:-len(self.read_termination)]
+        return msg
+
+    def query(self, message:str) -> str:
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(self, message:str, converter='f', separator=',', container=list):
+        return util.from_ascii_block(self.query(message), converter, separator, container)
+
+    def query_binary_values(self, message:str, datatype='f', is_big_endian=False, container=list):
+        self.write(message)
+        return util.from_ieee_block(self.read_raw(), datatype, is_big_endian, container)
+
+    def write_binary_values(self, message:str, values, datatype='f', is_big_endian=False):
+        block = util.to_ieee_block(values, datatype, is_big_endian)
+        term = (self.write_termination or '').encode('ascii')
+        return self.write_raw(message.encode('ascii') + block + term)
+
+    def wait_for_srq(self, timeout=25000):
+        '''Waits up to timeout ms for the device to request service.'''
+        self._check_connection()
+        t_end = time.perf_counter() + (timeout or 0) / 1000
+        while not self.device.service_request():
+            if time.perf_counter() >= t_end:
+                raise errors.VisaIOError(constants.StatusCode.error_timeout)
+            time.sleep(0.001)
+
+    def clear(self):
+        '''Discards the replies that have not been read, like a device clear.'''
+        self._check_connection()
+        self._replies.clear()
+
+    def reset_counters(self):
+        '''Zeroes the byte counters.'''
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    @property
+    def session(self):
+        '''Raises InvalidSession once closed, like a pyvisa resource.'''
+        if self.closed:
+            raise errors.InvalidSession()
+        return id(self)
+
+    def close(self):
+        self.closed = True
+
+
+class SimDevice:
+    '''Base class for simulated instruments. Subclasses implement `command` and return the reply
+    to a message as bytes, or `None` for messages that produce no reply. A reply can also be a
+    tuple (time, bytes) for replies the device only sends at a later `time.perf_counter()`.
+    Setting `latency` or `bandwidth` on a device overrides the resource manager defaults.'''
+
+    latency = None
+    bandwidth = None
+    faults = () # Injected faults, see inject.
+    offline = 0 # Number of attempts to open the device that fail, see inject.
+
+    def inject(self, fault:str, count=1, after=0, match=None, rate=None, seed=0, reopen_failures=0):
+        '''Makes later messages to the device fail, to test error handling. The faults belong to
+        the device, so they also apply to resources opened again after a disconnect.\n
+        Arguments:
+            - fault [`str`]: 'timeout': the message is lost and the write times out.
+                'no_reply': the message is handled but its reply is lost, so the read times out.
+                'disconnect': the write fails with a lost connection, and so does every later call
+                on the resource until the device is opened again. 'power_cycle': a disconnect after
+                which the device is back at its power-on settings.
+            - count [`int`]: The number of messages that fail. `None` for no limit.
+            - after [`int`]: The number of matching messages let through before the first fault.
+            - match [`str`]: Only messages containing this text (case-insensitive) fail. Defaults
+                to all messages.
+            - rate [`float`]: If given, each matching message fails with this probability instead.
+            - seed [`int`]: Seed of the random faults.
+            - reopen_failures [`int`]: For disconnects, the number of attempts to open the device
+                again that fail, as while a USB device enumerates again.
+        '''
+        if fault not in ('timeout', 'no_reply', 'disconnect', 'power_cycle'):
+            raise ValueError("Unknown fault " + repr(fault))
+        if not self.faults:
+            self.faults = []
+        self.faults.append({'fault': fault, 'count': count, 'after': after, 'rate': rate,
+                            'match': None if match is None else match.upper().encode('ascii'),
+                            'rng': np.random.default_rng(seed), 'reopen_failures': reopen_failures})
+
+    def next_fault(self, message:bytes):
+        '''Returns the fault injected into message, or None.'''
+        head = message[:64].upper()
+        for f in self.faults:
+            if f['match'] is not None and f['match'] not in head:
+                continue
+            if f['after'] > 0:
+                f['after'] -= 1
+                continue
+            if f['rate'] is not None and f['rng'].random() >= f['rate']:
+                continue
+            if f['count'] is not None:
+                f['count'] -= 1
+                if f['count'] <= 0:
+                    self.faults.remove(f)
+            if f['fault'] in ('disconnect', 'power_cycle'):
+                self.offline = f['reopen_failures']
+            return f['fault']
+        return None
+
+    def save_power_on(self):
+        '''Remembers the current settings as those the device has after power_cycle.'''
+        self._power_on = {k: copy.deepcopy(v) if isinstance(v, (dict, list)) else v
+                          for k, v in vars(self).items() if k not in ('_power_on', 'faults', 'offline')}
+
+    def power_cycle(self):
+        '''Restores the settings saved by save_power_on.'''
+        for k, v in getattr(self, '_power_on', {}).items():
+            setattr(self, k, copy.deepcopy(v) if isinstance(v, (dict, list)) else v)
+
+    def handle(self, message:bytes):
+        cmd = message.decode('ascii', errors='replace').strip()
+        return self.command(cmd)
+
+    def command(self, cmd:str):
+        return None
+
+    def service_request(self):
+        '''Returns True while the device asserts SRQ.'''
+        return False
+
+
+class SimSCPIDevice(SimDevice):
+    '''A generic SCPI instrument. It remembers the last argument written with each command header
+    and returns it when that header is queried, so simple setters and getters round-trip.'''
+
+    def __init__(self) -> None:
+        self.settings = {}
+
+    def command(self, cmd:str):
+        head, _, arg = cmd.partition(' ')
+        head = head.upper()
+        if head.endswith('?'):
+            return (self.settings.get(head[:-1], '0') + '\n').encode('ascii')
+        self.settings[head] = arg.strip()
+        return None
+
+
+class SimAWG(SimSCPIDevice):
+    '''Simulates an arbitrary waveform generator (33220A or DG4000). Uploads are decoded into
+    `waveform`, normalized to [-1, 1] like the points given to write_pts, so that the binary and
+    ASCII paths can be checked against each other. Benchmarks can turn decoding off, so the
+    simulated instrument adds no parse time of its own.'''
+
+    # DAC code range of the binary uploads: 14-bit signed on the 33220A, 14-bit unsigned on the DG4000.
+    DAC_RANGE = {b'DATA:DAC': (-8191, 8191), b':TRACE:DATA:DAC16': (0, 16383)}
+
+    def __init__(self, decode=True) -> None:
+        '''Arguments:
+            - decode [`bool`]: Decode the uploaded points into `waveform`.
+        '''
+        super().__init__()
+        self.decode = decode
+        self.upload_points = 0 # Points in the last waveform upload.
+        self.upload_bytes = 0  # Size in bytes of the last waveform upload.
+        self.waveform = None   # The last uploaded waveform, if decode is set.
+        self._continued = False # True while a multi-packet DAC16 upload is in progress.
+        self._codes = []       # DAC codes of the packets of a DAC16 upload so far.
+
+    def handle(self, message:bytes):
+        head = message[:32].upper()
+        if head.startswith((b'DATA VOLATILE', b':TRACE:DATA:DATA VOLATILE')):
+            self.upload_points = message.count(b',')
+            self.upload_bytes = len(message)
+            if self.decode:
+                values = message.split(b',', 1)[1].decode('ascii')
+                self.waveform = np.array(values.split(','), dtype=float)
+        elif head.startswith((b'DATA:DAC VOLATILE', b':TRACE:DATA:DAC16 VOLATILE')):
+            start = message.index(b'#')
+            ndigits = int(message[start+1:start+2])
+            nbytes = int(message[start+2:start+2+ndigits])
+            if not self._continued:
+                self.upload_points = 0
+                self.upload_bytes = 0
+                self._codes = []
+            self.upload_points += nbytes // 2
+            self.upload_bytes += len(message)
+            self._continued = b',CON,' in head
+            if self.decode:
+                command = head.split(b' ')[0]
+                if command == b'DATA:DAC':
+                    # The 33220A sends big-endian by default (FORM:BORD NORM), little-endian with SWAP.
+                    big = self.settings.get('FORM:BORD', 'NORM').upper().startswith('NORM')
+                    codes = util.from_ieee_block(message[start:], 'h', big, np.array)
+                else:
+                    codes = util.from_ieee_block(message[start:], 'H', False, np.array)
+                self._codes.append(codes)
+                if not self._continued:
+                    lo, hi = self.DAC_RANGE[command]
+                    half = (hi - lo) / 2
+                    self.waveform = (np.concatenate(self._codes) - (lo + half)) / half
+        else:
+            return super().handle(message)
+        return None
+
+
+class SimE36300(SimDevice):
+    '''Simulates a Keysight E36300 power supply with a resistive load on each channel. Every MEAS
+    command in a (possibly compound) query takes meas_time.'''
+
+    def __init__(self, load=(10.0, 10.0, 10.0), meas_time=0.0) -> None:
+        '''Arguments:
+            - load: The load resistance in ohms on channels 1 to 3.
+            - meas_time [`float`]: Seconds one MEAS command takes.
+        '''
+        self.load = load
+        self.meas_time = meas_time
+        self.volt = [0.0]*3
+        self.curr = [1.0]*3
+        self.output = [False]*3
+
+    def _channels(self, spec):
+        spec = spec.strip().lstrip('(@').rstrip(')')
+        chans = []
+        for part in spec.split(','):
+            if ':' in part:
+                lo, hi = part.split(':')
+                chans.extend(range(int(lo), int(hi) + 1))
+            elif part:
+                chans.append(int(part))
+        return [c - 1 for c in chans]
+
+    def _measure(self, quantity, chans):
+        time.sleep(self.meas_time)
+        values = []
+        for c in chans:
+            v = min(self.volt[c], self.curr[c]*self.load[c]) if self.output[c] else 0.0
+            values.append(v if quantity.startswith('VOLT') else v / self.load[c])
+        return ','.join('%+.6E' % v for v in values)
+
+    def command(self, cmd:str):
+        replies = []
+        for part in cmd.split(';'):
+            head, _, arg = part.strip().lstrip(':').partition(' ')
+            head = head.upper()
+            if head in ('MEAS:VOLT?', 'MEAS:CURR?', 'MEAS:CURRENT?'):
+                replies.append(self._measure(head[5:], self._channels(arg)))
+            elif head in ('VOLT?', 'CURRENT?', 'CURR?'):
+                setting = self.volt if head == 'VOLT?' else self.curr
+                replies.append(','.join('%+.6E' % setting[c] for c in self._channels(arg)))
+            elif head in ('VOLT', 'CURRENT', 'CURR', 'OUTPUT'):
+                value, _, spec = arg.partition(',')
+                for c in self._channels(spec):
+                    if head == 'VOLT':
+                        self.volt[c] = float(value)
+                    elif head == 'OUTPUT':
+                        self.output[c] = value.strip().upper() == 'ON'
+                    else:
+                        self.curr[c] = float(value)
+            elif head == '*RST':
+                self.__init__(self.load, self.meas_time)
+        if replies:
+            return (';'.join(replies) + '\n').encode('ascii')
+        return None
+
+
+class SimOSA(SimDevice):
+    '''Simulates a Yokogawa AQ637x OSA. Each sweep produces a noise floor with a few Lorentzian
+    peaks across the configured span.'''
+
+    # Relative sweep duration of each sensitivity, roughly as on the AQ637x.
+    SENS_TIME = {'NHLD': 1, 'NAUT': 1, 'NORM': 1, 'MID': 2, 'HIGH1': 8, 'HIGH2': 16, 'HIGH3': 32}
+
+    def __init__(self, npts=1001, sweep_time=0.0, seed=0, pts_per_nm=None, time_per_nm=None) -> None:
+        '''Arguments:
+            - npts [`int`]: Number of points in each trace.
+            - pts_per_nm [`float`]: If given, the number of points instead scales with the span,
+                like the instrument's automatic sampling.
+            - sweep_time [`float`]: Seconds a sweep takes. Trace queries block until it is done.
+            - time_per_nm [`float`]: If given, the sweep time is instead this many seconds per nm
+                of span at NORM sensitivity, scaled by SENS_TIME for the other sensitivities.
+            - seed [`int`]: Seed for the noise on the simulated spectrum.
+        '''
+        self.npts = npts
+        self.pts_per_nm = pts_per_nm
+        self.sweep_time = sweep_time
+        self.time_per_nm = time_per_nm
+        self.rng = np.random.default_rng(seed)
+        self.fmt = 'ASCII'
+        self.sens = 'NORM'
+        self.start = 1500.0
+        self.stop = 1600.0
+        self.resolution = 0.02
+        self.sweep_end = 0.0
+        self.sweep_pending = False
+        self.oper_enable = 0
+        self.sre = 0
+        self.trace = {'TRA': (np.zeros(0), np.zeros(0))}
+        self.active = 'TRA'
+
+    def spectrum(self, x):
+        '''Returns the simulated power in dBm at wavelengths x (nm).'''
+        lin = np.full(x.shape, 1e-8)
+        for center, width, peak in ((1550.0, 0.05, 1e-3), (1560.5, 0.2, 1e-5), (1064.0, 0.1, 1e-4)):
+            lin += peak / (1 + ((x - center) / width)**2)
+        return 10*np.log10(lin) + self.rng.normal(0, 0.2, x.shape)
+
+    def points(self):
+        if self.pts_per_nm:
+            return int(round((self.stop - self.start) * self.pts_per_nm)) + 1
+        return self.npts
+
+    def sweep_complete(self):
+        return self.sweep_pending and time.perf_counter() >= self.sweep_end
+
+    def service_request(self):
+        return bool(self.sre & 128) and bool(self.oper_enable & 1) and self.sweep_complete()
+
+    def _block(self, values):
+        if self.fmt == 'ASCII':
+            return (','.join(np.char.mod('%+.8E', values)) + '\n').encode('ascii')
+        datatype = 'f' if self.fmt == 'REAL,32' else 'd'
+        return util.to_ieee_block(values, datatype, False) + b'\n'
+
+    def command(self, cmd:str):
+        head, _, arg = cmd.partition(' ')
+        head = head.upper()
+        if head == ':FORMAT:DATA':
+            self.fmt = arg.upper()
+        elif head == ':SENSE:SENSE':
+            self.sens = arg.upper()
+        elif head == ':SENSE:WAV:START':
+            self.start = float(arg.upper().rstrip('NM'))
+        elif head == ':SENSE:WAV:STOP':
+            self.stop = float(arg.upper().rstrip('NM'))
+        elif head == ':INIT':
+            x = np.linspace(self.start, self.stop, self.points())
+            self.trace[self.active] = (x, self.spectrum(x))
+            duration = self.sweep_time
+            if self.time_per_nm is not None:
+                duration = self.time_per_nm * (self.stop - self.start) * self.SENS_TIME.get(self.sens, 1)
+            self.sweep_end = time.perf_counter() + duration
+            self.sweep_pending = True
+        elif head == ':ABORT':
+            self.sweep_end = 0.0
+            self.sweep_pending = False
+        elif head == '*CLS':
+            self.sweep_pending = False
+        elif head == '*SRE':
+            self.sre = int(arg)
+        elif head == ':STATUS:OPERATION:ENABLE':
+            self.oper_enable = int(arg)
+        elif head == ':STATUS:OPERATION:EVENT?':
+            # Reading the event register clears it.
+            done = self.sweep_complete()
+            if done:
+                self.sweep_pending = False
+            return (str(int(done)) + '\n').encode('ascii')
+        elif head == ':SENSE:SWEEP:POINTS?':
+            return (str(self.points()) + '\n').encode('ascii')
+        elif head == ':SENSE:BANDWIDTH:RESOLUTION':
+            self.resolution = float(arg.upper().rstrip('NM'))
+        elif head == ':TRACE:SNUMBER?':
+            return (str(len(self.trace[arg.strip().upper()][0])) + '\n').encode('ascii')
+        elif head == ':TRACE:ACTIVE?':
+            return (self.active + '\n').encode('ascii')
+        elif head in (':TRACE:X?', ':TRACE:Y?'):
+            # Like the real instrument, the bus stalls until the sweep has finished.
+            remaining = self.sweep_end - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            # An optional range of sampling points, numbered from 1: "TRA,first,last".
+            name, *span = arg.replace(' ', '').upper().split(',')
+            x, y = self.trace[name]
+            values = x if head == ':TRACE:X?' else y
+            if span:
+                values = values[int(span[0]) - 1:int(span[1])]
+            return self._block(values)
+        return None
+
+
+class SimPowerMeter(SimDevice):
+    '''Simulates a ThorLabs PM100 power meter reading a slowly drifting laser.'''
+
+    def __init__(self, power=1e-3, drift=1e-6, noise=1e-6, meas_time=0.0, seed=0, coupling=None) -> None:
+        '''Arguments:
+            - power [`float`]: Mean power in W.
+            - drift [`float`]: Linear drift in W/s.
+            - noise [`float`]: Standard deviation of the readings in W.
+            - meas_time [`float`]: Seconds a (averaged) measurement takes.
+            - coupling: Optional callable returning a factor (0 to 1) applied to the power, for
+                example SimMDT693B.coupling.
+        '''
+        self.coupling = coupling
+        self.power = power
+        self.drift = drift
+        self.noise = noise
+        self.meas_time = meas_time
+        self.rng = np.random.default_rng(seed)
+        self.averaging = 1
+        self.t0 = time.perf_counter()
+        self.meas_ready = 0.0
+
+    def reading(self):
+        t = time.perf_counter() - self.t0
+        power = self.power + self.drift*t
+        if self.coupling is not None:
+            power *= self.coupling()
+        return power + self.rng.normal(0, self.noise)
+
+    def command(self, cmd:str):
+        head, _, arg = cmd.partition(' ')
+        head = head.upper()
+        if head == ':AVER':
+            self.averaging = int(arg)
+        elif head == ':INIT':
+            self.meas_ready = time.perf_counter() + self.meas_time
+        elif head in (':FETCH?', 'READ?', ':READ?', 'MEAS:POW?'):
+            if head != ':FETCH?':
+                self.meas_ready = time.perf_counter() + self.meas_time
+            return (self.meas_ready, ('%.9E' % self.reading() + '\n').encode('ascii'))
+        return None
+
+
+class SimRotaryStage(SimDevice):
+    '''Simulates a ThorLabs ELL14 rotation mount moving at a fixed speed. Positions are kept
+    in motor steps, as on the real device.'''
+
+    def __init__(self, speed=360.0, steps_per_rev=262144) -> None:
+        '''Arguments:
+            - speed [`float`]: Rotation speed in steps per second.
+            - steps_per_rev [`int`]: Number of motor steps in one full turn.
+        '''
+        self.speed = speed
+        self.steps_per_rev = steps_per_rev
+        self.pos = 0
+        self.move_end = 0.0
+
+    def _position_reply(self):
+        return ('0PO' + '{0:08X}'.format(self.pos & 0xFFFFFFFF) + '\r\n').encode('ascii')
+
+    def _move(self, target):
+        start = max(self.move_end, time.perf_counter())
+        self.move_end = start + abs(target - self.pos) / self.speed
+        self.pos = target
+        return (self.move_end, self._position_reply())
+
+    def command(self, cmd:str):
+        if cmd[1:3] == 'ho':
+            return self._move(0)
+        elif cmd[1:3] == 'ma':
+            target = int(cmd[3:11], 16)
+            if target >= 1 << 31:
+                target -= 1 << 32
+            return self._move(target)
+        elif cmd[1:3] == 'gp':
+            return self._position_reply()
+        elif cmd[1:3] == 'gs':
+            busy = time.perf_counter() < self.move_end
+            return ('0GS' + ('09' if busy else '00') + '\r\n').encode('ascii')
+        return None
+
+
+class SimMDT693B(SimDevice):
+    '''Simulates a ThorLabs MDT693B 3-axis piezo controller. Voltages are clipped to the range
+    0 to vlimit, like on the real device. Every command is answered: with the echo of the command
+    if echo is on, then the requested value in brackets for queries, and the '>' prompt. A fiber
+    coupling efficiency that peaks at (x0, y0, z0) can be read with coupling(), to simulate
+    alignment with a power meter.'''
+
+    AXES = ('x', 'y', 'z')
+
+    def __init__(self, vlimit=150.0, echo=True, peak=(60.0, 80.0, 75.0), width=15.0) -> None:
+        '''Arguments:
+            - vlimit [`float`]: The output voltage limit in volts.
+            - echo [`bool`]: Whether commands are echoed, as after power-on.
+            - peak: The (x, y, z) voltages of best coupling.
+            - width [`float`]: The 1/e half-width of the coupling peak in volts.
+        '''
+        self.vlimit = vlimit
+        self.echo = echo
+        self.peak = peak
+        self.width = width
+        self.volts = dict.fromkeys(self.AXES, 0.0)
+        self.commands = 0 # Number of commands received.
+
+    def coupling(self):
+        '''Returns the coupling efficiency (0 to 1) at the current voltages.'''
+        d2 = sum((self.volts[a] - p)**2 for a, p in zip(self.AXES, self.peak))
+        return float(np.exp(-d2 / self.width**2))
+
+    def _set(self, axis, value):
+        self.volts[axis] = min(max(float(value), 0.0), self.vlimit)
+
+    def command(self, cmd:str):
+        self.commands += 1
+        reply = cmd + '\r' if self.echo else ''
+        head, eq, arg = cmd.partition('=')
+        head = head.strip().lower()
+        if head.endswith('?'):
+            head = head[:-1]
+            if head == 'xyzvoltage':
+                values = [self.volts[a] for a in self.AXES]
+            elif head[:1] in self.AXES and head[1:] == 'voltage':
+                values = [self.volts[head[0]]]
+            else:
+                values = None
+            if values is not None:
+                reply += '[' + ', '.join('%6.2f' % v for v in values) + ']\r'
+        elif eq and head == 'echo':
+            self.echo = arg.strip() in ('1', 'on')
+        elif eq and head == 'allvoltage':
+            for axis in self.AXES:
+                self._set(axis, arg)
+        elif eq and head == 'xyzvoltage':
+            for axis, value in zip(self.AXES, arg.split(',')):
+                self._set(axis, value)
+        elif eq and head[:1] in self.AXES and head[1:] == 'voltage':
+            self._set(head[0], arg)
+        return (reply + '>').encode('ascii')
+
+
+class SimResourceManager:
+    '''Stand-in for `pyvisa.ResourceManager` that opens simulated resources.'''
+
+    def __init__(self, devices=None, latency=0.0, bandwidth=None) -> None:
+        '''Arguments:
+            - devices [`dict`]: Maps VISA addresses to `SimDevice` instances.
+            - latency [`float`]: Default per-message latency of opened resources, in seconds.
+            - bandwidth [`float`]: Default bus bandwidth of opened resources, in bytes per second.
+        '''
+        self.devices = dict(devices or {})
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.opened = {}
+        for device in self.devices.values():
+            device.save_power_on()
+
+    def add_device(self, address:str, device:SimDevice):
+        device.save_power_on()
+        self.devices[address] = device
+
+    def inject(self, address:str, fault:str, **kwargs):
+        '''Injects faults into the device at address, see SimDevice.inject.'''
+        self.devices[address].inject(fault, **kwargs)
+
+    def list_resources(self):
+        return tuple(self.devices)
+
+    def open_resource(self, address:str):
+        if address not in self.devices:
+            raise ValueError("No simulated device at " + address)
+        device = self.devices[address]
+        if device.offline > 0:
+            device.offline -= 1
+            raise errors.VisaIOError(constants.StatusCode.error_resource_not_found)
+        latency = self.latency if device.latency is None else device.latency
+        bandwidth = self.bandwidth if device.bandwidth is None else device.bandwidth
+        res = SimResource(device, address, latency, bandwidth)
+        self.opened[address] = res
+        return res
+
+    def bytes_moved(self):
+        '''Returns the total number of bytes written to and read from all opened resources.'''
+        return sum(res.bytes_written + res.bytes_read for res in self.opened.values())
+
+    def close(self):
+        for res in self.opened.values():
+            res.close()
+        self.opened.clear()
+
+
+# Addresses used by sim_lab. They match the defaults in collect_dataset.py where there is one.
+LAB_ADDRESSES = {
+    'osa': 'GPIB0::1::INSTR',
+    'osa_2um': 'GPIB::30::INSTR',
+    'power_meter': 'USB::1::INSTR',
+    'stage': 'ASRL3::INSTR',
+    'awg_33220a': 'GPIB0::10::INSTR',
+    'awg_dg4000': 'USB::2::INSTR',
+    'dcps': 'USB::3::INSTR',
+    'piezo': 'ASRL4::INSTR',
+}
+
+def sim_lab(latency=0.0, bandwidth=None, npts=1001, sweep_time=0.0, meas_time=0.0,
+            stage_speed=2e5, osa_bandwidth=None, seed=0):
+    '''Returns a SimResourceManager with one simulated instance of every instrument of the lab (two
+    OSAs), at the addresses in LAB_ADDRESSES. The power meter reads the light coupled through the
+    piezo stage, so alignment scans have a peak to find.\n
+    Arguments:
+        - latency [`float`]: Seconds added to every bus message.
+        - bandwidth [`float`]: Default bus bandwidth in bytes/s. `None` means unlimited.
+        - npts [`int`]: Points per OSA trace.
+        - sweep_time [`float`]: Seconds per OSA sweep.
+        - meas_time [`float`]: Seconds per power meter or power supply measurement.
+        - stage_speed [`float`]: Rotation stage speed in steps/s.
+        - osa_bandwidth [`float`]: Overrides the bandwidth of the OSA bus only, ex. 1e6 for GPIB.
+        - seed [`int`]: Seed of the simulated noise.
+    '''
+    osa = SimOSA(npts=npts, sweep_time=sweep_time, seed=seed)
+    osa_2um = SimOSA(npts=npts, sweep_time=sweep_time, seed=seed + 1)
+    if osa_bandwidth is not None:
+        osa.bandwidth = osa_bandwidth
+        osa_2um.bandwidth = osa_bandwidth
+    piezo = SimMDT693B()
+    devices = {
+        'osa': osa,
+        'osa_2um': osa_2um,
+        'power_meter': SimPowerMeter(meas_time=meas_time, seed=seed, coupling=piezo.coupling),
+        'stage': SimRotaryStage(speed=stage_speed),
+        'awg_33220a': SimAWG(),
+        'awg_dg4000': SimAWG(),
+        'dcps': SimE36300(meas_time=meas_time),
+        'piezo': piezo,
+    }
+    return SimResourceManager({LAB_ADDRESSES[name]: dev for name, dev in devices.items()},
+                              latency=latency, bandwidth=bandwidth)
@@ -0,0 +1,280 @@
+'''Vectorized post-processing of OSA traces.\n
+The functions work on stacks of sweeps, with one sweep per row: the powers y have shape
+(sweeps x points), and the wavelengths x either the same shape or, for sweeps on a common grid,
+shape (points,). All of them are NumPy array operations over the whole stack, with no loop over
+the sweeps.\n
+analyze() runs them over a whole dataset (see SweepDataset) in chunks of entries, so datasets
+larger than the memory can be processed, optionally on several processes, and returns one row
+of results per entry.'''
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from SweepDataset import SweepDataset
+
+def dbm_to_mw(y):
+    '''Converts powers in dBm to mW.'''
+    return np.exp(np.asarray(y, dtype=float) * (np.log(10) / 10))
+
+def mw_to_dbm(p, floor=1e-30):
+    '''Converts powers in mW to dBm. Powers below floor (mW), including zero and negative noise
+    readings, are clipped to floor.'''
+    return 10 * np.log10(np.maximum(p, floor))
+
+def normalize(y, start_pow, end_pow, drift=False):
+    '''Normalizes sweeps in dBm by the laser power measured by the power meter, which gives the
+    spectrum in dB relative to the laser.\n
+    Arguments:
+        - y: The sweeps in dBm, (sweeps x points).
+        - start_pow, end_pow: The power meter readings in W before and after each sweep, one per sweep.
+        - drift [`bool`]: If False, every point is normalized by the mean of the two readings. If
+            True, the laser power is assumed to change linearly during the sweep, from start_pow at
+            the first point to end_pow at the last one.
+    Returns:
+        (numpy array): The normalized sweeps in dB.
+    '''
+    y = np.asarray(y, dtype=float)
+    start = np.asarray(start_pow, dtype=float).reshape(-1, 1) * 1e3 # W to mW.
+    end = np.asarray(end_pow, dtype=float).reshape(-1, 1) * 1e3
+    if drift:
+        frac = np.linspace(0.0, 1.0, y.shape[-1])
+        ref = start + (end - start) * frac
+    else:
+        ref = (start + end) / 2
+    return y - mw_to_dbm(ref)
+
+def resample(x, y, grid):
+    '''Linearly interpolates sweeps onto a common wavelength grid. Points outside the range of a
+    sweep are NaN.\n
+    Arguments:
+        - x: The wavelengths of the sweeps, (points,) or (sweeps x points), sorted along each row.
+        - y: The values, (sweeps x points).
+        - grid: The target wavelengths, sorted.
+    Returns:
+        (numpy array): The values on the grid, (sweeps x len(grid)).
+    '''
+    x, y, grid = np.asarray(x, dtype=float), np.atleast_2d(np.asarray(y, dtype=float)), np.asarray(grid, dtype=float)
+    if x.ndim == 2 and np.array_equal(x, np.broadcast_to(x[0], x.shape)):
+        x = x[0]
+    if x.ndim == 1:
+        # Same wavelengths for every sweep: the interpolation weights are computed once.
+        i = np.clip(np.searchsorted(x, grid) - 1, 0, len(x) - 2)
+        w = (grid - x[i]) / (x[i + 1] - x[i])
+        out = y[:, i] * (1 - w) + y[:, i + 1] * w
+        out[:, (grid < x[0]) | (grid > x[-1])] = np.nan
+        return out
+    return np.stack([np.interp(grid, xr, yr, left=np.nan, right=np.nan) for xr, yr in zip(x, y)])
+
+def _rows(x, y):
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    return np.broadcast_to(np.asarray(x, dtype=float), y.shape), y
+
+def _argmax(y):
+    '''argmax along the rows, ignoring NaN (from resampling) without copying y when there is none.'''
+    return np.nanargmax(y, axis=1) if np.isnan(y).any() else np.argmax(y, axis=1)
+
+def peak(x, y):
+    '''Finds the maximum of each sweep, refined by a parabola through the highest point and its
+    neighbours.\n
+    Returns:
+        (tuple): The peak wavelength and the peak value of each sweep, in the unit of y.
+    '''
+    x, y = _rows(x, y)
+    n = y.shape[1]
+    rows = np.arange(len(y))
+    i = _argmax(y)
+    j = np.clip(i, 1, n - 2)
+    y0, y1, y2 = y[rows, j - 1], y[rows, j], y[rows, j + 1]
+    denom = y0 - 2*y1 + y2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = np.where((i == j) & (denom < 0), 0.5 * (y0 - y2) / denom, 0.0)
+    shift = np.nan_to_num(shift)
+    # Offset in units of the local point spacing.
+    dx = np.where(shift >= 0, x[rows, j + 1] - x[rows, j], x[rows, j] - x[rows, j - 1])
+    x_peak = np.where(i == j, x[rows, j] + shift * dx, x[rows, i])
+    y_peak = np.where(i == j, y1 - 0.25 * (y0 - y2) * shift, y[rows, i])
+    return x_peak, y_peak
+
+def _band_weights(x, lower, upper):
+    '''Trapezoid integration weights of each point of x within [lower, upper]. x is (points,) for
+    sweeps on a common grid, so the weights are computed once, or (sweeps x points).'''
+    inside = (x >= (-np.inf if lower is None else lower)) & (x <= (np.inf if upper is None else upper))
+    dx = np.diff(x, axis=-1) * (inside[..., 1:] & inside[..., :-1])
+    w = np.zeros(x.shape)
+    w[..., 1:] += dx / 2
+    w[..., :-1] += dx / 2
+    return w
+
+def _weighted_sum(y, w):
+    return y @ w if w.ndim == 1 else (y * w).sum(axis=1)
+
+def centroid(x, y_mw, lower=None, upper=None):
+    '''Returns the power-weighted mean wavelength of each sweep, within an optional band.\n
+    Arguments:
+        - x: The wavelengths in nm.
+        - y_mw: The powers in linear units (ex. mW, see dbm_to_mw).
+        - lower, upper [`float`]: The band in nm. Defaults to the whole sweep.
+    '''
+    x, y = np.asarray(x, dtype=float), np.atleast_2d(np.asarray(y_mw, dtype=float))
+    w = _band_weights(x, lower, upper)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return _weighted_sum(y, w * x) / _weighted_sum(y, w)
+
+def band_power(x, y_mw, bands):
+    '''Integrates the power of each sweep over wavelength bands (trapezoid rule).\n
+    Arguments:
+        - x: The wavelengths in nm.
+        - y_mw: The powers in linear units, ex. mW.
+        - bands: A list of (lower, upper) bands in nm.
+    Returns:
+        (numpy array): The integrals in the unit of y times nm, (sweeps x bands). Divide by the
+            resolution bandwidth in nm for the total power in each band.
+    '''
+    x, y = np.asarray(x, dtype=float), np.atleast_2d(np.asarray(y_mw, dtype=float))
+    if np.isnan(y).any():
+        y = np.nan_to_num(y)
+    if x.ndim == 1:
+        # One matrix product for all bands.
+        return y @ np.stack([_band_weights(x, lo, hi) for lo, hi in bands], axis=-1)
+    return np.stack([_weighted_sum(y, _band_weights(x, lo, hi)) for lo, hi in bands], axis=-1)
+
+def fwhm(x, y_mw):
+    '''Returns the full width at half maximum of the highest peak of each sweep, in nm. The
+    half-maximum crossings are interpolated linearly between points. NaN if the peak does not fall
+    below half its maximum on both sides within the sweep.\n
+    Arguments:
+        - x: The wavelengths in nm.
+        - y_mw: The powers in linear units (not dBm).
+    '''
+    x, y = _rows(x, y_mw)
+    n = y.shape[1]
+    rows = np.arange(len(y))
+    i = _argmax(y)
+    half = y[rows, i] / 2
+    idx = np.arange(n)
+    below = y < half[:, None]
+    # Last point below half on the left of the peak and first one on the right.
+    left_below = below & (idx < i[:, None])
+    right_below = below & (idx > i[:, None])
+    left = n - 1 - np.argmax(left_below[:, ::-1], axis=1)
+    right = np.argmax(right_below, axis=1)
+    valid = left_below.any(axis=1) & right_below.any(axis=1)
+    l0, r0 = np.clip(left, 0, n - 2), np.clip(right, 1, n - 1)
+    def crossing(a, b):
+        ya, yb = y[rows, a], y[rows, b]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = (half - ya) / (yb - ya)
+        return x[rows, a] + t * (x[rows, b] - x[rows, a])
+    width = crossing(r0 - 1, r0) - crossing(l0, l0 + 1)
+    return np.where(valid, width, np.nan)
+
+def trace_metrics(x, y, start_pow=None, end_pow=None, bands=None, normalized=False, drift=False):
+    '''Computes the standard results of a stack of sweeps in dBm: the peak wavelength and level,
+    the centroid, the FWHM and the integrated power in each band.\n
+    Arguments:
+        - x, y: The wavelengths (nm) and powers (dBm), see the module documentation.
+        - start_pow, end_pow: The power meter readings, needed if normalized is True.
+        - bands [`dict`]: Maps names to (lower, upper) bands in nm for band_power.
+        - normalized [`bool`]: Normalize the sweeps by the laser power first, see normalize.
+        - drift [`bool`]: Passed on to normalize.
+    Returns:
+        (dict): One array per result, with one value per sweep.
+    '''
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    if normalized:
+        y = normalize(y, start_pow, end_pow, drift)
+    p = dbm_to_mw(y)
+    peak_wl, peak_level = peak(x, y)
+    out = {'peak_wl': peak_wl, 'peak_level': peak_level, 'centroid': centroid(x, p), 'fwhm': fwhm(x, p)}
+    if bands:
+        powers = band_power(x, p, list(bands.values()))
+        for k, name in enumerate(bands):
+            out[name] = powers[:, k]
+    return out
+
+def _load(ds, indices, grid):
+    '''Returns the wavelengths and powers of dataset entries, on grid if one is given.'''
+    rec = ds.index[indices]
+    npts = rec['npts']
+    if grid is None and np.all(npts == npts[0]):
+        n = int(npts[0])
+        offsets = rec['offset']
+        if np.all(np.diff(offsets) == 2*n):
+            # Consecutive entries: a single view into the memory map.
+            block = ds.traces[int(offsets[0]):int(offsets[0]) + 2*n*len(indices)].reshape(len(indices), 2, n)
+        else:
+            block = np.stack([ds[i] for i in indices])
+        x = block[:, 0]
+        if np.array_equal(x, np.broadcast_to(x[0], x.shape)):
+            x = x[0] # A common grid, which the metrics handle faster.
+        return np.array(x), np.array(block[:, 1])
+    if grid is None:
+        raise ValueError("The entries have different numbers of points, give a grid to resample them onto")
+    y = np.stack([resample(ds[i][0], ds[i][1], grid)[0] for i in indices])
+    return grid, y
+
+def _analyze_chunk(path, indices, grid, bands, normalized, drift):
+    ds = SweepDataset(path)
+    rec = ds.index[indices]
+    x, y = _load(ds, indices, grid)
+    return trace_metrics(x, y, rec['start_pow'], rec['end_pow'], bands, normalized, drift)
+
+def analyze(dataset, indices=None, band=None, grid=None, bands=None, normalized=False, drift=False,
+            chunk=256, workers=None):
+    '''Computes trace_metrics for the entries of a dataset, chunk by chunk.\n
+    Arguments:
+        - dataset: A SweepDataset or the path of its directory.
+        - indices: The entries to process. Defaults to all of them, or all of one band.
+        - band [`str`]: Only process the entries of this OSA band, see SweepDataset.band_entries.
+        - grid: A common wavelength grid in nm to resample the entries onto. Needed if the entries
+            have different numbers of points.
+        - bands, normalized, drift: See trace_metrics.
+        - chunk [`int`]: The number of entries loaded at a time.
+        - workers [`int`]: The number of processes. Defaults to 1, which processes the chunks in
+            this process; use os.cpu_count() for all cores.
+    Returns:
+        (numpy array): A structured array with one record per entry: its index, angle, start and
+            end power, and the fields of trace_metrics.
+    '''
+    ds = dataset if isinstance(dataset, SweepDataset) else SweepDataset(dataset)
+    if indices is None:
+        indices = ds.band_entries(band) if band is not None else np.arange(len(ds))
+    indices = np.asarray(indices, dtype=int)
+    names = ['peak_wl', 'peak_level', 'centroid', 'fwhm'] + list(bands or {})
+    out = np.zeros(len(indices), dtype=[('index', 'i8'), ('angle', 'f8'), ('start_pow', 'f8'),
+                                        ('end_pow', 'f8')] + [(name, 'f8') for name in names])
+    out['index'] = indices
+    for field in ('angle', 'start_pow', 'end_pow'):
+        out[field] = ds.index[field][indices]
+    chunks = [np.arange(k, min(k + chunk, len(indices))) for k in range(0, len(indices), chunk)]
+    args = (grid, bands, normalized, drift)
+    if workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_analyze_chunk, [ds.path] * len(chunks), [indices[c] for c in chunks],
+                               *[[a] * len(chunks) for a in args])
+            for c, res in zip(chunks, results):
+                for name in names:
+                    out[name][c] = res[name]
+    else:
+        for c in chunks:
+            x, y = _load(ds, indices[c], grid)
+            res = trace_metrics(x, y, out['start_pow'][c], out['end_pow'][c], bands, normalized, drift)
+            for name in names:
+                out[name][c] = res[name]
+    return out
+
+def read_dat(path:str):
+    '''Reads a legacy .dat file written by write_to_file or SweepDataset.export_dat.\n
+    Returns:
+        (tuple): The 2xN data (nm, dBm), and the start and end power readings.
+    '''
+    pows = {}
+    with open(path) as file:
+        for line in file:
+            if not line.startswith('#'):
+                break
+            for key, label in (('start', 'measurement start:'), ('end', 'measurement end:')):
+                if label in line:
+                    value = line.split(label, 1)[1].strip().strip('[]')
+                    pows[key] = float(value) if value and value != 'None' else np.nan
+    data = np.loadtxt(path, comments='#', delimiter='\t', ndmin=2).T
+    return data, pows.get('start', np.nan), pows.get('end', np.nan)
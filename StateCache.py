@@ -0,0 +1,91 @@
+'''A write-through cache of instrument settings, shared by the driver classes to skip SCPI writes
+that would not change anything.'''
+
+class StateCache:
+    '''Remembers the last value written for each setting of one instrument. A write is only sent
+    when the value differs from the cached one. The cache must be invalidated whenever the
+    instrument state may have changed behind its back: after *RST, or use of the front panel.
+    After a reconnect, replay writes the cached settings back instead.'''
+
+    def __init__(self, resource, enabled=True) -> None:
+        '''Arguments:
+            - resource: The pyvisa resource that commands are written to.
+            - enabled [`bool`]: If False, every write is sent, but values are still tracked.
+        '''
+        self.resource = resource
+        self.enabled = enabled
+        self.values = {}
+        self.commands = {} # The last command that set each setting, in the order they were sent.
+        self.writes = 0  # Number of writes sent.
+        self.skipped = 0 # Number of writes suppressed because nothing would change.
+        # A ResilientIO resource restores the settings when it has to open its session again.
+        if hasattr(resource, 'on_reopen'):
+            resource.on_reopen.append(self.replay)
+
+    def write(self, key, value, cmd:str) -> bool:
+        '''Sends cmd unless setting key is already known to be value.\n
+        Arguments:
+            - key: The name of the setting, ex. ':SENSE:SENSE' or ('VOLT', 1).
+            - value: The value cmd sets it to.
+            - cmd [`str`]: The command to send.
+        Returns:
+            (bool): True if cmd was sent.
+        '''
+        return self.write_all((key,), value, cmd)
+
+    def write_all(self, keys, value, cmd:str) -> bool:
+        '''Like write, for a command that sets several settings to the same value at once, for
+        example one voltage on a list of channels. The command is skipped only if every setting
+        already has the value.'''
+        if self.enabled and all(key in self.values and self.values[key] == value for key in keys):
+            self.skipped += 1
+            return False
+        self.resource.write(cmd)
+        for key in keys:
+            self.values[key] = value
+            self._remember(key, cmd)
+        self.writes += 1
+        return True
+
+    def write_many(self, values:dict, cmd:str) -> bool:
+        '''Like write, for a command that sets several settings to different values at once, for
+        example all three piezo axes. values maps each setting to its new value.'''
+        if self.enabled and all(key in self.values and self.values[key] == value for key, value in values.items()):
+            self.skipped += 1
+            return False
+        self.resource.write(cmd)
+        self.values.update(values)
+        for key in values:
+            self._remember(key, cmd)
+        self.writes += 1
+        return True
+
+    def _remember(self, key, cmd):
+        self.commands.pop(key, None) # Moves the setting to the end, so the order stays that of the writes.
+        self.commands[key] = cmd
+
+    def replay(self):
+        '''Sends the commands of the cached settings again, ex. after the instrument was reconnected
+        or power cycled. Each command is sent once, in the order of the last writes, so a command
+        that set several settings cannot undo a later one.'''
+        cmds = list(self.commands.values())
+        for cmd in reversed(list(dict.fromkeys(reversed(cmds)))):
+            self.resource.write(cmd)
+            self.writes += 1
+
+    def get(self, key, default=None):
+        '''Returns the cached value of a setting.'''
+        return self.values.get(key, default)
+
+    def invalidate(self, key=None):
+        '''Forgets one setting, or all of them if key is None.'''
+        if key is None:
+            self.values.clear()
+            self.commands.clear()
+        else:
+            self.values.pop(key, None)
+            self.commands.pop(key, None)
+
+    def stats(self) -> dict:
+        '''Returns the write and skip counters.'''
+        return {'writes': self.writes, 'skipped': self.skipped}
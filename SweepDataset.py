@@ -0,0 +1,300 @@
+'''Columnar storage for all the sweeps of one acquisition run.\n
+A dataset is a directory holding three append-only files:
+    - traces.f8: The raw float64 (little-endian) trace data. Each entry stores its wavelengths
+      followed by its powers.
+    - index.rec: One fixed-size binary record per entry (see INDEX_DTYPE), giving the offset and
+      length of its trace plus the scalar metadata.
+    - meta.jsonl: One JSON line per entry with the sweep configuration and any extra metadata.
+Entries can also carry named auxiliary arrays, such as the power log recorded during a sweep.
+These are appended to aux.bin, and their location is kept in the entry's metadata.
+A dataset-wide attrs.json is written when the dataset is created. The reader memory-maps the trace
+and index files, so slicing one angle or one wavelength band out of thousands of sweeps only
+touches the pages that are needed.'''
+
+import datetime
+import json
+import os
+import time
+import numpy as np
+
+INDEX_DTYPE = np.dtype([
+    ('offset', '<i8'),      # Offset of the entry in traces.f8, in float64 elements.
+    ('npts', '<i8'),        # Number of points in the trace.
+    ('angle', '<f8'),       # Stage angle in degrees.
+    ('start_pow', '<f8'),   # Power at measurement start.
+    ('end_pow', '<f8'),     # Power at measurement end.
+    ('time', '<f8'),        # Unix time at which the entry was written.
+])
+
+TRACE_FILE = 'traces.f8'
+INDEX_FILE = 'index.rec'
+META_FILE = 'meta.jsonl'
+AUX_FILE = 'aux.bin'
+ATTRS_FILE = 'attrs.json'
+
+def _scalar(value):
+    '''Converts a power reading (a float or the one-element list from read_pow) to a float.'''
+    if value is None:
+        return np.nan
+    return float(np.asarray(value, dtype=float).ravel()[0])
+
+def write_dat(data: np.ndarray, startPow, endPow, path:str, header: str = None):
+    '''Writes one sweep in the legacy tab-separated .dat format used by collect_dataset.write_to_file.\n
+    Arguments:
+        data: A 2xN numpy array. X in nm in row 0, Y in dBm in row 1.
+        startPow: The power at which the measurement began.
+        endPow: The power read by the meter after the measurement ended.
+        path: The path of the file to write.
+        header (optional): A header to write to the beginning of the data file.
+    '''
+    with open(path, "a") as file:
+        file.writelines(["# Power at measurement start: " + str(startPow) + "\n",
+                         "# Power at measurement end: " + str(endPow) + "\n"])
+        file.write("# Wavelength [nm]\tPower [dBm]\n")
+        if header != None:
+            for line in header.splitlines():
+                file.write('# ' + line + '\n')
+        file.writelines(str(x) + "\t" + str(y) + "\n" for x, y in zip(data[0].tolist(), data[1].tolist()))
+
+
+class SweepDatasetWriter:
+    '''Appends sweeps to a dataset directory. Every append is flushed to disk, so a dataset is
+    readable (and can be reopened for appending) at any point during a run.'''
+
+    def __init__(self, path:str, attrs:dict=None, append=False) -> None:
+        '''Arguments:
+            - path [`str`]: The dataset directory. It is created if needed.
+            - attrs [`dict`]: Dataset-wide metadata written to attrs.json on creation.
+            - append [`bool`]: If True, continue an existing dataset instead of requiring a new one.
+        '''
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        exists = os.path.exists(os.path.join(path, INDEX_FILE))
+        if exists and not append:
+            raise FileExistsError("Dataset already exists at " + path)
+        if not exists:
+            with open(os.path.join(path, ATTRS_FILE), 'w') as file:
+                json.dump(dict(attrs or {}, created=str(datetime.datetime.now())), file, indent=2)
+        self._traces = open(os.path.join(path, TRACE_FILE), 'ab')
+        self._index = open(os.path.join(path, INDEX_FILE), 'ab')
+        self._meta = open(os.path.join(path, META_FILE), 'a')
+        self._aux = open(os.path.join(path, AUX_FILE), 'ab')
+        self._repair()
+
+    def _repair(self, count=None):
+        '''Drops a partially written last entry left behind by a crash mid-append, and any entries
+        after the first count.'''
+        n_index = os.fstat(self._index.fileno()).st_size // INDEX_DTYPE.itemsize
+        if count is not None:
+            n_index = min(n_index, count)
+        self._index.truncate(n_index * INDEX_DTYPE.itemsize)
+        end = 0
+        if n_index > 0:
+            last = np.fromfile(os.path.join(self.path, INDEX_FILE), INDEX_DTYPE, count=n_index)[-1]
+            end = 8 * int(last['offset'] + 2*last['npts'])
+        self._traces.truncate(end)
+        with open(os.path.join(self.path, META_FILE)) as file:
+            lines = file.readlines()[:n_index]
+        self._meta.truncate(0)
+        self._meta.writelines(lines)
+        self._meta.flush()
+        aux_end = 0
+        for line in lines:
+            for arr in json.loads(line).get('aux', {}).values():
+                aux_end = max(aux_end, arr['offset'] + arr['nbytes'])
+        self._aux.truncate(aux_end)
+        self.aux_offset = aux_end
+        self.offset = end // 8
+        self.count = n_index
+
+    def append(self, data: np.ndarray, startPow=None, endPow=None, angle=np.nan, config=None, arrays=None, **meta):
+        '''Appends one sweep.\n
+        Arguments:
+            - data: A 2xN array. X (nm) in row 0, Y (dBm) in row 1.
+            - startPow, endPow: The power readings before and after the sweep.
+            - angle [`float`]: The stage angle in degrees.
+            - config: The sweep configuration, stored as JSON.
+            - arrays [`dict`]: Named auxiliary numpy arrays, for example a power log.
+            - meta: Any further JSON-serializable metadata for this entry.
+        Returns:
+            (int): The index of the new entry.
+        '''
+        data = np.ascontiguousarray(data, dtype='<f8')
+        npts = data.shape[1]
+        rec = np.array([(self.offset, npts, angle, _scalar(startPow), _scalar(endPow), time.time())],
+                       dtype=INDEX_DTYPE)
+        # Trace data first, index last: an entry only exists once its index record is complete.
+        self._traces.write(data.tobytes())
+        self._traces.flush()
+        if arrays:
+            meta['aux'] = {}
+            for name, arr in arrays.items():
+                arr = np.ascontiguousarray(arr)
+                meta['aux'][name] = {'offset': self.aux_offset, 'nbytes': arr.nbytes,
+                                     'dtype': np.lib.format.dtype_to_descr(arr.dtype), 'shape': arr.shape}
+                self._aux.write(arr.tobytes())
+                self.aux_offset += arr.nbytes
+            self._aux.flush()
+        self._meta.write(json.dumps(dict(meta, config=config), default=str) + '\n')
+        self._meta.flush()
+        self._index.write(rec.tobytes())
+        self._index.flush()
+        self.offset += 2*npts
+        self.count += 1
+        return self.count - 1
+
+    def append_bands(self, traces:dict, startPow=None, endPow=None, angle=np.nan, configs=None, arrays=None, **meta):
+        '''Appends the traces of several OSAs taken at one position, as one entry per band. The
+        entries carry their band name and the index of the first entry of the group in their
+        metadata, so SweepDataset.bands can find them together.\n
+        Arguments:
+            - traces [`dict`]: Maps band names to 2xN arrays.
+            - startPow, endPow, angle: As for append, shared by all bands.
+            - configs [`dict`]: The sweep configuration of each band.
+            - arrays [`dict`]: Auxiliary arrays, stored once with the first band.
+            - meta: Further metadata, stored with every band.
+        Returns:
+            (list): The indices of the new entries.
+        '''
+        group = self.count
+        entries = []
+        for band, data in traces.items():
+            entries.append(self.append(data, startPow, endPow, angle, (configs or {}).get(band),
+                                       arrays if not entries else None, band=band, group=group, **meta))
+        return entries
+
+    def truncate(self, count:int):
+        '''Drops every entry after the first count, for example entries written after the last
+        checkpoint of a run that is being resumed.'''
+        for file in (self._traces, self._index, self._meta, self._aux):
+            file.flush()
+        self._repair(count)
+
+    def close(self):
+        for file in (self._traces, self._index, self._meta, self._aux):
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SweepDataset:
+    '''Memory-mapped read access to a dataset written by SweepDatasetWriter.'''
+
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.refresh()
+
+    def refresh(self):
+        '''Re-maps the files, picking up entries appended since the dataset was opened.'''
+        with open(os.path.join(self.path, ATTRS_FILE)) as file:
+            self.attrs = json.load(file)
+        index_path = os.path.join(self.path, INDEX_FILE)
+        n = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        self.index = np.fromfile(index_path, INDEX_DTYPE, count=n)
+        n_vals = int((self.index['offset'] + 2*self.index['npts']).max()) if n else 0
+        if n_vals:
+            self.traces = np.memmap(os.path.join(self.path, TRACE_FILE), '<f8', 'r', shape=(n_vals,))
+        else:
+            self.traces = np.zeros(0)
+        self._meta = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i) -> np.ndarray:
+        '''Returns entry i as a read-only 2xN view into the memory map.'''
+        rec = self.index[i]
+        start, npts = int(rec['offset']), int(rec['npts'])
+        return self.traces[start:start + 2*npts].reshape(2, npts)
+
+    @property
+    def angles(self):
+        return self.index['angle']
+
+    @property
+    def meta(self):
+        '''The list of per-entry metadata dicts, loaded on first use.'''
+        if self._meta is None:
+            with open(os.path.join(self.path, META_FILE)) as file:
+                self._meta = [json.loads(line) for line in file][:len(self)]
+        return self._meta
+
+    def aux(self, i, name):
+        '''Returns the auxiliary array name of entry i as a read-only memory-mapped array.'''
+        info = self.meta[i]['aux'][name]
+        descr = info['dtype']
+        if isinstance(descr, list): # JSON turned the structured dtype's field tuples into lists.
+            descr = [tuple(field) for field in descr]
+        dtype = np.lib.format.descr_to_dtype(descr)
+        if info['nbytes'] == 0:
+            return np.zeros(info['shape'], dtype)
+        return np.memmap(os.path.join(self.path, AUX_FILE), dtype, 'r', offset=info['offset'],
+                         shape=tuple(info['shape']))
+
+    def bands(self, i):
+        '''Returns the traces taken together with entry i by append_bands, as a dict mapping band
+        names to 2xN views. An entry written by append is returned alone, under the name None.'''
+        group = self.meta[i].get('group')
+        if group is None:
+            return {None: self[i]}
+        out = {}
+        for j in range(group, len(self)):
+            if self.meta[j].get('group') != group:
+                break
+            out[self.meta[j]['band']] = self[j]
+        return out
+
+    def band_entries(self, band):
+        '''Returns the indices of the entries of one band.'''
+        return np.array([i for i, m in enumerate(self.meta) if m.get('band') == band], dtype=int)
+
+    def at_angle(self, angle, tol=1e-6):
+        '''Returns the indices of the entries taken at the given stage angle.'''
+        return np.flatnonzero(np.abs(self.angles - angle) <= tol)
+
+    def band(self, lower, upper, indices=None):
+        '''Returns the part of each trace with lower <= wavelength <= upper.\n
+        Arguments:
+            - lower, upper [`float`]: Wavelength bounds in nm.
+            - indices (optional): The entries to slice. Defaults to all of them.
+        Returns:
+            (list): One 2xM view per entry.
+        '''
+        if indices is None:
+            indices = range(len(self))
+        out = []
+        for i in indices:
+            entry = self[i]
+            lo = np.searchsorted(entry[0], lower, side='left')
+            hi = np.searchsorted(entry[0], upper, side='right')
+            out.append(entry[:, lo:hi])
+        return out
+
+    def stack(self):
+        '''Returns all entries as one (entries x 2 x points) view. Requires that every entry has
+        the same number of points.'''
+        npts = np.unique(self.index['npts'])
+        if len(npts) != 1:
+            raise ValueError("Entries have different numbers of points: " + str(npts))
+        return self.traces[:2*int(npts[0])*len(self)].reshape(len(self), 2, int(npts[0]))
+
+    def export_dat(self, folder:str, indices=None):
+        '''Writes entries as legacy .dat files, one per sweep, named after their write time.\n
+        Returns:
+            (list): The paths of the written files.
+        '''
+        if indices is None:
+            indices = range(len(self))
+        paths = []
+        for i in indices:
+            rec = self.index[i]
+            t_stamp = datetime.datetime.fromtimestamp(rec['time'])
+            path = os.path.join(folder, "sweep_" + str(t_stamp).replace(' ', '_').replace(':', '-') + ".dat")
+            header = "Stage angle [deg]: " + str(rec['angle']) + "\nSweep config: " + json.dumps(self.meta[i].get('config'))
+            write_dat(self[i], rec['start_pow'], rec['end_pow'], path, header)
+            paths.append(path)
+        return paths
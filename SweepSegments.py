@@ -0,0 +1,150 @@
+'''Typed OSA sweep segments and a segmented sweep that assembles all of its sub-sweeps into one
+preallocated buffer.\n
+A sweep config line is a flat list of (start, stop, sensitivity) triples, for example
+"1540, 1560, HIGH1, 1549, 1551, HIGH3". The number of sampling points of each segment is queried
+from the OSA once, the first time the sweep is run, to lay out the output array. Every run then
+checks the point count of each trace (:TRACE:SNUMBER?) and reads it straight into its slice.'''
+
+from typing import NamedTuple
+import numpy as np
+
+class SweepSegment(NamedTuple):
+    '''One OSA sub-sweep.'''
+    start: float    # Lower wavelength bound in nm.
+    stop: float     # Upper wavelength bound in nm.
+    sens: str       # Sensitivity, ex. 'HIGH3'.
+
+def parse_sweep_config(sweep_arr):
+    '''Parses a sweep config into a list of SweepSegment.\n
+    Arguments:
+        sweep_arr: A flat sequence of length 3n of (start, stop, sensitivity) values, or a string
+            of the same values separated by commas.
+    Returns:
+        (list): The SweepSegment of each sub-sweep.
+    '''
+    if isinstance(sweep_arr, str):
+        sweep_arr = ''.join(sweep_arr.split()).split(',')
+    sweep_arr = [v for v in sweep_arr if str(v) != '']
+    if len(sweep_arr) % 3 != 0:
+        raise ValueError("A sweep config needs 3 values per segment, got " + str(len(sweep_arr)))
+    segments = []
+    for i in range(0, len(sweep_arr), 3):
+        start, stop = float(sweep_arr[i]), float(sweep_arr[i+1])
+        if stop <= start:
+            raise ValueError("Segment stop must be above start: " + str(sweep_arr[i:i+3]))
+        segments.append(SweepSegment(start, stop, str(sweep_arr[i+2]).upper()))
+    return segments
+
+
+class SegmentedSweep:
+    '''A sequence of sub-sweeps that is run as one measurement.\n
+    Overlapping segments are resolved with the overlap option:
+        - None: Keep every point. The output is the plain concatenation of the segments, in order.
+        - 'first': Deduplicate. Points of a segment that fall inside an earlier segment are dropped.
+        - 'last': Stitch. Points of a segment that fall inside a later segment are dropped, so a
+          narrow high-sensitivity segment replaces that part of a wide survey.
+    With an overlap mode the output is sorted by wavelength.
+    '''
+
+    def __init__(self, segments, overlap=None) -> None:
+        '''Arguments:
+            - segments: A list of SweepSegment, or a flat config accepted by parse_sweep_config.
+            - overlap: None, 'first' or 'last'. See the class documentation.
+        '''
+        if overlap not in (None, 'first', 'last'):
+            raise ValueError("overlap must be None, 'first' or 'last'")
+        if len(segments) and not isinstance(segments[0], SweepSegment):
+            segments = parse_sweep_config(segments)
+        self.segments = list(segments)
+        self.overlap = overlap
+        self.npts = None    # Points per segment, filled in by prepare.
+        self.offsets = None # Start of each segment in the output buffer.
+        self._keep = None   # Indices of the points kept after overlap resolution.
+        self.trace = None   # The OSA trace the segments are read from.
+
+    def config(self):
+        '''Returns the segments as a JSON-friendly list of [start, stop, sens] lists.'''
+        return [list(seg) for seg in self.segments]
+
+    def prepare(self, osa):
+        '''Queries the number of points of every segment and lays out the output buffer. Runs
+        automatically on the first call of run.'''
+        self.trace = osa.get_active_trace()
+        npts = []
+        for seg in self.segments:
+            osa.config_scan(seg.start, seg.stop, seg.sens)
+            npts.append(osa.get_sweep_points())
+        self._layout(npts)
+
+    def _layout(self, npts):
+        self.npts = np.array(npts, dtype=int)
+        self.offsets = np.concatenate(([0], np.cumsum(self.npts)))
+        self._keep = None
+        if self.overlap is None:
+            return
+        # Nominal wavelength of every point, used to find the overlaps independently of the unit
+        # the OSA reports x in.
+        grid = [np.linspace(seg.start, seg.stop, n) for seg, n in zip(self.segments, self.npts)]
+        keep = []
+        for i, x in enumerate(grid):
+            others = self.segments[:i] if self.overlap == 'first' else self.segments[i+1:]
+            mask = np.ones(len(x), dtype=bool)
+            for seg in others:
+                mask &= (x < seg.start) | (x > seg.stop)
+            keep.append(mask)
+        keep = np.concatenate(keep)
+        order = np.argsort(np.concatenate(grid)[keep], kind='stable')
+        self._keep = np.flatnonzero(keep)[order]
+
+    def assemble(self, parts):
+        '''Merges separately acquired data, one 2xN array per segment in order, the same way run
+        does. Useful when the segments were not all swept in one run.'''
+        npts = [p.shape[1] for p in parts]
+        if self.npts is None or list(self.npts) != npts:
+            self._layout(npts)
+        buf = np.concatenate(parts, axis=1)
+        if self._keep is not None:
+            return buf[:, self._keep]
+        return buf
+
+    def views(self, data):
+        '''Returns one 2xN view of data per segment. Only valid for a buffer returned by run
+        with overlap=None.'''
+        return [data[:, self.offsets[i]:self.offsets[i+1]] for i in range(len(self.segments))]
+
+    def run(self, osa, release=None):
+        '''Performs every sub-sweep on the OSA and returns the assembled data.\n
+        Arguments:
+            - osa: The OSA on which the sweeps are to be performed.
+            - release (optional): Called once the last sweep has finished, before its trace is read
+                out. Lets a pipelined run move the stage while the final readout is in progress.
+        Returns:
+            (numpy array): A 2xN array. x is first row, y is second row.
+        '''
+        if self.npts is None:
+            self.prepare(osa)
+        buf = np.empty((2, self.offsets[-1]))
+        for i, seg in enumerate(self.segments):
+            osa.config_scan(seg.start, seg.stop, seg.sens)
+            osa.start_sweep()
+            osa.wait_sweep()
+            if i == len(self.segments) - 1 and release is not None:
+                release()
+            n = osa.get_trace_points(self.trace)
+            if n != self.npts[i]:
+                # The instrument changed its point count since prepare, so move the slots.
+                buf = self._relayout(buf, i, n)
+            osa.read_trace(self.trace, out=buf[:, self.offsets[i]:self.offsets[i+1]], npts=n)
+        if self._keep is not None:
+            return buf[:, self._keep]
+        return buf
+
+    def _relayout(self, buf, i, n):
+        '''Returns a resized buffer after segment i turned out to have n points. The segments
+        before i are copied over.'''
+        npts = self.npts.copy()
+        npts[i] = n
+        self._layout(npts)
+        new = np.empty((2, self.offsets[-1]))
+        new[:, :self.offsets[i]] = buf[:, :self.offsets[i]]
+        return new
@@ -0,0 +1,96 @@
+'''Waveform helpers shared by the arbitrary waveform generator classes.'''
+
+import functools
+import math
+import numpy as np
+
+def repeat_cycles(freq1:float, freq2:float, tol=1e-6, max_cycles=1 << 20):
+    '''Finds the smallest numbers of cycles (n1, n2) of two sine waves that fit in one common
+    period, using the continued fraction expansion of freq1/freq2.\n
+    Arguments:
+        - freq1, freq2 [`float`]: The frequencies (in Hz) of the two sine waves.
+        - tol [`float`]: The relative error allowed on freq2 so that the period closes exactly.
+        - max_cycles [`int`]: Upper bound on n1 and n2.
+    Returns:
+        (int tuple): (n1, n2), with n1/freq1 ~= n2/freq2 being the repeat period.
+    Raises:
+        ValueError: If no ratio within tol needs fewer than max_cycles cycles.
+    '''
+    if freq1 <= 0 or freq2 <= 0:
+        raise ValueError("Frequencies must be positive.")
+    ratio = freq1 / freq2
+    # Convergents p/q of the continued fraction of ratio.
+    p0, q0, p1, q1 = 0, 1, 1, 0
+    x = ratio
+    while True:
+        a = math.floor(x)
+        p0, q0, p1, q1 = p1, q1, a*p1 + p0, a*q1 + q0
+        if p1 > max_cycles or q1 > max_cycles:
+            raise ValueError("No common period within " + str(max_cycles) + " cycles at tolerance " + str(tol))
+        if abs(p1/q1 - ratio) <= tol*ratio:
+            return p1, q1
+        frac = x - a
+        if frac == 0:
+            return p1, q1
+        x = 1 / frac
+
+def repeat_period(freq1:float, freq2:float, tol=1e-6) -> float:
+    '''Returns the shortest time (in s) after which the sum of both sine waves repeats, to within
+    the relative tolerance tol. See repeat_cycles.'''
+    n1, n2 = repeat_cycles(freq1, freq2, tol)
+    return n1 / freq1
+
+def choose_npts(freq1:float, freq2:float, max_pts:int, tol=1e-6, pts_per_cycle=None) -> int:
+    '''Chooses the number of points for one period of a two-tone waveform.
+
+    Arguments:
+        - freq1, freq2 [`float`]: The frequencies (in Hz) of the two sine waves.
+        - max_pts [`int`]: The waveform memory limit of the instrument, in points.
+        - tol [`float`]: Relative tolerance for the repeat period, see repeat_cycles.
+        - pts_per_cycle [`int`]: If given, use only as many points as needed for this many points
+            per cycle of the faster tone, which makes uploads shorter. Otherwise use max_pts.
+    Returns:
+        (int): The number of points.
+    '''
+    if pts_per_cycle is None:
+        return max_pts
+    n1, n2 = repeat_cycles(freq1, freq2, tol)
+    return int(min(max_pts, pts_per_cycle*max(n1, n2)))
+
+@functools.lru_cache(maxsize=64)
+def two_tone(freq1:float, freq2:float, npts:int, tol=1e-6):
+    '''Synthesizes one period of 0.5*(sin(2 pi freq1 t) + sin(2 pi freq2 t)).\n
+    The phases are computed from integer sample indices, so the waveform is exactly periodic and
+    its last point connects smoothly to the first one. Results are cached, keyed on all arguments.\n
+    Arguments:
+        - freq1, freq2 [`float`]: The frequencies (in Hz) of the two sine waves.
+        - npts [`int`]: The number of points in the period.
+        - tol [`float`]: Relative tolerance for the repeat period, see repeat_cycles.
+    Returns:
+        (tuple): A read-only float32 array of the npts points, and the repetition frequency (Hz)
+            of the arbitrary waveform.
+    '''
+    n1, n2 = repeat_cycles(freq1, freq2, tol)
+    if 2*max(n1, n2) > npts:
+        raise ValueError("A period holds " + str(max(n1, n2)) + " cycles, which cannot be sampled with "
+                         + str(npts) + " points. Use a looser tolerance.")
+    k = np.arange(npts, dtype=np.int64)
+    scale = np.float32(2*np.pi/npts)
+    pts = 0.5*(np.sin(((k*n1) % npts).astype(np.float32)*scale)
+               + np.sin(((k*n2) % npts).astype(np.float32)*scale))
+    pts.flags.writeable = False
+    return pts, freq1 / n1
+
+def to_dac(pts, dac_min:int, dac_max:int, dtype='<i2') -> np.ndarray:
+    '''Quantizes normalized waveform points to integer DAC codes.\n
+    Arguments:
+        - pts: The waveform points, normalized to [-1, 1]. Values outside are clipped.
+        - dac_min [`int`]: The DAC code corresponding to -1.
+        - dac_max [`int`]: The DAC code corresponding to +1.
+        - dtype: The integer dtype of the result.
+    Returns:
+        (numpy array): The DAC codes, rounded to the nearest integer.
+    '''
+    pts = np.clip(np.asarray(pts, dtype=np.float32), -1, 1)
+    half = (dac_max - dac_min) / 2
+    return np.rint(pts*half + (dac_min + half)).astype(dtype)
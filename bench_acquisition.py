@@ -0,0 +1,74 @@
+"""Compares a serial acquisition loop with the pipelined AcquisitionPipeline on simulated instruments
+with injected latencies, and reports the wall time per stage position for both."""
+
+import argparse
+import contextlib
+import io
+import time
+import numpy as np
+from SimVISA import SimResourceManager, SimOSA, SimPowerMeter, SimRotaryStage
+from OSA import OSA
+from PowerMeter import PowerMeter
+from RotaryStage import RotaryStage
+from AcqPipeline import AcquisitionPipeline
+
+def make_instruments(args):
+    '''Returns a simulated (stage, power meter, OSA) set-up.'''
+    osa_dev = SimOSA(npts=args.points, sweep_time=args.sweep_time)
+    osa_dev.bandwidth = args.bandwidth
+    pm_dev = SimPowerMeter(meas_time=args.meas_time)
+    stage_dev = SimRotaryStage(speed=args.stage_speed)
+    rm = SimResourceManager({'GPIB0::1::INSTR': osa_dev, 'USB::1::INSTR': pm_dev,
+                             'ASRL3::INSTR': stage_dev}, latency=args.latency)
+    stage = RotaryStage(rm, 'ASRL3::INSTR')
+    return stage, PowerMeter(rm, 'USB::1::INSTR'), OSA(rm, 'GPIB0::1::INSTR', data_format='ASCII')
+
+def sweep_fn(osa:OSA, sweep, release=None):
+    '''Runs one single-segment sweep, releasing the stage before the readout.'''
+    osa.config_scan(sweep[0], sweep[1], sweep[2])
+    osa.start_sweep()
+    osa.wait_sweep(poll_interval=0.01)
+    if release is not None:
+        release()
+    return osa.read_trace()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--positions', type=int, default=6)
+    parser.add_argument('--points', type=int, default=20001)
+    parser.add_argument('--sweep-time', type=float, default=0.3, help="Seconds per OSA sweep.")
+    parser.add_argument('--bandwidth', type=float, default=1e6, help="OSA bus bandwidth in bytes/s.")
+    parser.add_argument('--meas-time', type=float, default=0.05, help="Seconds per power reading.")
+    parser.add_argument('--stage-speed', type=float, default=2e5, help="Stage speed in steps/s.")
+    parser.add_argument('--settle-time', type=float, default=0.1)
+    parser.add_argument('--write-time', type=float, default=0.1, help="Seconds per dataset write.")
+    parser.add_argument('--latency', type=float, default=0.001, help="Seconds per bus message.")
+    args = parser.parse_args()
+
+    positions = np.linspace(0, 90, args.positions)
+    sweeps = [(1540, 1570, 'HIGH1')] * args.positions
+    def sink(data, startPow, endPow, pos, sweep, angle):
+        time.sleep(args.write_time)
+
+    with contextlib.redirect_stdout(io.StringIO()): # Silences the driver's progress prints.
+        stage, pm, osa = make_instruments(args)
+        t0 = time.perf_counter()
+        for pos, sweep in zip(positions, sweeps):
+            stage.move_to_pos(pos)
+            time.sleep(args.settle_time)
+            startPow = pm.read_pow()
+            data = sweep_fn(osa, sweep)
+            endPow = pm.read_pow()
+            sink(data, startPow, endPow, pos, sweep, pos)
+        serial = (time.perf_counter() - t0) / args.positions
+
+        stage, pm, osa = make_instruments(args)
+        pipeline = AcquisitionPipeline(stage, pm, lambda sweep, release: sweep_fn(osa, sweep, release),
+                                       sink, settle_time=args.settle_time)
+        t0 = time.perf_counter()
+        pipeline.run(positions, sweeps)
+        pipelined = (time.perf_counter() - t0) / args.positions
+
+    print(f"serial:    {serial:.3f} s/position")
+    print(f"pipelined: {pipelined:.3f} s/position "
+          f"(steady state {np.median(pipeline.position_times):.3f} s, sweep {args.sweep_time:.3f} s)")
@@ -0,0 +1,44 @@
+"""Compares a fixed high-sensitivity sweep of a whole band with an AdaptiveSweep (fast survey plus
+high-sensitivity sweeps around the features) on a simulated OSA whose sweep time scales with the
+span and the sensitivity."""
+
+import argparse
+import contextlib
+import io
+import time
+from SimVISA import SimResourceManager, SimOSA
+from OSA import OSA
+from SweepSegments import SegmentedSweep
+from AdaptiveSweep import AdaptiveSweep
+
+def time_runs(sweep, osa, positions):
+    '''Returns the mean wall time per run of a sweep and the number of points of the last run.'''
+    t0 = time.perf_counter()
+    for i in range(positions):
+        data = sweep.run(osa)
+    return (time.perf_counter() - t0) / positions, data.shape[1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--positions', type=int, default=5)
+    parser.add_argument('--start', type=float, default=1500)
+    parser.add_argument('--stop', type=float, default=1600)
+    parser.add_argument('--survey-sens', default='MID')
+    parser.add_argument('--refine-sens', default='HIGH3')
+    parser.add_argument('--time-per-nm', type=float, default=5e-4, help="Seconds per nm at NORM.")
+    parser.add_argument('--pts-per-nm', type=float, default=100)
+    args = parser.parse_args()
+
+    osa_dev = SimOSA(pts_per_nm=args.pts_per_nm, time_per_nm=args.time_per_nm)
+    rm = SimResourceManager({'GPIB0::1::INSTR': osa_dev}, latency=0.001)
+    osa = OSA(rm, 'GPIB0::1::INSTR', data_format='REAL64')
+    sweeps = {
+        'fixed': SegmentedSweep([args.start, args.stop, args.refine_sens]),
+        'adaptive': AdaptiveSweep(args.start, args.stop, args.survey_sens, args.refine_sens),
+        'adaptive (reuse)': AdaptiveSweep(args.start, args.stop, args.survey_sens, args.refine_sens, reuse=True),
+    }
+    for name, sweep in sweeps.items():
+        with contextlib.redirect_stdout(io.StringIO()): # Silences the driver's progress prints.
+            t, npts = time_runs(sweep, osa, args.positions)
+        print(f"{name:18s} {t:.3f} s/position, {npts} points")
+    print("refined regions:", sweeps['adaptive'].regions)
@@ -0,0 +1,59 @@
+"""Runs one step of an experiment on the simulated lab (a stage move, a sweep on each OSA, a power
+reading and a power supply telemetry read) twice with the asyncio facade of AsyncInstruments:
+once awaiting each operation in turn, and once with asyncio.gather."""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+from SimVISA import sim_lab, LAB_ADDRESSES
+from OSA import OSA
+from PowerMeter import PowerMeter
+from RotaryStage import RotaryStage
+from DCPS_E36300 import E36300
+from AsyncInstruments import AsyncInstrument
+
+async def open_lab(rm):
+    with contextlib.redirect_stdout(io.StringIO()): # The drivers print their IDs.
+        return await asyncio.gather(
+            AsyncInstrument.open(OSA, rm, LAB_ADDRESSES['osa']),
+            AsyncInstrument.open(OSA, rm, LAB_ADDRESSES['osa_2um']),
+            AsyncInstrument.open(RotaryStage, rm, LAB_ADDRESSES['stage']),
+            AsyncInstrument.open(PowerMeter, rm, LAB_ADDRESSES['power_meter']),
+            AsyncInstrument.open(E36300, rm, LAB_ADDRESSES['dcps']),
+        )
+
+def step(osa1, osa2, stage, pm, dcps, pos):
+    '''Returns the operations of one experiment step, as coroutines.'''
+    async def measure(osa):
+        await osa.sweep()
+        return await osa.read_trace()
+    return [stage.move_to_pos(pos), measure(osa1), measure(osa2), pm.read_pow(), dcps.read_telemetry()]
+
+async def main(args):
+    rm = sim_lab(latency=args.latency, sweep_time=args.sweep_time, meas_time=args.meas_time,
+                 stage_speed=args.stage_speed)
+    lab = await open_lab(rm)
+    for name, concurrent in (('serial', False), ('gather', True)):
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(args.steps):
+                ops = step(*lab, pos=(i % 2) * 90)
+                if concurrent:
+                    await asyncio.gather(*ops)
+                else:
+                    for op in ops:
+                        await op
+        print(f"{name:8s} {(time.perf_counter() - t0) / args.steps:.3f} s per step")
+    for instr in lab:
+        await instr.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--sweep-time', type=float, default=0.2)
+    parser.add_argument('--meas-time', type=float, default=0.05)
+    parser.add_argument('--stage-speed', type=float, default=1e5)
+    asyncio.run(main(parser.parse_args()))
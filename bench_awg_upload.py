@@ -0,0 +1,38 @@
+"""Compares ASCII and binary (DAC block) waveform uploads to the AWGs against the simulated backend.
+
+For each instrument and upload path this reports the bytes sent over the bus and the host-side
+time spent encoding and sending the waveform."""
+
+import argparse
+import time
+import numpy as np
+from SimVISA import SimResourceManager, SimAWG
+from AWG_33220A import AWG_33220A
+from AWG_DG4000 import DG4000
+
+def bench_upload(awg_cls, npts, binary, repeat):
+    '''Returns (bytes sent per upload, points received, mean host upload time in s).'''
+    device = SimAWG(decode=False)
+    rm = SimResourceManager({'USB::1::INSTR': device})
+    awg = awg_cls(rm, 'USB::1::INSTR')
+    awg.pts = 0.5*(np.sin(np.linspace(0, 20*np.pi, npts)) + np.sin(np.linspace(0, 22*np.pi, npts)))
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        awg.write_pts(binary=binary)
+    elapsed = (time.perf_counter() - t0) / repeat
+    return device.upload_bytes, device.upload_points, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--bandwidth', type=float, default=1e6,
+                        help="Bus bandwidth in bytes/s used to project transfer time.")
+    args = parser.parse_args()
+
+    print(f"{'instrument':>10} {'points':>7} {'path':>6} {'bytes':>9} {'encode [ms]':>12} {'bus [ms]':>9}")
+    for awg_cls, npts in ((AWG_33220A, 65536), (DG4000, 16384)):
+        for binary in (False, True):
+            nbytes, received, elapsed = bench_upload(awg_cls, npts, binary, args.repeat)
+            assert received == npts
+            print(f"{awg_cls.__name__:>10} {npts:>7} {'binary' if binary else 'ascii':>6} {nbytes:>9} "
+                  f"{1e3*elapsed:>12.2f} {1e3*nbytes/args.bandwidth:>9.1f}")
@@ -0,0 +1,52 @@
+"""Runs a 3-axis scan (stage angle x power supply voltage x piezo voltage, one OSA sweep per point)
+on the simulated lab in raster and in snake order, and compares the setter calls and the wall time.
+The snake run is written to a dataset and read back by its N-D index."""
+
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+import numpy as np
+from SimVISA import sim_lab, LAB_ADDRESSES
+from OSA import OSA
+from RotaryStage import RotaryStage
+from DCPS_E36300 import E36300
+from PC_MDT693B import MDT693B
+from SweepDataset import SweepDatasetWriter
+from SweepSegments import SegmentedSweep
+from NDScan import NDScan, ScanDataset, stage_axis, dcps_axis, piezo_axis
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--angles', type=int, default=4)
+    parser.add_argument('--volts', type=int, default=3)
+    parser.add_argument('--piezo', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--stage-speed', type=float, default=2e5, help="Stage speed in steps/s.")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()): # The drivers print their IDs and progress.
+        rm = sim_lab(latency=args.latency, stage_speed=args.stage_speed)
+        osa = OSA(rm, LAB_ADDRESSES['osa'], data_format='REAL64')
+        stage = RotaryStage(rm, LAB_ADDRESSES['stage'])
+        dcps = E36300(rm, LAB_ADDRESSES['dcps'])
+        piezo = MDT693B(rm, LAB_ADDRESSES['piezo'])
+    sweep = SegmentedSweep([1540, 1560, 'MID'])
+    axes = [stage_axis(stage, np.linspace(0, 90, args.angles)),
+            dcps_axis(dcps, '(@1)', np.linspace(1, 5, args.volts)),
+            piezo_axis(piezo, 'x', np.linspace(0, 150, args.piezo))]
+    folder = tempfile.mkdtemp()
+    for order in ('raster', 'snake'):
+        scan = NDScan(axes, lambda point: sweep.run(osa), order=order)
+        stage.move_to_pos(0)
+        writer = SweepDatasetWriter(folder + '/' + order, attrs=scan.attrs())
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            scan.run(writer)
+        total = time.perf_counter() - t0
+        writer.close()
+        print(f"{order:7s} {total:6.2f} s  setter calls {scan.set_calls}")
+    data = ScanDataset(folder + '/snake')
+    print("Entries of the grid:", data.entries.shape, "missing:", int((data.entries < 0).sum()),
+          "traces at 30 deg:", data.select(angle=30).shape)
@@ -0,0 +1,48 @@
+"""Compares ASCII and binary (REAL32/REAL64) OSA trace readout against the simulated backend.
+
+For each trace length and data format this reports the bytes moved over the bus, the host-side
+time spent reading and parsing the reply, and the projected bus time at a given bandwidth, for a
+full readout (X and Y), a readout with the X axis cached, and a 1 nm region of interest."""
+
+import argparse
+import contextlib
+import io
+import time
+from SimVISA import SimResourceManager, SimOSA
+from OSA import OSA
+
+MODES = ('full', 'cached', 'roi')
+
+def bench_readout(npts, data_format, repeat, mode='full'):
+    '''Returns (bytes read per trace, mean host readout time in s) for one configuration.'''
+    rm = SimResourceManager({'GPIB0::1::INSTR': SimOSA(npts=npts)})
+    osa = OSA(rm, 'GPIB0::1::INSTR', data_format=data_format, cache_x=(mode != 'full'))
+    res = rm.opened['GPIB0::1::INSTR']
+    osa.config_scan(1540, 1570, 'HIGH1')
+    with contextlib.redirect_stdout(io.StringIO()): # Silences the driver's progress prints.
+        osa.sweep()
+        osa.read_trace('TRA') # Fills the X axis cache.
+        res.reset_counters()
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            if mode == 'roi':
+                osa.read_roi((1549.5, 1550.5), 'TRA')
+            else:
+                osa.read_trace('TRA')
+        elapsed = (time.perf_counter() - t0) / repeat
+    return res.bytes_read / repeat, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, nargs='+', default=[1001, 10001, 50001])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--bandwidth', type=float, default=1e6,
+                        help="Bus bandwidth in bytes/s used to project transfer time (GPIB ~1e6).")
+    args = parser.parse_args()
+
+    print(f"{'points':>8} {'format':>7} {'mode':>7} {'bytes':>11} {'parse [ms]':>11} {'bus [ms]':>10}")
+    for npts in args.points:
+        for fmt in OSA.DATA_FORMATS:
+            for mode in MODES:
+                nbytes, elapsed = bench_readout(npts, fmt, args.repeat, mode)
+                print(f"{npts:>8} {fmt:>7} {mode:>7} {nbytes:>11.0f} {1e3*elapsed:>11.2f} {1e3*nbytes/args.bandwidth:>10.1f}")
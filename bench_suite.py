@@ -0,0 +1,249 @@
+"""End-to-end throughput benchmarks of the acquisition loop and the instrument drivers, run against
+the simulated lab from SimVISA.sim_lab. Reports the wall time per stage position, trace points per
+second and bus bytes per second, and can compare the results with a saved baseline so that
+performance regressions show up before they reach the lab:
+
+    python bench_suite.py --json baseline.json
+    python bench_suite.py --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+import numpy as np
+from SimVISA import sim_lab, LAB_ADDRESSES
+from OSA import OSA
+from PowerMeter import PowerMeter
+from RotaryStage import RotaryStage
+from AWG_33220A import AWG_33220A
+from AWG_DG4000 import DG4000
+from DCPS_E36300 import E36300
+from PC_MDT693B import MDT693B
+from AcqPipeline import AcquisitionPipeline
+from SweepDataset import SweepDatasetWriter
+from SweepSegments import SegmentedSweep
+
+# Metrics where a higher value is better. For all other metrics lower is better.
+HIGHER_IS_BETTER = ('points_per_s', 'bytes_per_s', 'ops_per_s')
+
+def make_lab(args):
+    return sim_lab(latency=args.latency, npts=args.points, sweep_time=args.sweep_time,
+                   meas_time=args.meas_time, stage_speed=args.stage_speed,
+                   osa_bandwidth=args.osa_bandwidth)
+
+def bench_acquisition(args, data_format, pipelined):
+    '''Runs the collect_dataset.py acquisition loop (segmented sweeps, power logging, dataset
+    writes) over args.positions stage positions.'''
+    rm = make_lab(args)
+    stage = RotaryStage(rm, LAB_ADDRESSES['stage'])
+    pm = PowerMeter(rm, LAB_ADDRESSES['power_meter'])
+    osa = OSA(rm, LAB_ADDRESSES['osa'], data_format=data_format)
+    positions = np.linspace(0, 90, args.positions)
+    sweep = SegmentedSweep([1540, 1560, 'HIGH1'] * args.segments)
+    npoints = []
+    with tempfile.TemporaryDirectory() as folder:
+        dataset = SweepDatasetWriter(folder + '/run', attrs={'data_format': data_format})
+        def measure(sweep, release=None):
+            t_start = time.time()
+            data = sweep.run(osa, release)
+            return data, t_start, time.time()
+        def store(result, startPow, endPow, pos, sweep, angle):
+            data, t_start, t_end = result
+            npoints.append(data.shape[1])
+            dataset.append(data, startPow, endPow, angle=angle, config=sweep.config(),
+                           arrays={'power': pm.snapshot(t_start, t_end)}, target_angle=float(pos))
+        pm.start_logging(rate=100)
+        for res in rm.opened.values(): # Opening the instruments is not part of the measurement.
+            res.reset_counters()
+        t0 = time.perf_counter()
+        if pipelined:
+            pipeline = AcquisitionPipeline(stage, pm, measure, store, settle_time=args.settle_time)
+            pipeline.run(positions, [sweep] * len(positions))
+            position_times = pipeline.position_times
+        else:
+            position_times = []
+            for pos in positions:
+                t_pos = time.perf_counter()
+                angle = stage.move_to_pos(pos)
+                time.sleep(args.settle_time)
+                startPow = pm.read_pow()
+                result = measure(sweep)
+                endPow = pm.read_pow()
+                store(result, startPow, endPow, pos, sweep, angle)
+                position_times.append(time.perf_counter() - t_pos)
+        total = time.perf_counter() - t0
+        pm.stop_logging()
+        dataset.close()
+    return {'s_per_position': float(np.median(position_times)),
+            'points_per_s': sum(npoints) / total,
+            'bytes_per_s': rm.bytes_moved() / total}
+
+def bench_awg_upload(args, awg_class, address):
+    '''Uploads a full-memory two-tone waveform args.repeats times.'''
+    rm = make_lab(args)
+    awg = awg_class(rm, address)
+    pts, _ = awg.calc_points(1e3, 1.7e3)
+    res = rm.opened[address]
+    res.reset_counters()
+    t0 = time.perf_counter()
+    for i in range(args.repeats):
+        awg.write_pts(pts)
+    total = time.perf_counter() - t0
+    return {'s_per_op': total / args.repeats, 'points_per_s': args.repeats * len(pts) / total,
+            'bytes_per_s': res.bytes_written / total}
+
+def bench_dcps_telemetry(args):
+    '''Reads the voltage and current of all three channels args.repeats times.'''
+    rm = make_lab(args)
+    dcps = E36300(rm, LAB_ADDRESSES['dcps'])
+    t0 = time.perf_counter()
+    for i in range(args.repeats):
+        dcps.read_telemetry()
+    total = time.perf_counter() - t0
+    return {'s_per_op': total / args.repeats, 'ops_per_s': args.repeats / total}
+
+def bench_piezo(args):
+    '''Sets and reads back the three piezo voltages args.repeats times.'''
+    rm = make_lab(args)
+    piezo = MDT693B(rm, LAB_ADDRESSES['piezo'])
+    t0 = time.perf_counter()
+    for i in range(args.repeats):
+        for axis in ('x', 'y', 'z'):
+            piezo.set_voltage(axis, i % 150)
+            piezo.get_voltage(axis)
+    total = time.perf_counter() - t0
+    return {'s_per_op': total / args.repeats, 'ops_per_s': args.repeats / total}
+
+def bench_piezo_raster(args, sync=False):
+    '''Measures a 10x10 power map with MDT693B.raster, streaming the setpoints (the default) or
+    waiting for the controller's acknowledgement of each one.'''
+    rm = make_lab(args)
+    piezo = MDT693B(rm, LAB_ADDRESSES['piezo'])
+    pm = PowerMeter(rm, LAB_ADDRESSES['power_meter'])
+    grid = np.linspace(0, 150, 10)
+    t0 = time.perf_counter()
+    piezo.raster(grid, grid, 75, power_meter=pm, sync=sync)
+    total = time.perf_counter() - t0
+    return {'s_per_op': total / grid.size**2, 'ops_per_s': grid.size**2 / total}
+
+def bench_piezo_points(args):
+    '''Measures the same 10x10 power map point by point, as before MDT693B.scan: one voltage
+    write per axis, each acknowledged, then a power reading.'''
+    rm = make_lab(args)
+    piezo = MDT693B(rm, LAB_ADDRESSES['piezo'])
+    pm = PowerMeter(rm, LAB_ADDRESSES['power_meter'])
+    grid = np.linspace(0, 150, 10)
+    t0 = time.perf_counter()
+    for yv in grid:
+        for xv in grid:
+            for axis, volt in (('x', xv), ('y', yv), ('z', 75)):
+                piezo.pc.write(axis + "voltage=" + str(volt))
+                piezo.pc.read()
+            pm.read_pow()
+    total = time.perf_counter() - t0
+    return {'s_per_op': total / grid.size**2, 'ops_per_s': grid.size**2 / total}
+
+def bench_power_meter(args):
+    '''Takes args.repeats single power readings.'''
+    rm = make_lab(args)
+    pm = PowerMeter(rm, LAB_ADDRESSES['power_meter'])
+    t0 = time.perf_counter()
+    for i in range(args.repeats):
+        pm.read_pow()
+    total = time.perf_counter() - t0
+    return {'s_per_op': total / args.repeats, 'ops_per_s': args.repeats / total}
+
+def bench_fault_logging(args):
+    '''Runs collect_dataset.run_acquisition through ResilientIO while the power meter disconnects
+    during power logging, and counts the positions stored without fresh power samples.'''
+    from collect_dataset import run_acquisition
+    from ResilientIO import ResilientResourceManager
+    from SweepDataset import SweepDataset
+    sim = make_lab(args)
+    sim.inject(LAB_ADDRESSES['power_meter'], 'disconnect', match='READ?', after=20)
+    rm = ResilientResourceManager(sim, backoff=0.001, reconnect_delay=0.001)
+    with tempfile.TemporaryDirectory() as folder:
+        run = {'stage': LAB_ADDRESSES['stage'], 'power_meter': LAB_ADDRESSES['power_meter'],
+               'osas': [{'band': 'osa', 'address': LAB_ADDRESSES['osa'], 'data_format': 'REAL64',
+                         'sweeps': ['1540, 1560, HIGH1']}],
+               'positions': np.linspace(0, 90, args.positions).tolist(), 'folder': folder, 'name': 'run',
+               'export_dat': False}
+        t0 = time.perf_counter()
+        dataset = SweepDataset(run_acquisition(rm, run))
+        total = time.perf_counter() - t0
+        stale = sum(len(dataset.aux(i, 'power')) == 0 for i in range(len(dataset)))
+    return {'s_per_position': total / args.positions, 'stale_positions': stale,
+            'reconnects': rm.stats()[LAB_ADDRESSES['power_meter']]['reconnects']}
+
+BENCHMARKS = {
+    'acquisition/serial/ASCII': lambda args: bench_acquisition(args, 'ASCII', False),
+    'acquisition/pipelined/ASCII': lambda args: bench_acquisition(args, 'ASCII', True),
+    'acquisition/pipelined/REAL32': lambda args: bench_acquisition(args, 'REAL32', True),
+    'acquisition/pipelined/REAL64': lambda args: bench_acquisition(args, 'REAL64', True),
+    'awg/33220A/upload': lambda args: bench_awg_upload(args, AWG_33220A, LAB_ADDRESSES['awg_33220a']),
+    'awg/DG4000/upload': lambda args: bench_awg_upload(args, DG4000, LAB_ADDRESSES['awg_dg4000']),
+    'dcps/telemetry': bench_dcps_telemetry,
+    'piezo/set_get': bench_piezo,
+    'piezo/raster': bench_piezo_raster,
+    'piezo/raster/sync': lambda args: bench_piezo_raster(args, sync=True),
+    'piezo/point_by_point': bench_piezo_points,
+    'power_meter/read_pow': bench_power_meter,
+    'faults/power_meter_disconnect': bench_fault_logging,
+}
+
+def compare(results, baseline, tolerance):
+    '''Returns a list of (benchmark, metric, baseline, value) for every metric that got worse than
+    its baseline by more than the relative tolerance.'''
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            ref = baseline.get(name, {}).get(metric)
+            if not ref:
+                continue
+            change = (value - ref) / ref
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append((name, metric, ref, value))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', default='', help="Only run benchmarks whose name contains this string.")
+    parser.add_argument('--positions', type=int, default=5)
+    parser.add_argument('--segments', type=int, default=2, help="OSA sub-sweeps per position.")
+    parser.add_argument('--points', type=int, default=20001, help="Points per OSA trace.")
+    parser.add_argument('--sweep-time', type=float, default=0.2, help="Seconds per OSA sweep.")
+    parser.add_argument('--osa-bandwidth', type=float, default=1e6, help="OSA bus bandwidth in bytes/s.")
+    parser.add_argument('--meas-time', type=float, default=0.01, help="Seconds per measurement.")
+    parser.add_argument('--stage-speed', type=float, default=2e5, help="Stage speed in steps/s.")
+    parser.add_argument('--settle-time', type=float, default=0.05)
+    parser.add_argument('--latency', type=float, default=0.001, help="Seconds per bus message.")
+    parser.add_argument('--repeats', type=int, default=20, help="Repetitions of the driver benchmarks.")
+    parser.add_argument('--json', help="Write the results to this file.")
+    parser.add_argument('--baseline', help="Compare with results saved by an earlier --json run.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if args.only not in name:
+            continue
+        with contextlib.redirect_stdout(io.StringIO()): # Silences the driver's progress prints.
+            results[name] = bench(args)
+        print(f"{name:30s} " + "  ".join(f"{k} {v:.4g}" for k, v in results[name].items()))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, metric, ref, value in regressions:
+            print(f"REGRESSION {name} {metric}: {ref:.4g} -> {value:.4g}")
+        if regressions:
+            sys.exit(1)
@@ -1,12 +1,45 @@
-# Import Python packages.
-import pyvisa
+# Import Python packages. wx is only imported by the dialogs of the interactive mode.
+import argparse
+import atexit
+import json
 import numpy as np
-import wx
 import datetime
+import os
+import threading
+import time
 # Import instrument control classes.
 from OSA import OSA
 from PowerMeter import PowerMeter
 from RotaryStage import RotaryStage
+from AcqPipeline import AcquisitionPipeline
+from SweepDataset import SweepDataset, SweepDatasetWriter, write_dat
+from SweepSegments import SegmentedSweep, parse_sweep_config
+from AdaptiveSweep import AdaptiveSweep
+from RunManifest import RunManifest
+from MultiOSA import MultiOSA
+from InstrumentRegistry import InstrumentRegistry, resource_manager
+from SCPITrace import Tracer, span
+from ResilientIO import ResilientResourceManager, StalledError, Watchdog, classify
+
+# Instrument addresses used when a run file does not give them.
+DEFAULT_ADDRESSES = {
+    'stage': "ASRL3::INSTR", # TODO: Check this address before running.
+    'power_meter': 'USB::1::INSTR', # TODO: Change address to correct one before running.
+    'osa': 'GPIB0::1::INSTR', # TODO: Check the GPIB address (1um OSA) before running.
+}
+OSA_2UM_ADDRESS = "GPIB::30::INSTR" # TODO: Check the GPIB address (2um OSA) before running.
+# Seconds the sweeps of one position may take before the watchdog aborts them.
+DEFAULT_STALL_TIMEOUT = 900
+
+_app = None
+
+def _wx_app():
+    '''Imports wx and creates the wx.App on first use. Returns the wx module.'''
+    global _app
+    import wx
+    if _app is None:
+        _app = wx.App(None)
+    return wx
 
 def get_path(wildcard:str, msg:str):
     '''Returns the path to a user selected file of type given by
@@ -18,7 +51,7 @@ def get_path(wildcard:str, msg:str):
     Returns:
         (str): The path to the selected file. Returns None if cancelled.
     '''
-    app = wx.App(None)
+    wx = _wx_app()
     style = wx.FD_OPEN | wx.FD_FILE_MUST_EXIST
     dialog = wx.FileDialog(None, msg, wildcard=wildcard, style=style)
     if dialog.ShowModal() == wx.ID_OK:
@@ -31,7 +64,7 @@ def get_path(wildcard:str, msg:str):
 def get_dir(msg:str):
     '''Returns the path to a user selected directory.
     '''
-    app = wx.App(None)
+    wx = _wx_app()
     style = wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST
     dialog = wx.DirDialog(None, msg, style=style)
     if dialog.ShowModal() == wx.ID_OK:
@@ -45,7 +78,7 @@ def get_usr_text(msg:str):
     '''Prompts the user for text input with the message passed as an argument.
     Returns a string with what the user typed.
     '''
-    app = wx.App(None)
+    wx = _wx_app()
     dialog = wx.TextEntryDialog(None, msg)
     if dialog.ShowModal() == wx.ID_OK:
         ans = dialog.GetValue()
@@ -54,25 +87,49 @@ def get_usr_text(msg:str):
     dialog.Destroy()
     return ans
 
-def sweepline(sweep_arr, osa:OSA):
+def sweepline(sweep_arr, osa:OSA, release=None):
     '''Performs the set of sweeps defined by the array sweep_arr on the specified OSA. \n
     Arguments:
-        sweep_arr: An array of length 3n specifiying the parameters of each subsweep to take.
+        sweep_arr: An array of length 3n specifiying the parameters of each subsweep to take, or a
+            SegmentedSweep or AdaptiveSweep. Passing the same sweep object for every position avoids
+            re-querying the number of points of each segment.
         osa: The OSA on which the sweeps are to be performed.
+        release (optional): Called once the last sweep has finished, before its trace is read out.
+            Lets a pipelined run move the stage while the final readout is in progress.
     Returns:
         (numpy array): The collected data of all of the sweeps in a numpy array (2xN array).
     '''
-    num_sweeps = int(len(sweep_arr)/3)
-    sweep_dat = np.array([[],[]])
-    for i in range(num_sweeps):
-        osa.config_scan(int(num_sweeps[i]), int(num_sweeps[i+1]), num_sweeps[i+2])
-        data = osa.sweep()
-        sweep_dat = np.hstack((sweep_dat, data))
-    return sweep_dat
+    if not isinstance(sweep_arr, (SegmentedSweep, AdaptiveSweep)):
+        sweep_arr = SegmentedSweep(parse_sweep_config(sweep_arr))
+    return sweep_arr.run(osa, release)
+
+def make_sweep(line:str, overlap:str=None):
+    '''Creates the sweep for one line of a sweep config file. Lines starting with ADAPTIVE, like
+    "ADAPTIVE, 1500, 1600, MID, HIGH3, 10", define an AdaptiveSweep (start, stop, survey
+    sensitivity, refining sensitivity and optionally the threshold in dB above the noise floor,
+    followed by optional reuse=true and survey_every=N fields, see AdaptiveSweep.from_config).
+    Other lines are (start, stop, sensitivity) triples for a SegmentedSweep.\n
+    Arguments:
+        line [`str`]: The line of the sweep config file.
+        overlap [`str`]: How a SegmentedSweep resolves overlapping segments: 'first' (deduplicate),
+            'last' (stitch) or 'keep' (keep every point). If not given, overlapping segments are
+            deduplicated, so no wavelength is stored twice.
+    '''
+    if line.strip().upper().startswith('ADAPTIVE'):
+        return AdaptiveSweep.from_config(line)
+    if overlap not in (None, 'first', 'last', 'keep'):
+        raise ValueError("overlap must be 'first', 'last' or 'keep', not " + repr(overlap))
+    segments = parse_sweep_config(line)
+    if overlap is None:
+        spans = sorted((seg.start, seg.stop) for seg in segments)
+        overlapping = any(nxt[0] < prev[1] for prev, nxt in zip(spans, spans[1:]))
+        overlap = 'first' if overlapping else 'keep'
+    return SegmentedSweep(segments, None if overlap == 'keep' else overlap)
 
 def write_to_file(data: np.ndarray, startPow, endPow, folder_path, header: str = None):
     '''Writes the collected data to a text file with extension .dat, and puts the
-    starting and ending power in the header of the data file. \n
+    starting and ending power in the header of the data file. Runs now store their sweeps in a
+    single SweepDataset instead; this is kept for one-off legacy files. \n
     Arguments:
         data: A 2xN numpy array of the sweep data to write. X is in nm and in the 0 row position, Y in dBm in the 1 row position.
         startPow: The power at which the measurement began.
@@ -84,35 +141,128 @@ def write_to_file(data: np.ndarray, startPow, endPow, folder_path, header: str =
     '''
     t_stamp = datetime.datetime.now()
     f_name = "sweep_" + str(t_stamp).replace(' ', '_') + ".dat"
-    # Create file to write data to.
-    file = open(folder_path + "\\" + f_name, "a")
-    # Write a header to that file.
-    file.writelines(["# Power at measurement start: " + startPow + "\n", "# Power at measurement end: " + endPow + "\n"])
-    file.write("# Wavelength [nm]\tPower [dBm]\n")
-    if header != None:
-        header = header.splitlines()
-        for line in header:
-            file.write('# ' + line + '\n')
-    # Write the data to the file.
-    data = data.transpose()
-    for pt in data:
-        file.write(str(pt[0]) + "\t" + str(pt[1]) + "\n")
-    # Close file and exit.
-    file.close()
+    write_dat(data, startPow, endPow, folder_path + "\\" + f_name, header)
     return True
 
-if __name__ ==  "__main__":
-    # Set up connections to all instruments.
-    rm = pyvisa.ResourceManager()
-    rotStg = RotaryStage(rm, "ASRL3::INSTR") # TODO: Check this address before running.
-    pwrMeter = PowerMeter(rm, 'USB::1::INSTR') # TODO: Change address to correct one before running.
-    # Ask what OSA to use to collect data.
-    osa_spec = get_usr_text("Specify what OSA to use. Type '1' for 1 um OSA, and '2' for 2 um OSA.")
-    osa = None
-    if int(osa_spec) == 1:
-        osa = OSA(rm, 'GPIB0::1::INSTR') # TODO: Check the GPIB address (1um OSA) before running.
+def load_run_file(path:str):
+    '''Reads a run file and returns the run config used by run_acquisition. The file can be TOML
+    (.toml), JSON (.json) or YAML (.yaml/.yml, needs PyYAML). Example in TOML:
+
+        sweeps = ["1540, 1560, HIGH1", "ADAPTIVE, 1500, 1600, MID, HIGH3"]   # Or sweep_file = "path"
+        stall_timeout = 900         # Optional, seconds the sweeps of one position may take.
+        overlap = "first"           # Optional, how overlapping segments of a sweep are resolved:
+                                    # "first" (deduplicate, the default), "last" (stitch) or "keep".
+
+        [instruments]               # Optional, defaults to DEFAULT_ADDRESSES.
+        stage = "ASRL3::INSTR"
+        power_meter = "USB::1::INSTR"
+        osa = "GPIB0::1::INSTR"
+        data_format = "REAL64"      # Optional, OSA trace format.
+
+        [positions]                 # Either start/stop/steps or a list of values.
+        start = 0
+        stop = 90
+        steps = 10
+
+        [output]
+        folder = "D:/data"
+        name = "run_polarization"   # Optional, defaults to run_<date>_<time>.
+        export_dat = false          # Optional, also write legacy .dat files at the end.
+
+    To measure with several OSAs at once, list them as [[osas]] tables instead of setting
+    instruments.osa. Each needs a band name and an address, and can have its own sweeps,
+    sweep_file, data_format and overlap (the top-level ones are the defaults):
+
+        [[osas]]
+        band = "1um"
+        address = "GPIB0::1::INSTR"
+        sweeps = ["1000, 1100, HIGH1"]
+
+        [[osas]]
+        band = "2um"
+        address = "GPIB::30::INSTR"
+        sweeps = ["1900, 2100, HIGH1"]
+
+    Relative paths in the file are relative to the run file.\n
+    Returns:
+        (dict): The run config.
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.toml':
+        import tomllib
+        with open(path, 'rb') as file:
+            spec = tomllib.load(file)
+    elif ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading YAML run files needs PyYAML (pip install pyyaml).")
+        with open(path) as file:
+            spec = yaml.safe_load(file)
+    else:
+        with open(path) as file:
+            spec = json.load(file)
+    for key in ('positions', 'output'):
+        if key not in spec:
+            raise ValueError("Run file " + path + " has no '" + key + "' section.")
+    base = os.path.dirname(os.path.abspath(path))
+    def read_sweeps(section):
+        if 'sweep_file' in section:
+            with open(os.path.join(base, section['sweep_file'])) as file:
+                sweeps = file.readlines()
+        elif 'sweeps' in section:
+            sweeps = section['sweeps']
+            sweeps = [sweeps] if isinstance(sweeps, str) else sweeps
+        else:
+            return None
+        sweeps = [', '.join(map(str, s)) if isinstance(s, (list, tuple)) else s for s in sweeps]
+        return [line.strip() for line in sweeps if line.strip()]
+    instruments = dict(DEFAULT_ADDRESSES, **spec.get('instruments', {}))
+    pos = spec['positions']
+    if isinstance(pos, dict) and 'values' in pos:
+        positions = [float(p) for p in pos['values']]
+    elif isinstance(pos, dict):
+        positions = np.linspace(pos['start'], pos['stop'], int(pos['steps'])).tolist()
     else:
-        osa = OSA(rm, "GPIB::30::INSTR") # TODO: Check the GPIB address (2um OSA) before running.
+        positions = [float(p) for p in pos]
+    sweeps = read_sweeps(spec)
+    data_format = instruments.get('data_format', 'REAL64')
+    overlap = spec.get('overlap')
+    osas = []
+    for osa in spec.get('osas', [{'band': 'osa', 'address': instruments['osa']}]):
+        osas.append({'band': str(osa['band']), 'address': osa['address'],
+                     'data_format': osa.get('data_format', data_format),
+                     'overlap': osa.get('overlap', overlap),
+                     'sweeps': read_sweeps(osa) or sweeps})
+        if not osas[-1]['sweeps']:
+            raise ValueError("Run file " + path + " needs 'sweeps' or 'sweep_file' for OSA " + osas[-1]['band'])
+    output = spec.get('output', {})
+    return {
+        'stage': instruments['stage'], 'power_meter': instruments['power_meter'],
+        'osas': osas,
+        'positions': positions,
+        'folder': os.path.join(base, output.get('folder', '.')),  # Unchanged if absolute.
+        'name': output.get('name'),
+        'export_dat': bool(output.get('export_dat', False)),
+        'stall_timeout': spec.get('stall_timeout'),
+    }
+
+def osa_selection(answer:str):
+    '''Returns the bands chosen by an answer to the OSA prompt of ask_run: ['1um'] for '1',
+    ['2um'] for '2' and both for '12'. The list is empty if the answer names no OSA.'''
+    return [band for key, band in (('1', '1um'), ('2', '2um')) if key in answer]
+
+def ask_run():
+    '''Asks for the run config with wx dialogs, as the script always did before run files.'''
+    # Ask what OSA to use to collect data, until the answer names at least one.
+    bands = []
+    while not bands:
+        osa_spec = get_usr_text("Specify what OSA to use. Type '1' for 1 um OSA, '2' for 2 um OSA, \
+            and '12' to use both at once.")
+        if osa_spec is None:
+            raise SystemExit("No OSA selected, run cancelled.")
+        bands = osa_selection(osa_spec)
+    addresses = {'1um': DEFAULT_ADDRESSES['osa'], '2um': OSA_2UM_ADDRESS}
 
     # Define the set of motor positions to iterate over.
     pos_params = get_usr_text("Enter the motor start position, end position, \
@@ -120,31 +270,219 @@ if __name__ ==  "__main__":
     pos_params = ''.join(pos_params.split()).split(",") # Removes whitespace, then splits into array.
     positions_to_take = np.linspace(int(pos_params[0]), int(pos_params[1]), int(pos_params[2]))
 
-    # Get the list of sweeps to perform.
-    path = get_path(".txt", 'Open Sweep Config File')
-    file = open(path, 'r')
-    sweeps = file.readlines()
-    file.close()
+    # Get the list of sweeps to perform for each OSA.
+    osas = []
+    for band in bands:
+        path = get_path(".txt", 'Open Sweep Config File (' + band + ' OSA)')
+        file = open(path, 'r')
+        sweep_lines = [line.strip() for line in file.readlines() if line.strip()]
+        file.close()
+        osas.append({'band': band, 'address': addresses[band], 'data_format': 'REAL64', 'sweeps': sweep_lines})
 
-    #Get folder to write data files to.
+    #Get folder to write the dataset to.
     write_folder = get_dir("Select Folder to Save Data To")
+    return dict(DEFAULT_ADDRESSES, osas=osas, positions=positions_to_take.tolist(),
+                folder=write_folder, name=None, export_dat=False)
+
+def osa_bands(run:dict):
+    '''Returns the list of OSAs of a run config. Configs written before several OSAs were
+    supported have a single 'osa' address instead.'''
+    if 'osas' in run:
+        return run['osas']
+    return [{'band': 'osa', 'address': run['osa'], 'data_format': run.get('data_format', 'REAL64'),
+             'sweeps': run['sweeps']}]
 
-    # Take the sweeps and write to files.
-    if len(sweeps) == 1:
-        sweep = ''.join(sweeps[0].split()).split(",")
-        for pos in positions_to_take:
-            rotStg.move_to_pos(pos)
-            startPow = pwrMeter.read_pow() #Record laser power at start of sweep.
-            data = sweepline(sweep, osa)
-            endPow = pwrMeter.read_pow() #Record laser power at end of sweep.
-            write_to_file(data, startPow, endPow, write_folder)
-        pass
+def run_acquisition(rm, run:dict=None, resume:str=None, instruments:InstrumentRegistry=None, feed=None):
+    '''Runs one acquisition: one sweep per stage position on every OSA of the run, stored in a
+    dataset with a run manifest. The OSAs sweep concurrently, and the traces of one position are
+    stored together, tagged with the band of their OSA.\n
+    Arguments:
+        rm: A pyvisa ResourceManager (or SimVISA.SimResourceManager).
+        run [`dict`]: The run config, as returned by load_run_file or ask_run.
+        resume [`str`]: Instead of run, the dataset directory of an interrupted run to continue.
+            Its config is read from the run manifest.
+        instruments [`InstrumentRegistry`]: Where to get the instruments from. They are left open
+            for later runs, so the stage is not homed and the instruments not set up again. If not
+            given, the instruments are opened for this run only.
+        feed [`LiveView.LiveFeed`]: If given, every trace is published to it for the live view.
+    Returns:
+        (str): The dataset directory.
+    '''
+    if resume:
+        # Everything needed to continue is in the manifest.
+        write_path = resume
+        manifest = RunManifest.load(write_path)
+        run = dict(DEFAULT_ADDRESSES, **manifest.config)
+    else:
+        run_name = run.get('name') or "run_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        write_path = os.path.join(run['folder'], run_name)
+
+    # Set up connections to all instruments.
+    registry = instruments or InstrumentRegistry(rm)
+    rotStg = registry.get(RotaryStage, run['stage'])
+    pwrMeter = registry.get(PowerMeter, run['power_meter'])
+    bands = osa_bands(run)
+    osas = {b['band']: registry.get(OSA, b['address'], data_format=b['data_format']) for b in bands}
+    multi = MultiOSA(osas)
+    dataset = SweepDatasetWriter(write_path, attrs={'osas': [{k: b[k] for k in ('band', 'address', 'data_format')}
+                                                             for b in bands]},
+                                 append=bool(resume))
+    if resume:
+        manifest.resume(dataset)
+    else:
+        manifest = RunManifest(write_path, run)
+
+    # Take the sweeps and write them to the dataset. Each instrument runs on its own worker, so
+    # the write and the trace readout of one position overlap the move to the next.
+    sweeps = [{} for pos in run['positions']] # The sweep of each band at each position.
+    for b in bands:
+        band_sweeps = [make_sweep(line, b.get('overlap')) for line in b['sweeps']]
+        if len(band_sweeps) == 1:
+            band_sweeps = band_sweeps * len(run['positions'])
+        for i, sweep in enumerate(band_sweeps):
+            sweeps[i][b['band']] = sweep
+    todo = manifest.remaining()
+    next_index = iter(todo) # The writer runs the positions in order.
+    # Log the laser power continuously, so every sweep is stored with its full power trace.
+    pwrMeter.start_logging(rate=100)
+    # A sweep that never completes is aborted. It is measured again, like one whose OSA had to be
+    # reconnected or whose status poll timed out (ResilientIO does not retry the poll, as it clears
+    # the completion bit), if the stage has not moved on yet.
+    watchdog = Watchdog()
+    stall_timeout = run.get('stall_timeout') or DEFAULT_STALL_TIMEOUT
+    def abort_sweeps():
+        for osa in osas.values():
+            osa.abort()
+    def measure(band_sweeps, release):
+        released = []
+        def release_once():
+            released.append(True)
+            release()
+        for attempt in range(2):
+            t_start = time.time()
+            try:
+                with span('sweep'), watchdog.watch('sweep', stall_timeout, abort_sweeps,
+                                                   [osa.osa for osa in osas.values() if hasattr(osa.osa, 'cancel')]):
+                    data = multi.run(band_sweeps, release_once)
+                break
+            except Exception as err:
+                if attempt or released or not (isinstance(err, StalledError) or classify(err) != 'fatal'):
+                    raise
+                print("Sweep failed (" + repr(err) + "), measuring the position again.")
+        # An adaptive sweep changes its segments from one position to the next, so its config is
+        # taken now rather than when the write runs.
+        configs = {band: sweep.config() for band, sweep in band_sweeps.items()}
+        return data, t_start, time.time(), configs
+    def store(result, startPow, endPow, pos, band_sweeps, angle):
+        data, t_start, t_end, configs = result
+        # The index holds the angle reported by the stage, the commanded one goes in the metadata.
+        if not pwrMeter.is_logging():
+            # Storing the sweep without its power log, or with a frozen start/end power, would pass unnoticed.
+            raise RuntimeError("The power meter stopped logging: " + repr(pwrMeter.log_error)) from pwrMeter.log_error
+        power = pwrMeter.snapshot(t_start, t_end)
+        with span('store'):
+            entries = dataset.append_bands(data, startPow, endPow, angle=angle, configs=configs,
+                                           arrays={'power': power}, target_angle=float(pos))
+        settings = {'osa_' + band: osa.state.values for band, osa in osas.items()}
+        settings['power_meter'] = pwrMeter.state.values
+        index = next(next_index)
+        manifest.record(index, entries, dataset, angle=angle, settings=settings)
+        if feed is not None:
+            for band, trace in data.items():
+                feed.publish(trace[0], trace[1], angle=angle, band=band, power=power, position=index)
+    pipeline = AcquisitionPipeline(rotStg, pwrMeter, measure, store)
+    try:
+        pipeline.run([run['positions'][i] for i in todo], [sweeps[i] for i in todo])
+    except BaseException as err:
+        manifest.finish(err)
+        print("Run stopped. Continue it with: python collect_dataset.py --resume " + write_path)
+        raise
+    finally:
+        pwrMeter.stop_logging()
+        dataset.close()
+        multi.close()
+        if instruments is None:
+            registry.close_all()
+    manifest.finish()
+    if run.get('export_dat'):
+        with span('export_dat'):
+            SweepDataset(write_path).export_dat(write_path)
+    return write_path
+
+if __name__ ==  "__main__":
+    parser = argparse.ArgumentParser(description="Collects OSA sweeps over a range of rotation stage positions. "
+                                     "Runs are described by run files (TOML, JSON or YAML, see load_run_file), "
+                                     "which are measured one after the other.")
+    parser.add_argument('run_files', nargs='*', help="Run files to measure, in order.")
+    parser.add_argument('--interactive', action='store_true', help="Ask for the run settings with dialogs (needs wx).")
+    parser.add_argument('--resume', metavar='RUN_DIR',
+                        help="Resume an interrupted run from the manifest in its dataset directory, "
+                             "skipping the positions it already completed.")
+    parser.add_argument('--simulate', action='store_true',
+                        help="Use the simulated instruments of SimVISA instead of real ones.")
+    parser.add_argument('--live', action='store_true',
+                        help="Show the traces, a waterfall over the stage angle and the laser power while measuring "
+                             "(needs matplotlib).")
+    parser.add_argument('--live-port', type=int, metavar='PORT',
+                        help="Serve the live view on this local port, for python LiveView.py --connect localhost:PORT.")
+    parser.add_argument('--no-retry', action='store_true',
+                        help="Do not retry instrument commands after transient errors or reconnect lost instruments.")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="Trace every instrument command, print the time spent per command at the end and "
+                             "write the timeline to FILE in the Chrome trace format.")
+    args = parser.parse_args()
+    if not (args.run_files or args.interactive or args.resume):
+        parser.error("give a run file, --interactive or --resume")
+
+    if args.simulate:
+        from SimVISA import sim_lab
+        rm = sim_lab()
+    else:
+        rm = resource_manager()
+    if args.trace:
+        tracer = Tracer().start()
+        names = {address: key for key, address in DEFAULT_ADDRESSES.items()}
+        names[OSA_2UM_ADDRESS] = 'osa_2um'
+        tracer.attach_manager(rm, names=names)
+        def write_trace():
+            tracer.report()
+            tracer.export_chrome(args.trace)
+            print("Trace written to " + args.trace)
+        atexit.register(write_trace)
+    if not args.no_retry:
+        # After the tracer, so that it records every attempt.
+        rm = ResilientResourceManager(rm)
+        atexit.register(rm.report)
+    instruments = InstrumentRegistry(rm) # Shared by all runs, and closed at exit.
+    atexit.register(instruments.close_all)
+    feed = None
+    if args.live or args.live_port:
+        from LiveView import LiveFeed, LiveMonitor
+        feed = LiveFeed(port=args.live_port)
+    runs = [load_run_file(path) for path in args.run_files] # Fails early on a bad file.
+    if args.interactive:
+        runs.append(ask_run())
+    def measure_all():
+        if args.resume:
+            print("Dataset written to " + run_acquisition(rm, resume=args.resume, instruments=instruments, feed=feed))
+        for run in runs:
+            print("Dataset written to " + run_acquisition(rm, run, instruments=instruments, feed=feed))
+    if args.live:
+        # The plots need the main thread, so the runs are measured on a worker thread.
+        monitor = LiveMonitor(feed)
+        errors = []
+        def measure_in_worker():
+            try:
+                measure_all()
+            except BaseException as err:
+                errors.append(err)
+        worker = threading.Thread(target=measure_in_worker, name='acquisition')
+        worker.start()
+        monitor.run(stop=lambda: not worker.is_alive())
+        worker.join()
+        if errors:
+            raise errors[0]
     else:
-        for i in range(len(sweeps)):
-            sweep = ''.join(sweeps[i].split()).split(',')
-            rotStg.move_to_pos(positions_to_take[i])
-            startPow = pwrMeter.read_pow() #Record laser power at start of sweep.
-            data = sweepline(sweep, osa)
-            endPow = pwrMeter.read_pow() #Record laser power at end of sweep.
-            write_to_file(data, startPow, endPow, write_folder)
-            
+        measure_all()
+    if feed is not None:
+        feed.close()
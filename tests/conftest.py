@@ -0,0 +1,6 @@
+'''The driver modules are top-level scripts, not a package, so the tests import them from the
+repository directory.'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
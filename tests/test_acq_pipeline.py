@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from AcqPipeline import AcquisitionPipeline
+
+
+class Log:
+    '''Records (event, position) pairs in the order they happen, from every worker thread.'''
+
+    def __init__(self) -> None:
+        self.events = []
+        self.lock = threading.Lock()
+
+    def add(self, event, pos):
+        with self.lock:
+            self.events.append((event, pos))
+
+    def index(self, event, pos):
+        return self.events.index((event, pos))
+
+
+class FakeStage:
+    def __init__(self, log) -> None:
+        self.log = log
+        self.pos = None
+
+    def move_to_pos(self, pos):
+        self.log.add('move', pos)
+        time.sleep(0.01)
+        self.pos = pos
+        self.log.add('moved', pos)
+        return pos + 0.001 # The angle reported by the motor.
+
+
+class FakeMeter:
+    def __init__(self, stage, log) -> None:
+        self.stage = stage
+        self.log = log
+
+    def read_pow(self):
+        self.log.add('power', self.stage.pos)
+        return [1e-3]
+
+
+def make_pipeline(log, readout=0.05, fail_at=None, release=True, **kwargs):
+    stage = FakeStage(log)
+    def sweep(config, release_fn):
+        pos = stage.pos
+        log.add('sweep', pos)
+        if pos == fail_at:
+            raise RuntimeError("sweep failed at " + str(pos))
+        time.sleep(0.02)
+        if release:
+            release_fn()
+        time.sleep(readout) # The trace readout, which the next move may overlap.
+        log.add('readout', pos)
+        return {'pos': pos, 'config': config}
+    def sink(data, start, end, pos, config, angle):
+        log.add('write', pos)
+        return (data['pos'], pos, config, angle, start, end)
+    return AcquisitionPipeline(stage, FakeMeter(stage, log), sweep, sink, **kwargs)
+
+
+def test_results_in_order():
+    log = Log()
+    results = make_pipeline(log).run([0, 10, 20], ['a', 'b', 'c'])
+    assert [r[:3] for r in results] == [(0, 0, 'a'), (10, 10, 'b'), (20, 20, 'c')]
+    assert [r[3] for r in results] == pytest.approx([0.001, 10.001, 20.001])
+    assert all(r[4] == r[5] == [1e-3] for r in results)
+    assert [e for e in log.events if e[0] == 'write'] == [('write', 0), ('write', 10), ('write', 20)]
+
+
+def test_dependencies():
+    log = Log()
+    pipeline = make_pipeline(log)
+    pipeline.run([0, 10, 20], [None] * 3)
+    for pos, nxt in ((0, 10), (10, 20)):
+        assert log.index('moved', pos) < log.index('sweep', pos)
+        # The stage only leaves once the light is no longer needed: the end power was read...
+        power_reads = [i for i, e in enumerate(log.events) if e == ('power', pos)]
+        assert len(power_reads) == 2 and power_reads[1] < log.index('move', nxt)
+        # ...but it does not wait for the readout of the previous position.
+        assert log.index('move', nxt) < log.index('readout', pos)
+        assert log.index('readout', pos) < log.index('write', pos)
+    assert len(pipeline.position_times) == 3
+
+
+def test_sweep_without_release_holds_the_stage():
+    log = Log()
+    make_pipeline(log, release=False).run([0, 10], [None] * 2)
+    assert log.index('readout', 0) < log.index('move', 10)
+
+
+def test_error_stops_the_run():
+    log = Log()
+    pipeline = make_pipeline(log, fail_at=10)
+    t0 = time.perf_counter()
+    with pytest.raises(RuntimeError, match='sweep failed at 10'):
+        pipeline.run([0, 10, 20, 30], [None] * 4)
+    assert time.perf_counter() - t0 < 2
+    written = [pos for event, pos in log.events if event == 'write']
+    assert 10 not in written and 20 not in written and 30 not in written
+    assert ('sweep', 30) not in log.events
+
+
+def test_max_in_flight():
+    log = Log()
+    pipeline = make_pipeline(log, readout=0.0, max_in_flight=1)
+    sink = pipeline.sink
+    def slow_sink(*args):
+        time.sleep(0.05)
+        return sink(*args)
+    pipeline.sink = slow_sink
+    pipeline.run([0, 10, 20], [None] * 3)
+    # With one position in flight, a move waits for the write of the previous position.
+    assert log.index('write', 0) < log.index('move', 10)
+    assert log.index('write', 10) < log.index('move', 20)
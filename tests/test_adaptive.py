@@ -0,0 +1,62 @@
+import numpy as np
+
+from AdaptiveSweep import AdaptiveSweep
+from OSA import OSA
+from SimVISA import LAB_ADDRESSES, sim_lab
+
+
+def make_osa():
+    rm = sim_lab()
+    return OSA(rm, LAB_ADDRESSES['osa'], data_format='REAL64'), rm.devices[LAB_ADDRESSES['osa']]
+
+
+def count_sweeps(device):
+    '''Counts the :INIT commands the simulated OSA receives.'''
+    counter = {'sweeps': 0}
+    command = device.command
+    def counted(cmd):
+        if cmd.split(' ')[0].upper() == ':INIT':
+            counter['sweeps'] += 1
+        return command(cmd)
+    device.command = counted
+    return counter
+
+
+def test_reuse_without_features_surveys_every_run():
+    # The simulated spectrum has no peaks between 1570 and 1590 nm.
+    osa, device = make_osa()
+    counter = count_sweeps(device)
+    sweep = AdaptiveSweep(1570, 1590, reuse=True)
+    traces = [sweep.run(osa) for _ in range(3)]
+    assert sweep.regions == []
+    assert counter['sweeps'] == 3
+    # Every run is a new measurement, not a copy of the first survey.
+    assert not np.array_equal(traces[0][1], traces[1][1])
+    assert not np.array_equal(traces[1][1], traces[2][1])
+
+
+def test_reuse_with_features_skips_the_survey():
+    osa, device = make_osa()
+    counter = count_sweeps(device)
+    sweep = AdaptiveSweep(1540, 1570, reuse=True, survey_every=10)
+    sweep.run(osa)
+    assert sweep.regions
+    first = counter['sweeps']
+    refining = len(sweep.regions)
+    assert first == 1 + refining
+    sweep.run(osa)
+    assert counter['sweeps'] == first + refining
+
+
+def test_refine_sweeps_cache_is_bounded():
+    sweep = AdaptiveSweep(1500, 1600)
+    first = None
+    for i in range(3 * sweep.refine_cache_size):
+        sweep.regions = [(1500 + i, 1501 + i)]
+        refine = sweep._refine_sweep()
+        first = first or refine
+        # The most recent sets are reused.
+        assert sweep._refine_sweep() is refine
+    assert len(sweep._refine) == sweep.refine_cache_size
+    sweep.regions = [(1500, 1501)]
+    assert sweep._refine_sweep() is not first
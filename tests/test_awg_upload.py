@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from AWG_33220A import AWG_33220A
+from AWG_DG4000 import DG4000
+from SimVISA import SimAWG, SimResourceManager
+
+
+def upload(awg_cls, pts, binary):
+    device = SimAWG()
+    awg = awg_cls(SimResourceManager({'USB::1::INSTR': device}), 'USB::1::INSTR')
+    awg.write_pts(pts, binary=binary)
+    return device
+
+
+@pytest.mark.parametrize('awg_cls, npts', [(AWG_33220A, 4096), (DG4000, 4096), (DG4000, 40000)])
+def test_binary_and_ascii_uploads_match(awg_cls, npts):
+    t = np.linspace(0, 1, npts, endpoint=False)
+    pts = 0.5*(np.sin(2*np.pi*7*t) + np.sin(2*np.pi*9*t))
+    ascii = upload(awg_cls, pts, binary=False).waveform
+    binary = upload(awg_cls, pts, binary=True).waveform
+    assert len(ascii) == len(binary) == npts
+    # The binary upload is quantized to 14 bits, so it is within one DAC step of the ASCII one.
+    assert np.max(np.abs(binary - ascii)) < 2 / 16383
+    assert np.max(np.abs(binary)) == pytest.approx(np.max(np.abs(pts)), abs=1e-3)
+
+
+def test_33220a_full_scale_codes():
+    device = upload(AWG_33220A, np.array([-1.0, 0.0, 1.0]), binary=True)
+    assert device.settings['FORM:BORD'] == 'NORM'
+    assert device.waveform.tolist() == [-1.0, 0.0, 1.0]
@@ -0,0 +1,23 @@
+from DCPS_E36300 import E36300
+from SimVISA import LAB_ADDRESSES, sim_lab
+
+
+def test_output_on_after_protection_trip():
+    rm = sim_lab()
+    device = rm.devices[LAB_ADDRESSES['dcps']]
+    ps = E36300(rm, LAB_ADDRESSES['dcps'])
+    ps.set_chnl_output('(@1:2)', on=True)
+    assert device.output == [True, True, False]
+    device.output[0] = False # Over-current protection trips channel 1.
+    ps.set_chnl_output('(@1)', on=True)
+    assert device.output == [True, True, False]
+    ps.set_chnl_output('(@1:2)', on=False)
+    assert device.output == [False, False, False]
+
+
+def test_settings_still_cached():
+    rm = sim_lab()
+    ps = E36300(rm, LAB_ADDRESSES['dcps'])
+    ps.set_voltage(5.0, '(@1)')
+    ps.set_voltage(5.0, '(@1)')
+    assert ps.state.stats()['skipped'] == 1
@@ -0,0 +1,51 @@
+import os
+import stat
+import threading
+
+import pytest
+
+import InstrumentRegistry
+from InstrumentRegistry import DAEMON_KEY_ENV, RegistryManager, connect, daemon_authkey, registry
+from SimVISA import LAB_ADDRESSES, sim_lab
+
+
+@pytest.fixture
+def key_file(tmp_path, monkeypatch):
+    monkeypatch.delenv(DAEMON_KEY_ENV, raising=False)
+    path = str(tmp_path / 'key')
+    monkeypatch.setattr(InstrumentRegistry, 'DAEMON_KEY_FILE', path)
+    return path
+
+
+def test_key_created_once_and_private(key_file):
+    with pytest.raises(FileNotFoundError):
+        daemon_authkey()
+    key = daemon_authkey(create=True)
+    assert len(key) == 64
+    assert stat.S_IMODE(os.stat(key_file).st_mode) == 0o600
+    assert daemon_authkey() == key
+    assert daemon_authkey(create=True) == key
+
+
+def test_key_from_environment(key_file, monkeypatch):
+    monkeypatch.setenv(DAEMON_KEY_ENV, 'from-env')
+    assert daemon_authkey(create=True) == b'from-env'
+    assert not os.path.exists(key_file)
+
+
+def test_clients_need_the_daemon_key(key_file, monkeypatch):
+    monkeypatch.setattr(registry, 'rm', sim_lab())
+    # A subclass, so that connect() in this process does not replace the server's callable.
+    class Daemon(RegistryManager):
+        pass
+    Daemon.register('instrument', callable=registry.get)
+    manager = Daemon(address=('127.0.0.1', 0), authkey=daemon_authkey(create=True))
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        pm = connect(server.address).instrument('PowerMeter', LAB_ADDRESSES['power_meter'])
+        assert pm.read_pow() is not None
+        with pytest.raises(Exception):
+            connect(server.address, authkey=b'instrument-registry')
+    finally:
+        registry.close_all()
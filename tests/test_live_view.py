@@ -0,0 +1,92 @@
+import socket
+import time
+
+import numpy as np
+
+from LiveView import LiveClient, LiveFeed, LiveState, decimate_minmax, encode_frame, read_frame
+
+
+def spectrum(npts=100001):
+    x = np.linspace(1500, 1600, npts)
+    y = np.full(npts, -60.0)
+    y[npts // 8] = -3.0      # A one-point peak,
+    y[2 * npts // 3] = -90.0 # and a one-point dip.
+    return x, y
+
+
+def test_decimate_keeps_peaks_and_dips():
+    x, y = spectrum()
+    xd, yd = decimate_minmax(x, y, bins=500)
+    assert len(xd) == len(yd) == 1000
+    assert yd.max() == -3.0 and yd.min() == -90.0
+    assert np.all(np.diff(xd) >= 0) and xd[0] == x[0]
+    # The max of each bin is never below its min.
+    assert np.all(yd[1::2] >= yd[::2])
+
+
+def test_short_trace_unchanged():
+    x, y = np.arange(10.0), np.arange(10.0)
+    xd, yd = decimate_minmax(x, y, bins=5)
+    assert np.array_equal(xd, x) and np.array_equal(yd, y)
+
+
+def test_frame_round_trip():
+    frame = {'angle': 12.5, 'band': '1um', 'minmax': True, 'x': np.arange(5.0), 'y': -np.arange(5.0)}
+    a, b = socket.socketpair()
+    try:
+        a.sendall(encode_frame(frame) * 2)
+        for _ in range(2):
+            got = read_frame(b)
+            assert got['angle'] == 12.5 and got['band'] == '1um' and got['minmax']
+            assert np.array_equal(got['x'], frame['x']) and np.array_equal(got['y'], frame['y'])
+    finally:
+        a.close()
+        b.close()
+
+
+def test_publish_drops_old_frames():
+    feed = LiveFeed(bins=100, capacity=3)
+    x, y = spectrum(10001)
+    power = np.zeros(1000, dtype=[('t', 'f8'), ('power', 'f8')])
+    for i in range(5):
+        feed.publish(x, y, angle=i, power=power, position=i)
+    assert feed.dropped == 2
+    frames = feed.get_all()
+    assert [f['position'] for f in frames] == [2, 3, 4]
+    assert len(frames[0]['x']) == 200 and frames[0]['minmax']
+    assert len(frames[0]['power']) == 200
+    assert feed.get_all() == []
+
+
+def test_waterfall():
+    feed = LiveFeed(bins=100)
+    state = LiveState(columns=50, history=3)
+    x, y = spectrum(10001)
+    for angle in range(4):
+        feed.publish(x, y + angle, angle=angle, band='1um')
+        feed.publish(x, y, angle=angle, band='2um')
+    for frame in feed.get_all():
+        state.add(frame)
+    assert state.band == '1um' and set(state.latest) == {'1um', '2um'}
+    assert state.waterfall().shape == (3, 50)
+    assert list(state.angles) == [1, 2, 3]
+    assert np.nanmedian(state.waterfall()[-1]) == -60.0 + 3
+
+
+def test_served_feed():
+    feed = LiveFeed(bins=100, port=0)
+    try:
+        client = LiveClient(port=feed.server.server_address[1])
+        deadline = time.time() + 5
+        while not feed._clients and time.time() < deadline:
+            time.sleep(0.01)
+        x, y = spectrum(10001)
+        feed.publish(x, y, angle=7.0, band='1um')
+        frames = []
+        while not frames and time.time() < deadline:
+            frames = client.get_all()
+            time.sleep(0.01)
+        assert len(frames) == 1 and frames[0]['angle'] == 7.0 and len(frames[0]['y']) == 200
+        client.close()
+    finally:
+        feed.close()
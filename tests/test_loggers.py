@@ -0,0 +1,63 @@
+'''The background loggers of the power meter and the power supply must not die silently when their
+instrument goes away.'''
+import time
+
+import pytest
+
+from DCPS_E36300 import E36300
+from PowerMeter import PowerMeter
+from ResilientIO import ResilientResourceManager
+from SimVISA import LAB_ADDRESSES, sim_lab
+
+
+def wait_for(condition, timeout=5.0):
+    t_end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > t_end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_power_meter_logger_death_is_reported(capsys):
+    rm = sim_lab()
+    meter = PowerMeter(rm, LAB_ADDRESSES['power_meter'])
+    meter.start_logging(rate=200)
+    assert wait_for(lambda: len(meter.snapshot()) > 0)
+    rm.inject(LAB_ADDRESSES['power_meter'], 'disconnect')
+    assert wait_for(lambda: not meter.is_logging())
+    assert meter.log_error is not None
+    assert capsys.readouterr().out == '' # Reported through log_error, not printed.
+    # Without the logger, read_pow goes to the bus and fails there instead of returning old samples.
+    with pytest.raises(Exception):
+        meter.read_pow()
+    meter.stop_logging()
+
+
+def test_power_meter_logger_survives_reconnect():
+    rm = ResilientResourceManager(sim_lab(), backoff=0.01)
+    address = LAB_ADDRESSES['power_meter']
+    meter = PowerMeter(rm, address)
+    meter.start_logging(rate=200)
+    assert wait_for(lambda: len(meter.snapshot()) > 0)
+    rm.inject(address, 'disconnect')
+    t_fault = time.time()
+    # The session is opened again and the logger, restarted if it stopped, keeps sampling.
+    assert wait_for(lambda: rm.stats()[address]['reconnects'] > 0)
+    assert wait_for(lambda: meter.snapshot()['t'][-1] > t_fault + 0.05)
+    assert meter.is_logging()
+    meter.stop_logging()
+
+
+def test_power_supply_poller_death_is_reported(capsys):
+    rm = sim_lab()
+    dcps = E36300(rm, LAB_ADDRESSES['dcps'])
+    dcps.start_polling(interval=0.005)
+    assert wait_for(lambda: len(dcps.snapshot()) > 0)
+    rm.inject(LAB_ADDRESSES['dcps'], 'disconnect')
+    assert wait_for(lambda: not dcps.is_polling())
+    assert dcps.poll_error is not None
+    assert capsys.readouterr().out == ''
+    with pytest.raises(RuntimeError):
+        dcps.snapshot()
+    dcps.stop_polling()
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from NDScan import Axis, NDScan, scan_order
+
+
+@pytest.mark.parametrize('shape', [(4,), (3, 4), (2, 3, 4), (3, 1, 2)])
+def test_snake_steps_one_axis_by_one(shape):
+    pts = scan_order(shape, 'snake')
+    # Every grid point is visited exactly once.
+    assert len(pts) == np.prod(shape)
+    assert len({tuple(p) for p in pts}) == len(pts)
+    steps = np.abs(np.diff(pts, axis=0))
+    assert np.all(steps.sum(axis=1) == 1)
+
+
+def test_raster_order():
+    pts = scan_order((2, 3), 'raster')
+    assert pts.tolist() == [[0, 0], [0, 1], [0, 2], [1, 0], [1, 1], [1, 2]]
+    with pytest.raises(ValueError):
+        scan_order((2, 3), 'spiral')
+
+
+def test_snake_reverses_inner_axis():
+    assert scan_order((2, 3), 'snake').tolist() == [[0, 0], [0, 1], [0, 2], [1, 2], [1, 1], [1, 0]]
+
+
+@pytest.mark.parametrize('order', ['snake', 'raster'])
+def test_moves_matches_setter_calls(order):
+    calls = {'a': [], 'b': [], 'c': []}
+    axes = [Axis(name, range(n), calls[name].append) for name, n in zip('abc', (2, 3, 4))]
+    scan = NDScan(axes, lambda point: point['a'] + point['b'] + point['c'], order=order)
+    results = scan.run()
+    assert results.shape == (2, 3, 4)
+    assert results[1, 2, 3] == 6
+    assert scan.moves() == {name: len(c) for name, c in calls.items()}
+    assert scan.set_calls == scan.moves()
+
+
+def test_snake_moves_fewer_than_raster():
+    axes = [Axis(name, range(n), lambda v: None) for name, n in zip('abc', (2, 3, 4))]
+    snake = NDScan(axes, lambda point: None, order='snake').moves()
+    raster = NDScan(axes, lambda point: None, order='raster').moves()
+    # Snake keeps an axis where it is when an outer one steps, raster restarts it.
+    assert snake == {'a': 2, 'b': 5, 'c': 19}
+    assert raster == {'a': 2, 'b': 6, 'c': 24}
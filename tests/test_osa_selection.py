@@ -0,0 +1,30 @@
+import pytest
+
+from collect_dataset import make_sweep, osa_selection
+from MultiOSA import MultiOSA
+
+
+@pytest.mark.parametrize('answer, bands', [
+    ('1', ['1um']),
+    ('2', ['2um']),
+    ('12', ['1um', '2um']),
+    (' 21 ', ['1um', '2um']),
+    ('', []),
+    ('3', []),
+])
+def test_osa_selection(answer, bands):
+    assert osa_selection(answer) == bands
+
+
+def test_multi_osa_needs_an_osa():
+    with pytest.raises(ValueError):
+        MultiOSA({})
+
+
+def test_make_sweep_overlap():
+    assert make_sweep('1500, 1600, MID, 1540, 1560, HIGH1').overlap == 'first'
+    assert make_sweep('1500, 1550, MID, 1550, 1600, MID').overlap is None
+    assert make_sweep('1500, 1600, MID, 1540, 1560, HIGH1', 'last').overlap == 'last'
+    assert make_sweep('1500, 1600, MID, 1540, 1560, HIGH1', 'keep').overlap is None
+    with pytest.raises(ValueError):
+        make_sweep('1500, 1600, MID', 'both')
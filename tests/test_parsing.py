@@ -0,0 +1,75 @@
+import pytest
+
+from AdaptiveSweep import AdaptiveSweep
+from DCPS_E36300 import parse_channels
+from RotaryStage import parse_reply
+from SCPITrace import command_key
+from SweepSegments import SegmentedSweep, SweepSegment, parse_sweep_config
+
+
+@pytest.mark.parametrize('cmd, key', [
+    (':SENS:WAV:STAR 1500NM', ':SENS:WAV:STAR'),
+    (':TRACE:Y? TRA', ':TRACE:Y?'),
+    ('xvoltage=10', 'xvoltage'),
+    ('0ma0000A000', '0ma'),
+    ('0gs', '0gs'),
+    ('  *IDN?  ', '*IDN?'),
+])
+def test_command_key(cmd, key):
+    assert command_key(cmd) == key
+
+
+@pytest.mark.parametrize('spec, chans', [
+    ('(@1)', [1]),
+    ('(@1,3)', [1, 3]),
+    ('(@1:3)', [1, 2, 3]),
+    ('(@1, 2:3)', [1, 2, 3]),
+])
+def test_parse_channels(spec, chans):
+    assert parse_channels(spec) == chans
+
+
+def test_parse_reply():
+    assert parse_reply('0PO0001A2B3\r\n') == ('0', 'PO', '0001A2B3')
+    assert parse_reply('0gs00') == ('0', 'GS', '00')
+    with pytest.raises(ValueError):
+        parse_reply('0P')
+
+
+def test_sweep_config_round_trip():
+    segments = parse_sweep_config(' 1500, 1600, mid,1540,1560,HIGH1 ')
+    assert segments == [SweepSegment(1500.0, 1600.0, 'MID'), SweepSegment(1540.0, 1560.0, 'HIGH1')]
+    config = SegmentedSweep(segments).config()
+    assert config == [[1500.0, 1600.0, 'MID'], [1540.0, 1560.0, 'HIGH1']]
+    flat = [value for seg in config for value in seg]
+    assert parse_sweep_config(flat) == segments
+    assert parse_sweep_config(', '.join(map(str, flat))) == segments
+
+
+@pytest.mark.parametrize('config', ['1500, 1600', '1600, 1500, MID'])
+def test_sweep_config_errors(config):
+    with pytest.raises(ValueError):
+        parse_sweep_config(config)
+
+
+def test_adaptive_config():
+    sweep = AdaptiveSweep.from_config('ADAPTIVE, 1500, 1600, mid, high3, 15')
+    assert sweep.survey == SweepSegment(1500.0, 1600.0, 'MID')
+    assert sweep.refine_sens == 'HIGH3'
+    assert sweep.threshold_db == 15.0
+    assert sweep.config() == [[1500.0, 1600.0, 'MID']]
+    with pytest.raises(ValueError):
+        AdaptiveSweep.from_config('ADAPTIVE, 1500, 1600, MID')
+
+
+def test_adaptive_config_reuse_fields():
+    sweep = AdaptiveSweep.from_config('ADAPTIVE, 1500, 1600, MID, HIGH3, reuse=true, survey_every=5')
+    assert sweep.reuse and sweep.survey_every == 5
+    assert sweep.threshold_db == 10.0
+    sweep = AdaptiveSweep.from_config('ADAPTIVE, 1500, 1600, MID, HIGH3, 15, reuse = no')
+    assert not sweep.reuse and sweep.threshold_db == 15.0
+    for line in ('ADAPTIVE, 1500, 1600, MID, HIGH3, reuse=maybe',
+                 'ADAPTIVE, 1500, 1600, MID, HIGH3, every=5',
+                 'ADAPTIVE, 1500, 1600, MID, reuse=true'):
+        with pytest.raises(ValueError):
+            AdaptiveSweep.from_config(line)
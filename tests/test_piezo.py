@@ -0,0 +1,45 @@
+import numpy as np
+
+from PC_MDT693B import MDT693B
+from PowerMeter import PowerMeter
+from SimVISA import LAB_ADDRESSES, sim_lab
+
+
+def make_stage():
+    rm = sim_lab()
+    piezo = MDT693B(rm, LAB_ADDRESSES['piezo'])
+    pm = PowerMeter(rm, LAB_ADDRESSES['power_meter'])
+    return rm, piezo, pm
+
+
+def test_raster_shape_and_peak():
+    rm, piezo, pm = make_stage()
+    x, y = np.linspace(0, 150, 11), np.linspace(0, 150, 7)
+    powers = piezo.raster(x, y, z=75, power_meter=pm)
+    assert powers.shape == (len(y), len(x))
+    iy, ix = np.unravel_index(np.argmax(powers), powers.shape)
+    # The simulated coupling peaks at x=60, y=80.
+    assert x[ix] == 60
+    assert y[iy] == 75
+    assert piezo.pending == 0
+
+
+def test_raster_streams_by_default():
+    rm, piezo, pm = make_stage()
+    grid = np.linspace(0, 150, 4)
+    streamed = piezo.raster(grid, grid, z=75, power_meter=pm)
+    synced = piezo.raster(grid, grid, z=75, power_meter=pm, sync=True)
+    # Same map, up to the power meter noise.
+    assert np.argmax(streamed) == np.argmax(synced)
+    np.testing.assert_allclose(streamed, synced, atol=5e-6)
+    assert piezo.pending == 0
+
+
+def test_hill_climb_fills_missing_start_axes():
+    rm, piezo, pm = make_stage()
+    piezo.set_voltage('z', 75)
+    best, best_pow = piezo.hill_climb(start=(40, 100), power_meter=pm)
+    assert len(best) == 3
+    assert best[2] == 75
+    np.testing.assert_allclose(best[:2], (60, 80), atol=1)
+    np.testing.assert_allclose(piezo.get_voltages(), best, atol=0.01)
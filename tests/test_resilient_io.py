@@ -0,0 +1,122 @@
+'''ResilientIO under the faults injected by SimVISA.'''
+import tempfile
+import time
+
+import numpy as np
+import pytest
+from pyvisa import constants, errors
+
+from OSA import OSA
+from PowerMeter import PowerMeter
+from ResilientIO import ResilientResourceManager, StalledError, Watchdog, classify, idempotent
+from SimVISA import LAB_ADDRESSES, sim_lab
+
+OSA_ADDRESS = LAB_ADDRESSES['osa']
+
+
+def resilient_lab(**kwargs):
+    sim = sim_lab(**kwargs)
+    return sim, ResilientResourceManager(sim, backoff=0.001, reconnect_delay=0.001)
+
+
+def test_classify():
+    assert classify(errors.VisaIOError(constants.StatusCode.error_timeout)) == 'transient'
+    assert classify(errors.VisaIOError(constants.StatusCode.error_connection_lost)) == 'disconnect'
+    assert classify(errors.InvalidSession()) == 'disconnect'
+    assert classify(StalledError('sweep stalled')) == 'fatal'
+    assert classify(ValueError()) == 'fatal'
+
+
+@pytest.mark.parametrize('message', [':TRACE:Y? TRA', ':SENSE:WAV:START 1500NM', ':INIT:SMODE SINGLE',
+                                     ':STATUS:OPERATION:CONDITION?', '*STB?', '0ma00001000'])
+def test_idempotent(message):
+    assert idempotent(message)
+
+
+@pytest.mark.parametrize('message', ['*TRG', ':INIT', ':init:imm', ':STATUS:OPERATION:EVENT?',
+                                     ':STAT:OPER:EVEN?', ':STAT:QUES?', '*ESR?', '0fw', '0mr00000100'])
+def test_not_idempotent(message):
+    assert not idempotent(message)
+
+
+def test_query_retried_after_timeout():
+    sim, rm = resilient_lab()
+    osa = OSA(rm, OSA_ADDRESS)
+    sim.inject(OSA_ADDRESS, 'no_reply', match=':SENSE:SWEEP:POINTS?', count=2)
+    assert osa.get_sweep_points() == 1001
+    assert rm.stats()[OSA_ADDRESS]['retries'] == 2
+
+
+def test_lost_sweep_completion_is_raised():
+    # The completion bit is cleared by the poll whose reply is lost. Sending the poll again would
+    # wait for a completion that already happened, until the sweep timeout.
+    sim, rm = resilient_lab(sweep_time=0.2)
+    osa = OSA(rm, OSA_ADDRESS)
+    osa.start_sweep()
+    time.sleep(0.3)
+    sim.inject(OSA_ADDRESS, 'no_reply', match=':STATUS:OPERATION:EVENT?')
+    t0 = time.perf_counter()
+    with pytest.raises(errors.VisaIOError):
+        osa.wait_sweep(timeout=3)
+    assert time.perf_counter() - t0 < 1
+    assert rm.stats()[OSA_ADDRESS]['retries'] == 0
+
+
+def test_power_cycle_restores_settings():
+    sim, rm = resilient_lab()
+    meter = PowerMeter(rm, LAB_ADDRESSES['power_meter'])
+    meter.set_averaging(25)
+    device = sim.devices[LAB_ADDRESSES['power_meter']]
+    sim.inject(LAB_ADDRESSES['power_meter'], 'power_cycle', match=':FETCH?', reopen_failures=2)
+    # The reading is lost with the session and raised, but the session is opened again and the
+    # cached settings are written back to the power cycled meter.
+    with pytest.raises(errors.VisaIOError):
+        meter.read_pow()
+    stats = rm.stats()[LAB_ADDRESSES['power_meter']]
+    assert stats['disconnect'] == 1 and stats['reconnects'] == 1
+    assert device.averaging == 25
+    assert meter.read_pow()
+
+
+def test_query_not_resent_after_disconnect():
+    sim, rm = resilient_lab()
+    osa = OSA(rm, OSA_ADDRESS)
+    sim.inject(OSA_ADDRESS, 'disconnect', match=':SENSE:SWEEP:POINTS?')
+    with pytest.raises(errors.VisaIOError):
+        osa.get_sweep_points()
+    # The session was opened again, so the next call goes through.
+    assert osa.get_sweep_points() == 1001
+
+
+def test_watchdog_stops_a_stalled_block():
+    sim, rm = resilient_lab()
+    osa = OSA(rm, OSA_ADDRESS)
+    watchdog = Watchdog(interval=0.02)
+    aborted = []
+    with pytest.raises(StalledError):
+        with watchdog.watch('sweep', 0.1, lambda: aborted.append(True), [osa.osa]):
+            while True:
+                osa.get_sweep_points()
+                time.sleep(0.01)
+    assert aborted and watchdog.stalls == ['sweep']
+    # Calls work again after the block.
+    assert osa.get_sweep_points() == 1001
+
+
+def test_run_measures_again_after_lost_completion():
+    from collect_dataset import run_acquisition
+    from SweepDataset import SweepDataset
+    sim, rm = resilient_lab(sweep_time=0.15)
+    # Loses the reply to the poll that sees the first sweep complete.
+    sim.inject(OSA_ADDRESS, 'no_reply', match=':STATUS:OPERATION:EVENT?', after=2)
+    with tempfile.TemporaryDirectory() as folder:
+        run = {'stage': LAB_ADDRESSES['stage'], 'power_meter': LAB_ADDRESSES['power_meter'],
+               'osas': [{'band': 'osa', 'address': OSA_ADDRESS, 'data_format': 'REAL64',
+                         'sweeps': ['1540, 1560, HIGH1']}],
+               'positions': [0.0, 10.0, 20.0], 'folder': folder, 'name': 'run', 'export_dat': False,
+               'stall_timeout': 60}
+        t0 = time.perf_counter()
+        dataset = SweepDataset(run_acquisition(rm, run))
+        assert time.perf_counter() - t0 < 20
+        assert len(dataset) == 3
+        assert np.allclose(sorted(dataset.index['angle']), [0, 10, 20], atol=0.01)
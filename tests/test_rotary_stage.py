@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from RotaryStage import RotaryStage
+from SimVISA import SimResourceManager, SimRotaryStage
+
+ADDRESS = 'ASRL3::INSTR'
+
+
+def make_stage(speed=2e5, **kwargs):
+    device = SimRotaryStage(speed=speed)
+    sim = SimResourceManager({ADDRESS: device})
+    return RotaryStage(sim, ADDRESS, home=False, **kwargs), device, sim
+
+
+def test_move_waits_for_the_motor():
+    stage, device, sim = make_stage()
+    t0 = time.perf_counter()
+    angle = stage.move_to_pos(90)
+    # 90 degrees are 32768 steps (the motor is off by a factor of 2), 0.16 s at 2e5 steps/s.
+    assert time.perf_counter() - t0 >= 32768 / 2e5 - 0.01
+    assert time.perf_counter() >= device.move_end
+    assert angle == pytest.approx(90, abs=0.01)
+    # The status polls of the move were drained, so the next reply is the one asked for.
+    assert stage.get_status() == 0
+    assert stage.get_pos(query=True) == pytest.approx(90, abs=0.01)
+
+
+def test_negative_position():
+    stage, device, sim = make_stage()
+    assert stage.move_to_pos(-30) == pytest.approx(-30, abs=0.01)
+    assert device.pos < 0
+
+
+def test_move_without_wait():
+    stage, device, sim = make_stage()
+    assert stage.move_to_pos(45, wait=False) is None
+    assert stage.wait_move() == pytest.approx(45, abs=0.01)
+
+
+def test_lost_end_of_move_reply():
+    stage, device, sim = make_stage()
+    sim.inject(ADDRESS, 'no_reply', match='0ma')
+    # The status poll reports the motor stopped, and the position is read instead.
+    assert stage.move_to_pos(20) == pytest.approx(20, abs=0.01)
+
+
+def test_move_timeout():
+    stage, device, sim = make_stage(speed=1e4, move_timeout=0.1)
+    with pytest.raises(TimeoutError):
+        stage.move_to_pos(90)
+
+
+def test_motor_error():
+    stage, device, sim = make_stage()
+    command = device.command
+    device.command = lambda cmd: b'0GS0D\r\n' if cmd[1:3] == 'gs' else command(cmd)
+    sim.inject(ADDRESS, 'no_reply', match='0ma')
+    with pytest.raises(RuntimeError, match='Over current'):
+        stage.move_to_pos(20)
+
+
+def test_settle_time():
+    stage, device, sim = make_stage(settle_time=0.1)
+    t0 = time.perf_counter()
+    stage.move_to_pos(0.5)
+    assert time.perf_counter() - t0 >= 0.1
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from RunManifest import RunManifest
+from SimVISA import LAB_ADDRESSES, sim_lab
+from SweepDataset import SweepDataset, SweepDatasetWriter
+
+
+def test_record_and_load(tmp_path):
+    path = str(tmp_path)
+    manifest = RunManifest(path, {'positions': [0, 10, 20]})
+    with SweepDatasetWriter(str(tmp_path / 'data')) as writer:
+        entry = writer.append(np.zeros((2, 5)))
+        manifest.record(1, entry, writer, angle=10.0, settings={'osa': {(':SENSE', 1): np.float64(2.5)}})
+    assert manifest.remaining() == [0, 2]
+    loaded = RunManifest.load(path)
+    assert loaded.done() == {1}
+    rec = loaded.completed[0]
+    assert rec['entries'] == [0] and rec['trace_offset'] == 10
+    assert rec['settings'] == {'osa': {"(':SENSE', 1)": 2.5}}
+    loaded.finish()
+    assert RunManifest.load(path).status == 'incomplete'
+    loaded.finish(RuntimeError('stage lost'))
+    failed = RunManifest.load(path)
+    assert failed.status == 'failed' and 'stage lost' in failed.error
+
+
+def test_resume_drops_entries_after_checkpoint(tmp_path):
+    path = str(tmp_path)
+    manifest = RunManifest(path, {'positions': [0, 10]})
+    writer = SweepDatasetWriter(path)
+    manifest.record(0, writer.append_bands({'a': np.zeros((2, 3)), 'b': np.ones((2, 3))}), writer)
+    writer.append(np.full((2, 3), 7.0)) # Written, but the run stopped before its checkpoint.
+    writer.close()
+    manifest = RunManifest.load(path)
+    with SweepDatasetWriter(path, append=True) as writer:
+        manifest.resume(writer)
+        assert writer.count == 2
+    assert manifest.status == 'running'
+    assert len(SweepDataset(path)) == 2
+
+
+def test_interrupted_run_resumes(tmp_path):
+    from collect_dataset import run_acquisition
+    run = {'stage': LAB_ADDRESSES['stage'], 'power_meter': LAB_ADDRESSES['power_meter'],
+           'osas': [{'band': 'osa', 'address': LAB_ADDRESSES['osa'], 'data_format': 'REAL64',
+                     'sweeps': ['1540, 1560, HIGH1']}],
+           'positions': [0.0, 10.0, 20.0, 30.0], 'folder': str(tmp_path), 'name': 'run',
+           'export_dat': False}
+    sim = sim_lab()
+    # The OSA is lost during the third sweep, with nothing to reconnect it.
+    sim.inject(LAB_ADDRESSES['osa'], 'disconnect', match=':INIT', after=2)
+    with pytest.raises(Exception):
+        run_acquisition(sim, run)
+    path = str(tmp_path / 'run')
+    manifest = RunManifest.load(path)
+    assert manifest.status == 'failed'
+    assert 0 < len(manifest.done()) < 4
+    assert run_acquisition(sim_lab(), resume=path) == path
+    manifest = RunManifest.load(path)
+    assert manifest.status == 'complete' and manifest.done() == {0, 1, 2, 3}
+    ds = SweepDataset(path)
+    assert len(ds) == 4
+    assert np.allclose(np.sort(ds.angles), [0, 10, 20, 30], atol=0.01)
@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+
+from SpectralAnalysis import (analyze, band_power, centroid, dbm_to_mw, fwhm, mw_to_dbm, normalize, peak,
+                              read_dat, resample, trace_metrics)
+from SweepDataset import SweepDataset, SweepDatasetWriter
+
+X = np.linspace(1540, 1560, 4001) # 5 pm steps.
+
+
+def lorentzian(x, center, width, amp=1.0):
+    return amp / (1 + ((x - center) / (width / 2))**2)
+
+
+def gaussian(x, center, width, amp=1.0):
+    return amp * np.exp(-4 * np.log(2) * ((x - center) / width)**2)
+
+
+CENTERS = np.array([1548.0, 1550.0123, 1551.3377])
+WIDTHS = np.array([0.2, 0.5, 1.0])
+
+
+@pytest.mark.parametrize('line', [lorentzian, gaussian])
+def test_peak_and_fwhm(line):
+    y_mw = np.stack([line(X, c, w, 1e-3) for c, w in zip(CENTERS, WIDTHS)])
+    x_peak, level = peak(X, mw_to_dbm(y_mw))
+    # The parabola refines the peak to well below the 5 pm point spacing.
+    assert np.allclose(x_peak, CENTERS, atol=5e-4)
+    assert np.allclose(level, -30.0, atol=0.01)
+    assert np.allclose(fwhm(X, y_mw), WIDTHS, rtol=1e-3)
+
+
+def test_centroid():
+    y_mw = np.stack([gaussian(X, c, w) for c, w in zip(CENTERS, WIDTHS)])
+    assert np.allclose(centroid(X, y_mw), CENTERS, atol=1e-6)
+    # Within a band, only the power in the band counts: half of a line gives the center of that half.
+    right = centroid(X, gaussian(X, 1550.0, 0.5), 1550.0, 1560.0)[0]
+    assert right == pytest.approx(1550.0 + 0.5 / (2 * np.sqrt(np.pi * np.log(2))), abs=1e-4)
+
+
+def test_band_power():
+    g = gaussian(X, 1550.0, 0.5, 2.0)
+    l = lorentzian(X, 1550.0, 0.5, 2.0)
+    bands = [(1540, 1560), (1549, 1551), (1550, 1560)]
+    powers = band_power(X, np.stack([g, l]), bands)
+    assert powers.shape == (2, 3)
+    gauss_area = 2.0 * 0.5 * np.sqrt(np.pi / (4 * np.log(2)))
+    assert powers[0] == pytest.approx([gauss_area, gauss_area, gauss_area / 2], rel=1e-4)
+    lorentz_area = lambda half: 2.0 * 0.5 * np.arctan(2 * half / 0.5) # Over center +- half.
+    assert powers[1] == pytest.approx([lorentz_area(10), lorentz_area(1), lorentz_area(10) / 2], rel=1e-4)
+    # Per-sweep wavelengths give the same result as a common grid.
+    assert np.allclose(band_power(np.stack([X, X]), np.stack([g, l]), bands), powers)
+
+
+def test_fwhm_of_truncated_peak_is_nan():
+    y = lorentzian(X, 1540.0, 0.5)
+    assert np.isnan(fwhm(X, y)[0])
+
+
+def test_conversions_and_normalize():
+    assert dbm_to_mw([0.0, -30.0]) == pytest.approx([1.0, 1e-3])
+    assert mw_to_dbm(np.array([1.0, 0.0]))[0] == 0.0 and mw_to_dbm(np.array([0.0]))[0] == -300.0
+    y = np.full((2, 5), -20.0)
+    # 1 mW of laser power is 0 dBm, so normalizing by it changes nothing.
+    assert np.allclose(normalize(y, [1e-3, 1e-2], [1e-3, 1e-2]), [[-20.0] * 5, [-30.0] * 5])
+    drift = normalize(y[:1], [1e-3], [1e-2], drift=True)[0]
+    assert drift[0] == pytest.approx(-20.0) and drift[-1] == pytest.approx(-30.0)
+
+
+def test_resample():
+    x = np.array([[0.0, 1.0, 2.0], [1.0, 2.0, 3.0]])
+    y = np.array([[0.0, 10.0, 20.0], [10.0, 20.0, 30.0]])
+    out = resample(x, y, [0.5, 1.5, 2.5])
+    assert np.allclose(out[0, :2], [5.0, 15.0]) and np.isnan(out[0, 2])
+    assert np.isnan(out[1, 0]) and np.allclose(out[1, 1:], [15.0, 25.0])
+    assert np.allclose(resample(x[0], y[:1], [0.5, 1.5]), [[5.0, 15.0]])
+
+
+def make_dataset(path, n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    with SweepDatasetWriter(path) as writer:
+        for i in range(n):
+            center, width = rng.uniform(1545, 1555), rng.uniform(0.1, 1.0)
+            y = mw_to_dbm(lorentzian(X, center, width, 1e-3) + 1e-9)
+            writer.append(np.array([X, y]), 1e-3, 1.1e-3, angle=float(i), band='1um' if i % 2 else '2um')
+    return path
+
+
+BANDS = {'c_band': (1545.0, 1550.0)}
+
+
+def test_analyze_matches_trace_metrics(tmp_path):
+    path = make_dataset(str(tmp_path / 'run'))
+    ds = SweepDataset(path)
+    single = analyze(ds, bands=BANDS, chunk=len(ds))
+    direct = trace_metrics(X, ds.stack()[:, 1], bands=BANDS)
+    for name in ('peak_wl', 'peak_level', 'centroid', 'fwhm', 'c_band'):
+        assert np.allclose(single[name], direct[name])
+    assert single['angle'].tolist() == list(range(len(ds)))
+    assert np.all(single['start_pow'] == 1e-3)
+
+
+def test_chunked_and_workers_match_single_pass(tmp_path):
+    path = make_dataset(str(tmp_path / 'run'))
+    single = analyze(path, bands=BANDS, normalized=True, chunk=1000)
+    chunked = analyze(path, bands=BANDS, normalized=True, chunk=7)
+    workers = analyze(path, bands=BANDS, normalized=True, chunk=7, workers=2)
+    # Equal up to the rounding of the matrix products, which depends on the chunk size.
+    for name in single.dtype.names:
+        assert np.allclose(chunked[name], single[name], rtol=1e-12, atol=0)
+        assert np.allclose(workers[name], single[name], rtol=1e-12, atol=0)
+    odd = analyze(path, band='1um', bands=BANDS, chunk=3)
+    assert odd['index'].tolist() == list(range(1, 40, 2))
+    assert np.allclose(odd['fwhm'], analyze(path, bands=BANDS)['fwhm'][1::2], rtol=1e-12, atol=0)
+
+
+def test_analyze_needs_grid_for_mixed_lengths(tmp_path):
+    path = str(tmp_path / 'run')
+    with SweepDatasetWriter(path) as writer:
+        writer.append(np.array([X, mw_to_dbm(lorentzian(X, 1550.0, 0.5))]))
+        x = X[::2]
+        writer.append(np.array([x, mw_to_dbm(lorentzian(x, 1550.0, 0.5))]))
+    with pytest.raises(ValueError):
+        analyze(path)
+    res = analyze(path, grid=np.linspace(1545, 1555, 2001))
+    assert np.allclose(res['peak_wl'], 1550.0, atol=1e-3)
+    assert np.allclose(res['fwhm'], 0.5, rtol=1e-2)
+
+
+def test_read_dat(tmp_path):
+    path = make_dataset(str(tmp_path / 'run'), n=1)
+    out = tmp_path / 'dat'
+    out.mkdir()
+    dat = SweepDataset(path).export_dat(str(out))[0]
+    data, start, end = read_dat(dat)
+    assert np.allclose(data, SweepDataset(path)[0])
+    assert start == 1e-3 and end == 1.1e-3
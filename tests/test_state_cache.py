@@ -0,0 +1,84 @@
+from StateCache import StateCache
+
+
+class Recorder:
+    '''A resource that records the commands written to it.'''
+
+    def __init__(self) -> None:
+        self.sent = []
+
+    def write(self, cmd):
+        self.sent.append(cmd)
+
+
+def test_repeated_write_is_skipped():
+    res = Recorder()
+    cache = StateCache(res)
+    assert cache.write(':AVER', 10, ':AVER 10')
+    assert not cache.write(':AVER', 10, ':AVER 10')
+    assert cache.write(':AVER', 20, ':AVER 20')
+    assert res.sent == [':AVER 10', ':AVER 20']
+    assert cache.stats() == {'writes': 2, 'skipped': 1}
+
+
+def test_write_all_skips_only_if_every_setting_matches():
+    res = Recorder()
+    cache = StateCache(res)
+    cache.write(('VOLT', 1), 5.0, 'VOLT 5,(@1)')
+    assert cache.write_all([('VOLT', 1), ('VOLT', 2)], 5.0, 'VOLT 5,(@1,2)')
+    assert not cache.write_all([('VOLT', 1), ('VOLT', 2)], 5.0, 'VOLT 5,(@1,2)')
+    assert cache.stats() == {'writes': 2, 'skipped': 1}
+
+
+def test_write_many():
+    res = Recorder()
+    cache = StateCache(res)
+    assert cache.write_many({'x': 1, 'y': 2}, 'xyz 1 2')
+    assert not cache.write_many({'x': 1, 'y': 2}, 'xyz 1 2')
+    assert cache.write_many({'x': 1, 'y': 3}, 'xyz 1 3')
+    assert cache.stats() == {'writes': 2, 'skipped': 1}
+
+
+def test_disabled_cache_sends_everything():
+    res = Recorder()
+    cache = StateCache(res, enabled=False)
+    for _ in range(3):
+        cache.write(':AVER', 10, ':AVER 10')
+    assert len(res.sent) == 3
+    assert cache.stats() == {'writes': 3, 'skipped': 0}
+    assert cache.get(':AVER') == 10
+
+
+def test_invalidate_sends_again():
+    res = Recorder()
+    cache = StateCache(res)
+    cache.write('a', 1, 'A 1')
+    cache.write('b', 2, 'B 2')
+    cache.invalidate('a')
+    assert cache.write('a', 1, 'A 1')
+    assert not cache.write('b', 2, 'B 2')
+    cache.invalidate()
+    assert cache.write('b', 2, 'B 2')
+    assert cache.stats() == {'writes': 4, 'skipped': 1}
+
+
+def test_replay_resends_in_order_of_last_write():
+    res = Recorder()
+    cache = StateCache(res)
+    cache.write_many({'x': 1, 'y': 1}, 'XY 1')
+    cache.write('z', 0, 'Z 0')
+    cache.write('x', 2, 'X 2')
+    res.sent.clear()
+    cache.replay()
+    # 'XY 1' still sets y, but must not undo the later 'X 2'.
+    assert res.sent == ['XY 1', 'Z 0', 'X 2']
+
+
+def test_replay_registers_on_reopen():
+    res = Recorder()
+    res.on_reopen = []
+    cache = StateCache(res)
+    cache.write('a', 1, 'A 1')
+    for hook in res.on_reopen:
+        hook()
+    assert res.sent == ['A 1', 'A 1']
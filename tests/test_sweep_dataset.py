@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pytest
+
+from SweepDataset import INDEX_DTYPE, INDEX_FILE, TRACE_FILE, SweepDataset, SweepDatasetWriter
+
+
+def trace(npts, start=1500.0, level=-40.0):
+    x = np.linspace(start, start + 10, npts)
+    return np.array([x, level + np.sin(x)])
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'run')
+    power = np.array([(1.0, 1e-3), (2.0, 2e-3)], dtype=[('t', 'f8'), ('power', 'f8')])
+    with SweepDatasetWriter(path, attrs={'operator': 'test'}) as writer:
+        assert writer.append(trace(11), 1e-3, 2e-3, angle=0.0, config=[[1500, 1510, 'MID']],
+                             arrays={'power': power}, note='first') == 0
+        assert writer.append(trace(11, level=-50), angle=45.0) == 1
+        with pytest.raises(FileExistsError):
+            SweepDatasetWriter(path)
+    ds = SweepDataset(path)
+    assert len(ds) == 2
+    assert ds.attrs['operator'] == 'test'
+    assert np.array_equal(ds[0], trace(11))
+    assert np.array_equal(ds[1], trace(11, level=-50))
+    assert ds.index['start_pow'][0] == 1e-3 and ds.index['end_pow'][0] == 2e-3
+    assert ds.meta[0]['note'] == 'first' and ds.meta[0]['config'] == [[1500, 1510, 'MID']]
+    assert np.array_equal(ds.aux(0, 'power'), power)
+    assert ds.at_angle(45).tolist() == [1]
+    assert ds.stack().shape == (2, 2, 11)
+
+
+def test_band_slices(tmp_path):
+    path = str(tmp_path / 'run')
+    with SweepDatasetWriter(path) as writer:
+        writer.append(trace(101))
+        writer.append(trace(51))
+    ds = SweepDataset(path)
+    parts = ds.band(1502, 1504)
+    assert [p.shape[1] for p in parts] == [21, 11]
+    assert all(np.all((p[0] >= 1502) & (p[0] <= 1504)) for p in parts)
+    with pytest.raises(ValueError):
+        ds.stack()
+
+
+def test_bands_group_entries(tmp_path):
+    path = str(tmp_path / 'run')
+    with SweepDatasetWriter(path) as writer:
+        writer.append_bands({'1um': trace(11, 1000), '2um': trace(21, 2000)}, angle=0.0,
+                            configs={'1um': 'a', '2um': 'b'})
+        writer.append_bands({'1um': trace(11, 1000), '2um': trace(21, 2000)}, angle=5.0)
+    ds = SweepDataset(path)
+    assert len(ds) == 4
+    bands = ds.bands(3)
+    assert list(bands) == ['1um', '2um'] and bands['2um'].shape == (2, 21)
+    assert ds.band_entries('2um').tolist() == [1, 3]
+    assert ds.meta[1]['config'] == 'b'
+
+
+def test_reopen_and_append(tmp_path):
+    path = str(tmp_path / 'run')
+    with SweepDatasetWriter(path) as writer:
+        writer.append(trace(11))
+    ds = SweepDataset(path)
+    with SweepDatasetWriter(path, append=True) as writer:
+        assert writer.append(trace(11, level=-60)) == 1
+    assert len(ds) == 1
+    ds.refresh()
+    assert len(ds) == 2 and np.array_equal(ds[1], trace(11, level=-60))
+
+
+def test_partial_entry_is_dropped(tmp_path):
+    path = str(tmp_path / 'run')
+    with SweepDatasetWriter(path) as writer:
+        writer.append(trace(11))
+        writer.append(trace(11, level=-60))
+    # A crash in the middle of the index record of the second entry.
+    with open(os.path.join(path, INDEX_FILE), 'r+b') as file:
+        file.truncate(INDEX_DTYPE.itemsize + 5)
+    with SweepDatasetWriter(path, append=True) as writer:
+        assert writer.count == 1
+        assert os.path.getsize(os.path.join(path, TRACE_FILE)) == 8 * 2 * 11
+        assert writer.append(trace(5)) == 1
+    ds = SweepDataset(path)
+    assert len(ds) == 2 and np.array_equal(ds[1], trace(5)) and len(ds.meta) == 2
+
+
+def test_truncate(tmp_path):
+    path = str(tmp_path / 'run')
+    power = np.ones(4)
+    with SweepDatasetWriter(path) as writer:
+        for level in (-40, -50, -60):
+            writer.append(trace(11, level=level), arrays={'power': power})
+        writer.truncate(1)
+        assert writer.count == 1 and writer.aux_offset == power.nbytes
+        assert writer.append(trace(11, level=-70), arrays={'power': 2*power}) == 1
+    ds = SweepDataset(path)
+    assert len(ds) == 2
+    assert np.array_equal(ds[1], trace(11, level=-70))
+    assert np.array_equal(ds.aux(1, 'power'), 2*power)
+
+
+def test_export_dat(tmp_path):
+    path = str(tmp_path / 'run')
+    with SweepDatasetWriter(path) as writer:
+        writer.append(trace(11), 1e-3, 1e-3, angle=10.0, config='cfg')
+    out = tmp_path / 'dat'
+    out.mkdir()
+    paths = SweepDataset(path).export_dat(str(out))
+    assert len(paths) == 1 and os.path.exists(paths[0])
+    with open(paths[0]) as file:
+        assert 'Stage angle [deg]: 10.0' in file.read()
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from AWG_33220A import AWG_33220A
+from SimVISA import SimAWG, SimResourceManager
+from Waveform import choose_npts, repeat_cycles, repeat_period, to_dac, two_tone
+
+
+@pytest.mark.parametrize('freq1, freq2, cycles', [
+    (1000.0, 1500.0, (2, 3)),
+    (1e6, 1.1e6, (10, 11)),
+    (2000.0, 1000.0, (2, 1)),
+])
+def test_repeat_cycles(freq1, freq2, cycles):
+    assert repeat_cycles(freq1, freq2) == cycles
+    assert repeat_period(freq1, freq2) == pytest.approx(cycles[0] / freq1)
+
+
+def test_repeat_cycles_tolerance():
+    # An irrational ratio closes within the tolerance, with fewer cycles for a looser one.
+    n1, n2 = repeat_cycles(1000.0, 1000.0 * np.sqrt(2), tol=1e-6)
+    assert abs(n1 / n2 - 1 / np.sqrt(2)) <= 1e-6 / np.sqrt(2)
+    assert max(repeat_cycles(1000.0, 1000.0 * np.sqrt(2), tol=1e-3)) < max(n1, n2)
+    with pytest.raises(ValueError):
+        repeat_cycles(1000.0, 1000.0 * np.sqrt(2), tol=1e-12, max_cycles=1000)
+    with pytest.raises(ValueError):
+        repeat_cycles(0.0, 1000.0)
+
+
+def test_choose_npts():
+    assert choose_npts(1000.0, 1500.0, 65536) == 65536
+    assert choose_npts(1000.0, 1500.0, 65536, pts_per_cycle=100) == 300
+    assert choose_npts(1000.0, 1001.0, 65536, pts_per_cycle=100) == 65536 # Capped at the memory size.
+
+
+def test_two_tone_is_exactly_periodic():
+    pts, freq = two_tone(1000.0, 1500.0, 600)
+    assert freq == pytest.approx(500.0)
+    t = np.arange(601) / 600
+    expected = 0.5*(np.sin(2*np.pi*2*t) + np.sin(2*np.pi*3*t))
+    assert np.allclose(pts, expected[:600], atol=1e-5)
+    # The point after the last one is the first point of the next period.
+    assert expected[600] == pytest.approx(pts[0], abs=1e-5)
+    assert not pts.flags.writeable
+    assert two_tone(1000.0, 1500.0, 600)[0] is pts
+    with pytest.raises(ValueError):
+        two_tone(1000.0, 1500.0, 5)
+
+
+def test_to_dac():
+    codes = to_dac([-1.0, -0.5, 0.0, 0.5, 1.0, 2.0], -8191, 8191)
+    assert codes.dtype == np.dtype('<i2')
+    assert codes.tolist() == [-8191, -4096, 0, 4096, 8191, 8191]
+    assert to_dac([-1.0, 0.0, 1.0], 0, 16383, '<u2').tolist() == [0, 8192, 16383]
+
+
+def test_load_two_tone_reuses_slots():
+    device = SimAWG(decode=False)
+    awg = AWG_33220A(SimResourceManager({'USB::1::INSTR': device}), 'USB::1::INSTR')
+    uploads = []
+    write_pts = awg.write_pts
+    awg.write_pts = lambda pts, name: uploads.append(name) or write_pts(pts, name)
+    pairs = [(1000.0 * (i + 1), 1500.0 * (i + 1)) for i in range(5)]
+    for pair in pairs[:4]:
+        awg.load_two_tone(*pair, pts_per_cycle=50)
+    assert uploads == ['TWOTONE1', 'TWOTONE2', 'TWOTONE3', 'TWOTONE4']
+    awg.load_two_tone(*pairs[0], pts_per_cycle=50) # Still stored, nothing is uploaded.
+    assert len(uploads) == 4
+    assert device.settings['FUNC:USER'] == 'TWOTONE1'
+    awg.load_two_tone(*pairs[4], pts_per_cycle=50) # Overwrites the least recently used slot.
+    assert uploads[-1] == 'TWOTONE2'